@@ -1,94 +1,40 @@
-from quart import Quart, render_template, request, jsonify,redirect, url_for, send_file, flash, Blueprint
+import time
+
+# Время загрузки модуля для отчёта о запуске
+_IMPORT_STARTED = time.perf_counter()
+
+from quart import Quart, render_template, request, jsonify,redirect, url_for, send_file, flash, Blueprint, Response, g
 from quart_auth import QuartAuth, basic_auth_required
-from docx import Document
-from aiohttp import web
-import aiomysql
-from docx.oxml.ns import qn
-from docx.enum.table import WD_ALIGN_VERTICAL
 from dotenv import load_dotenv
 from datetime import date, datetime
+from urllib.parse import quote
 import asyncio
 import os
-import calendar
-import tempfile
-from io import BytesIO
-from pathlib import Path
-import pandas as pd
-from db_manager import DatabaseManager
+from contextlib import aclosing
+from db_manager import CircuitBreaker, DatabaseManager, DatabaseUnavailable, PoolAutoscaler
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from office_converter import ConversionQueueFull, ConversionScheduler, LibreOfficePool, merge_pdfs
+from render_cache import RenderCache
+from render_executor import RenderExecutor
+from batch_export import BATCH_FAMILIES, BatchExportUnavailable, bundle_zip, month_documents, stream_zip
+from document_builders import PDF_MIMETYPE, build_job_documents, document_job_params
+from render_jobs import RenderJobQueue, RenderJobStore
 import random
 from math import floor
-import openpyxl
 import uuid
-from document_utils import (
-    amount_to_time,
-    clear_document_highlights,
-    clear_workbook_highlights,
-    convert_to_currency_words,
-    create_table,
-    format_date,
-    formatting_text,
-    prepare_workbook_for_pdf,
-    replace_in_tables,
-    replace_table_in_document,
-    replace_text_in_document,
-)
+from document_utils import amount_to_time, convert_amounts_to_words, convert_to_currency_words, format_date
 from sql_utils import build_placeholders, quote_qualified_identifier
+from template_registry import TemplateRegistry
 
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 
 
-async def convert_office_bytes_to_pdf(source_bytes, source_suffix):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_path = Path(temp_dir)
-        source_path = temp_path / f"document{source_suffix}"
-        pdf_path = temp_path / "document.pdf"
-        profile_path = temp_path / "lo-profile"
-        runtime_path = temp_path / "runtime"
-        config_path = temp_path / "config"
-        cache_path = temp_path / "cache"
-        runtime_path.mkdir(mode=0o700)
-        config_path.mkdir()
-        cache_path.mkdir()
-        source_path.write_bytes(source_bytes)
-
-        env = os.environ.copy()
-        env["HOME"] = str(temp_path)
-        env["XDG_RUNTIME_DIR"] = str(runtime_path)
-        env["XDG_CONFIG_HOME"] = str(config_path)
-        env["XDG_CACHE_HOME"] = str(cache_path)
-
-        process = await asyncio.create_subprocess_exec(
-            "soffice",
-            "--headless",
-            f"-env:UserInstallation={profile_path.as_uri()}",
-            "--convert-to",
-            "pdf",
-            "--outdir",
-            str(temp_path),
-            str(source_path),
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            env=env,
-        )
-        stdout, stderr = await process.communicate()
-
-        if process.returncode != 0 or not pdf_path.exists():
-            output = (stderr or stdout).decode("utf-8", errors="replace")
-            raise RuntimeError(f"LibreOffice PDF conversion failed: {output}")
-
-        return pdf_path.read_bytes()
-
-
 class MyApp:
-    replace_text_in_document = staticmethod(replace_text_in_document)
-    replace_in_tables = staticmethod(replace_in_tables)
-    formatting_text = staticmethod(formatting_text)
     convert_to_currency_words = staticmethod(convert_to_currency_words)
+    convert_amounts_to_words = staticmethod(convert_amounts_to_words)
     format_date = staticmethod(format_date)
     amount_to_time = staticmethod(amount_to_time)
-    create_table = staticmethod(create_table)
-    replace_table_in_document = staticmethod(replace_table_in_document)
 
     def __init__(self):
         # Создание экземпляра Quart
@@ -98,37 +44,490 @@ class MyApp:
         self.app.config["QUART_AUTH_BASIC_USERNAME"] = os.getenv('BUSERNAME')
         self.app.config["QUART_AUTH_BASIC_PASSWORD"] = os.getenv('BPASSWD')
 
-        # Настройка подключения к базам данных
+        # Метрики пулов соединений, запросов к базам данных и HTTP-запросов для /metrics
+        self.metrics = MetricsRegistry()
+
+        # Настройка подключения к базам данных. С MYSQL_LOCAL_POOL_MAX пул локальной базы
+        # растёт от MYSQL_LOCAL_POOL_SIZE до этого предела, когда запросы ждут соединения
+        local_pool_max = int(os.getenv('MYSQL_LOCAL_POOL_MAX', 0))
         self.local_db = DatabaseManager(
             host=os.getenv('MYSQL_HOST_LOCAL'),
             user=os.getenv('MYSQL_USER_LOCAL'),
             password=os.getenv('MYSQL_PASSWORD_LOCAL'),
-            db=os.getenv('MYSQL_DB_LOCAL')
+            db=os.getenv('MYSQL_DB_LOCAL'),
+            minsize=int(os.getenv('MYSQL_LOCAL_POOL_MIN', 1)),
+            maxsize=int(os.getenv('MYSQL_LOCAL_POOL_SIZE', 10)),
+            name='local',
+            metrics=self.metrics,
+            autoscaler=PoolAutoscaler(
+                local_pool_max,
+                wait_threshold=float(os.getenv('MYSQL_LOCAL_POOL_WAIT_P95_MS', 50)) / 1000,
+                interval=float(os.getenv('MYSQL_LOCAL_POOL_CHECK_INTERVAL', 10)),
+                cooldown=float(os.getenv('MYSQL_LOCAL_POOL_COOLDOWN', 300))
+            ) if local_pool_max else None
         )
 
+        # Удалённая база Netstat: небольшой постоянный пул с проверкой простаивающих соединений,
+        # быстрым отказом при недоступности сервера и ограничением одновременных запросов к нему
         self.remote_db = DatabaseManager(
             host=os.getenv('MYSQL_HOST_REMOTE'),
             user=os.getenv('MYSQL_USER_REMOTE'),
             password=os.getenv('MYSQL_PASSWORD_REMOTE'),
-            db=os.getenv('MYSQL_DB_REMOTE')
+            db=os.getenv('MYSQL_DB_REMOTE'),
+            minsize=1,
+            maxsize=int(os.getenv('MYSQL_REMOTE_POOL_SIZE', 2)),
+            connect_timeout=float(os.getenv('MYSQL_REMOTE_CONNECT_TIMEOUT', 5)),
+            circuit_breaker=CircuitBreaker(
+                'Netstat',
+                failure_threshold=int(os.getenv('MYSQL_REMOTE_FAILURE_THRESHOLD', 3)),
+                reset_timeout=float(os.getenv('MYSQL_REMOTE_RETRY_AFTER', 5)),
+                max_reset_timeout=float(os.getenv('MYSQL_REMOTE_MAX_RETRY_AFTER', 300))
+            ),
+            max_concurrency=int(os.getenv('MYSQL_REMOTE_CONCURRENCY', 2)),
+            queue_timeout=float(os.getenv('MYSQL_REMOTE_QUEUE_TIMEOUT', 30)),
+            keepalive_interval=float(os.getenv('MYSQL_REMOTE_KEEPALIVE', 60)),
+            name='remote',
+            metrics=self.metrics
+        )
+
+        # Шаблоны документов загружаются в память один раз и перечитываются только при изменении файла
+        self.templates = TemplateRegistry(
+            os.getenv('TEMPLATES_DIR', 'static/docs'),
+            check_interval=float(os.getenv('TEMPLATE_CHECK_INTERVAL', 2))
+        )
+
+        # Документы формируются в пуле процессов, чтобы не блокировать цикл событий
+        self.renderer = RenderExecutor(
+            self.templates,
+            workers=int(os.getenv('RENDER_WORKERS', os.cpu_count() or 1))
+        )
+
+        # Кэш готовых документов и PDF на диске
+        self.render_cache = RenderCache(
+            os.getenv('RENDER_CACHE_DIR', 'cache/renders'),
+            max_bytes=int(os.getenv('RENDER_CACHE_MAX_MB', 512)) * 1024 * 1024
+        )
+
+        # Пул процессов LibreOffice для конвертации документов в PDF
+        self.pdf_converter = LibreOfficePool(
+            size=int(os.getenv('LIBREOFFICE_POOL_SIZE', 2)),
+            max_jobs=int(os.getenv('LIBREOFFICE_MAX_JOBS', 200)),
+            job_timeout=float(os.getenv('LIBREOFFICE_JOB_TIMEOUT', 120)),
+            python_path=os.getenv('LIBREOFFICE_PYTHON', '/usr/bin/python3'),
+            # Каталог в памяти (tmpfs) для профилей и файлов конвертации, по умолчанию /dev/shm
+            work_dir=os.getenv('LIBREOFFICE_WORK_DIR') or None,
+            # Большие пакеты конвертируются частями на всех процессах пула, с таймаутом на каждую часть
+            batch_size=int(os.getenv('LIBREOFFICE_BATCH_SIZE', 10)),
+            batch_timeout=float(os.getenv('LIBREOFFICE_BATCH_TIMEOUT', 300))
+        )
+        # Все конвертации в PDF проходят через очередь с ограничением параллельности
+        self.pdf_scheduler = ConversionScheduler(
+            self.pdf_converter,
+            concurrency=int(os.getenv('PDF_CONCURRENCY', self.pdf_converter.size or 2)),
+            max_queue=int(os.getenv('PDF_QUEUE_SIZE', 20)),
+            queue_timeout=float(os.getenv('PDF_QUEUE_TIMEOUT', 30))
+        )
+        # Сколько документов пакетной выгрузки формируется одновременно
+        self.batch_export_concurrency = int(os.getenv('BATCH_EXPORT_CONCURRENCY', self.renderer.workers or 4))
+
+        # Очередь заданий формирования документов: задания хранятся в SQLite и переживают перезапуск
+        self.render_jobs = RenderJobQueue(
+            RenderJobStore(os.getenv('RENDER_JOBS_DIR', 'cache/jobs')),
+            self.run_render_job,
+            concurrency=int(os.getenv('RENDER_JOBS_CONCURRENCY', 2)),
+            stale_after=float(os.getenv('RENDER_JOBS_STALE_AFTER', 600)),
+            ttl=float(os.getenv('RENDER_JOBS_TTL_HOURS', 24)) * 3600
         )
 
         bp = Blueprint('generate_protocols', __name__)
         # Настройка маршрутов
         self.setup_routes()
         self.setup_lifecycle()
+        self.setup_metrics()
 
     async def __call__(self, scope, receive, send):
         await self.app(scope, receive, send)
 
+    async def render_document(self, job, tags=(), pdf=False):
+        """
+        Готовый документ (или PDF при pdf=True) из кэша либо из пула формирования документов.
+        Теги привязывают запись кэша к акту или договору для инвалидации при их изменении.
+        """
+        template = self.templates.get(job.template)
+        key = self.render_cache.make_key(template.sha256, job, 'pdf' if pdf else 'native')
+        cached = await asyncio.to_thread(self.render_cache.get, key)
+        if cached is not None:
+            return cached
+
+        result = await self.renderer.render(job)
+        if pdf:
+            result = await self.pdf_scheduler.convert(result, os.path.splitext(template.path)[1].lower())
+
+        await asyncio.to_thread(self.render_cache.put, key, result, tags)
+        return result
+
+    async def render_built_document(self, built):
+        return await self.render_document(built.job, tags=built.tags, pdf=built.pdf)
+
+    async def render_documents(self, documents, pdf=False, concurrency=None, return_exceptions=False):
+        """
+        Байты нескольких документов (BuiltDocument) в том же порядке.
+        Документы, которые отдаются в PDF (document.pdf или pdf=True для всех),
+        конвертируются одним пакетным заданием LibreOffice.
+        concurrency ограничивает число одновременно формируемых документов.
+        При return_exceptions=True для документа, который не удалось сформировать
+        или сконвертировать, вместо байтов возвращается исключение.
+        """
+        results = [None] * len(documents)
+        misses = []
+        for index, document in enumerate(documents):
+            as_pdf = pdf or document.pdf
+            template = self.templates.get(document.job.template)
+            key = self.render_cache.make_key(template.sha256, document.job, 'pdf' if as_pdf else 'native')
+            cached = await asyncio.to_thread(self.render_cache.get, key)
+            if cached is not None:
+                results[index] = cached
+            else:
+                suffix = os.path.splitext(template.path)[1].lower() if as_pdf else None
+                misses.append((index, document, key, suffix))
+
+        semaphore = asyncio.Semaphore(concurrency or len(misses) or 1)
+
+        async def render(document):
+            async with semaphore:
+                return await self.renderer.render(document.job)
+
+        rendered = await asyncio.gather(
+            *(render(document) for _, document, _, _ in misses), return_exceptions=return_exceptions
+        )
+
+        to_convert = [
+            position for position, (_, _, _, suffix) in enumerate(misses)
+            if suffix and not isinstance(rendered[position], Exception)
+        ]
+        if to_convert:
+            pdf_documents = await self.pdf_scheduler.convert_many(
+                [(rendered[position], misses[position][3]) for position in to_convert],
+                return_exceptions=return_exceptions
+            )
+            for position, pdf_bytes in zip(to_convert, pdf_documents):
+                rendered[position] = pdf_bytes
+
+        for (index, document, key, _), data in zip(misses, rendered):
+            results[index] = data
+            if not isinstance(data, Exception):
+                await asyncio.to_thread(self.render_cache.put, key, data, document.tags)
+        return results
+
+    async def render_document_files(self, documents, merge=False):
+        """
+        Файлы комплекта документов списком (имя, байты): каждый документ отдельно
+        или, при merge=True, один PDF комплекта.
+        """
+        if merge:
+            pdf_documents = await self.render_documents(documents, pdf=True)
+            merged = await asyncio.to_thread(merge_pdfs, pdf_documents)
+            return [(f"{documents[0].bundle}.pdf", merged)]
+
+        rendered = await self.render_documents(documents)
+        return [(document.file_name, data) for document, data in zip(documents, rendered)]
+
+    async def run_render_job(self, kind, params):
+        """
+        Файл задания формирования (байты, имя файла, mimetype) или None, если данных нет.
+        Комплекты отдаются ZIP-архивом, при format='pdf' - одним объединённым PDF.
+        """
+        built = await build_job_documents(self.local_db, kind, params)
+        if not built:
+            return None
+        if not isinstance(built, list):
+            return await self.render_built_document(built), built.file_name, built.mimetype
+        if params.get('format') == 'pdf':
+            [(file_name, data)] = await self.render_document_files(built, merge=True)
+            return data, file_name, PDF_MIMETYPE
+        return bundle_zip(await self.render_document_files(built)), f"{built[0].bundle}.zip", "application/zip"
+
     def setup_lifecycle(self):
+        @self.app.before_serving
+        async def preload_templates():
+            await asyncio.to_thread(self.templates.preload)
+            await self.renderer.start()
+
+        @self.app.before_serving
+        async def start_pdf_converter():
+            await self.pdf_converter.start()
+
+        @self.app.before_serving
+        async def start_database_pools():
+            # Пулы создаются один раз и живут до остановки приложения
+            await self.local_db.start()
+            await self.remote_db.start()
+
+        @self.app.before_serving
+        async def start_render_jobs():
+            await self.render_jobs.start()
+
+        @self.app.after_serving
+        async def close_render_jobs():
+            # Незавершённые задания возвращаются в очередь до остановки пулов
+            await self.render_jobs.close()
+
         @self.app.after_serving
         async def close_database_pools():
             await self.local_db.close()
             await self.remote_db.close()
 
+        @self.app.after_serving
+        async def close_pdf_converter():
+            await self.pdf_converter.close()
+
+        @self.app.after_serving
+        async def close_renderer():
+            await self.renderer.close()
+
+    def setup_metrics(self):
+        http_requests = self.metrics.counter(
+            "http_requests_total", "HTTP-запросы по маршруту и коду ответа", ("method", "route", "status")
+        )
+        http_duration = self.metrics.histogram(
+            "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route")
+        )
+
+        @self.app.before_request
+        async def start_request_timer():
+            g.request_started = time.perf_counter()
+
+        @self.app.after_request
+        async def observe_request(response):
+            started = g.get('request_started')
+            if started is not None:
+                # Шаблон маршрута, а не путь: /llc_acts/<int:agreement_id>, чтобы id не плодили метки
+                route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+                http_requests.inc(method=request.method, route=route, status=response.status_code)
+                http_duration.observe(time.perf_counter() - started, method=request.method, route=route)
+            return response
+
+        @self.app.route('/metrics', methods=['GET'])
+        @basic_auth_required()
+        async def metrics():
+            return Response(self.metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
     def setup_routes(self):
 
+        @self.app.errorhandler(ConversionQueueFull)
+        async def conversion_queue_full(error):
+            return Response(
+                "Сервис формирования PDF перегружен, попробуйте позже.",
+                status=503,
+                headers={"Retry-After": str(error.retry_after)},
+                mimetype="text/plain"
+            )
+
+        @self.app.errorhandler(DatabaseUnavailable)
+        async def database_unavailable(error):
+            print(f"Запрос отклонён: {error}")
+            return (
+                jsonify({"error": "Удаленная база данных недоступна, попробуйте позже."}),
+                503,
+                {"Retry-After": str(error.retry_after)}
+            )
+
+        @self.app.route('/pdf_queue_stats', methods=['GET'])
+        @basic_auth_required()
+        async def pdf_queue_stats():
+            return jsonify(self.pdf_scheduler.stats())
+
+        @self.app.route('/render_cache_stats', methods=['GET'])
+        @basic_auth_required()
+        async def render_cache_stats():
+            return jsonify(self.render_cache.stats())
+
+        def attachment(data, file_name, mimetype):
+            # Готовые байты уходят в ответ как есть, без промежуточного BytesIO для send_file
+            ascii_name = file_name.encode('ascii', 'replace').decode('ascii').replace('?', '_').replace('"', '_')
+            disposition = f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(file_name, safe='')}"
+            return Response(data, mimetype=mimetype, headers={"Content-Disposition": disposition})
+
+        def job_status(job):
+            status = {
+                "id": job["id"],
+                "kind": job["kind"],
+                "params": job["params"],
+                "state": job["state"],
+                "error": job["error"],
+                "attempts": job["attempts"],
+                "created_at": job["created_at"],
+                "updated_at": job["updated_at"],
+                "status_url": url_for('render_job_status', job_id=job["id"]),
+            }
+            if job["state"] == "done":
+                status.update(
+                    file_name=job["file_name"],
+                    size=job["size"],
+                    download_url=url_for('render_job_download', job_id=job["id"]),
+                )
+            return status
+
+        async def submit_render_job(kind, params):
+            job_id = await self.render_jobs.submit(kind, params)
+            status_url = url_for('render_job_status', job_id=job_id)
+            return jsonify({"id": job_id, "state": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+        def document_bundle_format():
+            # Комплект документов одним архивом, при ?format=pdf - одним объединённым PDF
+            return 'pdf' if request.args.get('format') == 'pdf' else ''
+
+        async def send_render_job(kind, params, not_found_message, allow_async=True):
+            # ?async=1 или заголовок Prefer: respond-async - задание в очередь и сразу ответ 202 с его id,
+            # иначе документ формируется в запросе, как раньше.
+            # Маршруты без авторизации передают allow_async=False: /jobs/<id> требует авторизации,
+            # и анонимный клиент не смог бы получить результат, а только заполнял бы очередь
+            if request.args.get('async') == '1' or 'respond-async' in request.headers.get('Prefer', ''):
+                if not allow_async:
+                    return "Асинхронное формирование доступно только с авторизацией", 403
+                return await submit_render_job(kind, params)
+            result = await self.run_render_job(kind, params)
+            if result is None:
+                return not_found_message, 404
+            return attachment(*result)
+
+        @self.app.route('/jobs', methods=['POST'])
+        @basic_auth_required()
+        async def submit_job():
+            # Тело запроса: {"kind": "llc_act", "params": {"family": "llc", "document": "act", "act_id": 15}}
+            payload = await request.get_json(silent=True) or {}
+            kind = payload.get('kind', '')
+            try:
+                params = document_job_params(kind, payload.get('params') or {})
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return await submit_render_job(kind, params)
+
+        @self.app.route('/jobs/<job_id>', methods=['GET'])
+        @basic_auth_required()
+        async def render_job_status(job_id):
+            # ?wait=N - дождаться завершения задания, но не дольше N секунд (до 60)
+            wait = min(max(request.args.get('wait', 0, type=float), 0), 60)
+            job = await (self.render_jobs.wait(job_id, wait) if wait else self.render_jobs.get(job_id))
+            if job is None:
+                return jsonify({"error": "Задание не найдено"}), 404
+            return jsonify(job_status(job))
+
+        @self.app.route('/jobs/<job_id>/download', methods=['GET'])
+        @basic_auth_required()
+        async def render_job_download(job_id):
+            job = await self.render_jobs.get(job_id)
+            if job is None:
+                return jsonify({"error": "Задание не найдено"}), 404
+            if job["state"] in ("queued", "running"):
+                return jsonify(job_status(job)), 202, {"Retry-After": "2"}
+            if job["state"] == "not_found":
+                return jsonify(job_status(job)), 404
+            if job["state"] == "failed":
+                return jsonify(job_status(job)), 500
+            try:
+                data = await asyncio.to_thread(self.render_jobs.store.read_result, job_id)
+            except FileNotFoundError:
+                return jsonify({"error": "Результат задания удалён"}), 410
+            return attachment(data, job["file_name"], job["mimetype"])
+
+        @self.app.route('/render_jobs_stats', methods=['GET'])
+        @basic_auth_required()
+        async def render_jobs_stats():
+            return jsonify(await asyncio.to_thread(self.render_jobs.store.stats))
+
+        @self.app.route('/batch_export', methods=['GET'])
+        @basic_auth_required()
+        async def batch_export():
+            # Все документы семейства за месяц одним ZIP-архивом: ?month=2025-01&family=fop|llc|kdn-new.
+            # merge=agreement - по одному объединённому PDF на акт или протокол, merge=month - один PDF за месяц
+            family = request.args.get('family', '')
+            merge = request.args.get('merge', '')
+            try:
+                period = datetime.strptime(request.args.get('month', ''), '%Y-%m')
+            except ValueError:
+                return "Укажите месяц в формате ГГГГ-ММ", 400
+            if family not in BATCH_FAMILIES:
+                return f"Неизвестное семейство документов, допустимо: {', '.join(BATCH_FAMILIES)}", 400
+            if merge not in ('', 'agreement', 'month'):
+                return "Параметр merge: agreement или month", 400
+
+            try:
+                builders = await month_documents(self.local_db, family, period.year, period.month)
+            except BatchExportUnavailable as e:
+                # Ошибка до начала ответа: клиент получает сообщение, а не оборванный архив
+                print(e)
+                return str(e), 503
+            if not builders:
+                return "Нет документов за выбранный месяц", 404
+
+            export_name = f"{family}_{period.strftime('%Y-%m')}"
+            if merge == 'month':
+                # Все документы месяца конвертируются частями на процессах пула и объединяются в один PDF.
+                # Документы, которые не удалось сформировать, пропускаются: список - в журнале, число - в заголовке ответа
+                semaphore = asyncio.Semaphore(self.batch_export_concurrency)
+
+                async def build(builder):
+                    async with semaphore:
+                        return await builder()
+
+                built_results = await asyncio.gather(
+                    *(build(builder) for _, builder in builders), return_exceptions=True
+                )
+                labels, documents, errors = [], [], []
+                for (label, _), built in zip(builders, built_results):
+                    if isinstance(built, DatabaseUnavailable):
+                        raise built
+                    if isinstance(built, Exception):
+                        errors.append(f"{label}: {type(built).__name__}: {built}")
+                        continue
+                    if built is None:
+                        errors.append(f"{label}: данные не найдены")
+                        continue
+                    for document in built if isinstance(built, list) else [built]:
+                        labels.append(f"{label}, {document.file_name}")
+                        documents.append(document)
+
+                rendered = await self.render_documents(
+                    documents, pdf=True, concurrency=self.batch_export_concurrency, return_exceptions=True
+                )
+                pdf_documents = []
+                for label, data in zip(labels, rendered):
+                    if isinstance(data, Exception):
+                        errors.append(f"{label}: {type(data).__name__}: {data}")
+                    else:
+                        pdf_documents.append(data)
+
+                if errors:
+                    print(f"Пакетная выгрузка {export_name}: пропущено документов - {len(errors)}")
+                    for error in errors:
+                        print(f"  {error}")
+                if not pdf_documents:
+                    if errors:
+                        return "Не удалось сформировать документы за выбранный месяц:\n" + "\n".join(errors), 500
+                    return "Нет документов за выбранный месяц", 404
+
+                merged = await asyncio.to_thread(merge_pdfs, pdf_documents)
+                response = attachment(merged, f"{export_name}.pdf", "application/pdf")
+                if errors:
+                    # В заголовке только число: полный список есть в журнале, а длинный заголовок
+                    # не пропустит обратный прокси (proxy_buffer_size nginx - 4-8 КБ)
+                    response.headers["X-Skipped-Documents"] = str(len(errors))
+                return response
+
+            async def render_files(documents):
+                return await self.render_document_files(documents, merge=merge == 'agreement')
+
+            archive_name = f"{export_name}.zip"
+            response = Response(
+                stream_zip(builders, render_files, concurrency=self.batch_export_concurrency),
+                mimetype="application/zip",
+                headers={"Content-Disposition": f'attachment; filename="{archive_name}"'}
+            )
+            # Выгрузка за месяц может идти дольше стандартного таймаута ответа
+            response.timeout = None
+            return response
+
         @self.app.route('/check_payments', methods=['GET', 'POST'])
         @basic_auth_required()
         async def check_payments():
@@ -371,355 +770,25 @@ class MyApp:
 
         @self.app.route('/llc_acts/<int:act_id>/generate_report_llc', methods=['POST'])
         async def generate_report_llc(act_id):
-            # SQL-запрос для получения данных по act_id
-            query = """
-                    SELECT act.act_date, 
-                           act.act_sum, 
-                           act.id, 
-                           agr.agreement_name, 
-                           agr.agreement_date, 
-                           llc.name, 
-                           llc.edrpou, 
-                           ri.name, 
-                           ri.iban, 
-                           ri.bank_account_detail, 
-                           ri.address, 
-                           ri.phone, 
-                           ri.inn, 
-                           ri.name_short,
-                           llc.in_persona,
-                           ri.pidstava,
-                           llc.address,
-                           llc.iban,
-                           llc.bank_account_detail,
-                           llc.inn,
-                           llc.name_short
-                    FROM credentials.llc_acts act
-                    JOIN credentials.llc_agreements agr ON act.agreement = agr.id
-                    JOIN credentials.llc_credentials llc ON agr.llc_id = llc.id
-                    JOIN credentials.ri_credentials ri ON agr.ri_id = ri.id
-                    WHERE act.id = %s
-                    """
-            result = await self.local_db.execute_query(query, (act_id,))
-            data = result[0] if result else {}
-
-            # Новый запрос для получения данных из llc_acts_data
-            query_acts_data = """
-                    SELECT sw_rank, model_list, count_devices, ip_list, worktime_float
-                    FROM credentials.llc_acts_data
-                    WHERE act_id = %s
-                    """
-            acts_data_result = await self.local_db.execute_query(query_acts_data, (act_id,))
-
-            # Подготовка данных для замены
-            replacements = {
-                "@act_name": f"R{act_id}_{data[0].strftime('%m/%y')}_{data[3]}",
-                "@act_date": f"«{calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1]}» {self.format_date(data[0])[1]} {self.format_date(data[0])[2]} року",
-                "@ri_name": data[7],
-                "@ri_iban": data[8],
-                "@bank_account_detail_ri": data[9],
-                "@ri_address": data[10],
-                "@ri_phone": data[11],
-                "@ri_inn": data[12],
-                "@llc_name": data[5],
-                "@llc_edrpou": data[6],
-                "@agr_name": data[3],
-                "@agr_date": self.format_date(data[4])[0],
-                "@act_sum": data[1],
-                "@actsumwords": self.convert_to_currency_words(data[1]),  # Конвертация числа в пропись
-                "@ri_shortname": data[13],
-                "@llc_in_persona": data[14],
-                "@ri_pidstava": data[15],
-                "@current_month": self.format_date(data[0])[1],
-                "@current_year": self.format_date(data[0])[2],
-                "@last_day_of_the_month": calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1],
-                "@llc_address": data[16],
-                "@llc_iban": data[17],
-                "@bank_account_detail_llc": data[18],
-                "@llc_inn": data[19],
-                "@llc_shortname": data[20]
-            }
-
-            # Условия для замены значений из acts_data
-            if str(data[6]) == '38736443':  # Если edrpou == 38736443
-                for row in acts_data_result:
-                    if row[0] == 1:  # sw_rank == 1
-                        replacements["@rank1_models"] = row[1]
-                        replacements["@rank1_count"] = row[2]
-                        replacements["@rank1_ips"] = row[3]
-                    elif row[0] == 2:  # sw_rank == 2
-                        replacements["@rank2_models"] = row[1]
-                        replacements["@rank2_count"] = row[2]
-                        replacements["@rank2_ips"] = row[3]
-                    elif row[0] == 0:  # sw_rank == 0
-                        replacements["@time_models"] = row[1]
-                        replacements["@time_count"] = round(row[4], 2)
-                        replacements["@time_ips"] = row[3]
-            else:  # Если edrpou != 38736443
-                for row in acts_data_result:
-                    if row[0] == 4:  # sw_rank == 4
-                        replacements["@rank4_models"] = row[1]
-                        replacements["@rank4_count"] = row[2]
-                        replacements["@rank4_ips"] = row[3]
-                    elif row[0] == 3:  # sw_rank == 3
-                        replacements["@rank3_models"] = row[1]
-                        replacements["@rank3_count"] = row[2]
-                        replacements["@rank3_ips"] = row[3]
-                    elif row[0] == 0:  # sw_rank == 0
-                        replacements["@time_models"] = row[1]
-                        replacements["@time_count"] = round(row[4], 2)
-                        replacements["@time_ips"] = row[3]
-
-            # Проверка `llc_edrpou` и выбор пути к шаблону
-            template_path = 'static/docs/kdn_report.docx' if str(data[6]) == '38736443' else 'static/docs/llc_report.docx'
-
-            # Открываем шаблон документа Word
-            document = Document(template_path)
-
-            # Замена меток на соответствующие значения в тексте документа
-            self.replace_text_in_document(document, replacements)
-            self.replace_in_tables(document.tables, replacements)
-            self.formatting_text(document)
-
-            # Сохраняем измененный файл в памяти
-            output = BytesIO()
-            document.save(output)
-            output.seek(0)
-            docx_name = f'{data[3]}_Звіт_{self.format_date(data[0])[1]}_{self.format_date(data[0])[2]}'
-
-            # Отправляем файл для скачивания
-            return await send_file(output, as_attachment=True, attachment_filename=f"{docx_name}.docx")
+            params = {'family': 'llc', 'document': 'report', 'act_id': act_id}
+            return await send_render_job('llc_act', params, "Акт не найден", allow_async=False)
 
         @self.app.route('/llc_acts/<int:act_id>/generate_act', methods=['POST'])
         async def generate_act(act_id):
-            # SQL-запрос для получения данных по act_id
-            query = """
-            SELECT act.act_date, 
-                   act.act_sum, 
-                   act.id, 
-                   agr.agreement_name, 
-                   agr.agreement_date, 
-                   llc.name, 
-                   llc.edrpou, 
-                   ri.name, 
-                   ri.iban, 
-                   ri.bank_account_detail, 
-                   ri.address, 
-                   ri.phone, 
-                   ri.inn, 
-                   ri.name_short,
-                   llc.in_persona,
-                   ri.pidstava,
-                   llc.address,
-                   llc.iban,
-                   llc.bank_account_detail,
-                   llc.inn,
-                   llc.name_short
-            FROM credentials.llc_acts act
-            JOIN credentials.llc_agreements agr ON act.agreement = agr.id
-            JOIN credentials.llc_credentials llc ON agr.llc_id = llc.id
-            JOIN credentials.ri_credentials ri ON agr.ri_id = ri.id
-            WHERE act.id = %s
-            """
-            result = await self.local_db.execute_query(query, (act_id,))
-            data = result[0] if result else {}
-
-            # Новый запрос для получения данных из llc_acts_data
-            query_acts_data = """
-                    SELECT sw_rank, count_devices, worktime_float
-                    FROM credentials.llc_acts_data
-                    WHERE act_id = %s
-                    """
-            acts_data_result = await self.local_db.execute_query(query_acts_data, (act_id,))
-
-
-            # Подготовка данных для замены
-            replacements = {
-                "@act_name": f"A{act_id}_{data[0].strftime('%m/%y')}_{data[3]}",
-                "@act_date": f"«{calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1]}» {self.format_date(data[0])[1]} {self.format_date(data[0])[2]} року",
-                "@ri_name": data[7],
-                "@ri_iban": data[8],
-                "@bank_account_detail_ri": data[9],
-                "@ri_address": data[10],
-                "@ri_phone": data[11],
-                "@ri_inn": data[12],
-                "@llc_name": data[5],
-                "@llc_edrpou": data[6],
-                "@agr_name": data[3],
-                "@agr_date": self.format_date(data[4])[0],
-                "@act_sum": data[1],
-                "@actsumwords": self.convert_to_currency_words(data[1]),  # Конвертация числа в пропись
-                "@ri_shortname": data[13],
-                "@llc_in_persona": data[14],
-                "@ri_pidstava": data[15],
-                "@current_month": self.format_date(data[0])[1],
-                "@current_year": self.format_date(data[0])[2],
-                "@last_day_of_the_month": calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1],
-                "@llc_address": data[16],
-                "@llc_iban": data[17],
-                "@bank_account_detail_llc": data[18],
-                "@llc_inn": data[19],
-                "@llc_shortname": data[20]
-            }
-
-            # Условия для замены значений из acts_data
-            if str(data[6]) == '38736443':  # Если edrpou == 38736443
-                for row in acts_data_result:
-                    if row[0] == 1:  # sw_rank == 1
-                        replacements["@rank1_count"] = row[1]
-                        replacements["@rank1_sum"] = float(row[1] * 1000)
-                        sum_rank1 = float(row[1] * 1000)
-                    elif row[0] == 2:  # sw_rank == 2
-                        replacements["@rank2_count"] = row[1]
-                        replacements["@rank2_sum"] = float(row[1] * 1000)
-                        sum_rank2 = float(row[1] * 1000)
-                    elif row[0] == 0:  # sw_rank == 0
-                        replacements["@time_count"] = round(row[2], 2)
-                        replacements["@time_sum"] = round(float(data[1]) - sum_rank2 - sum_rank1, 2)
-            else:  # Если edrpou != 38736443
-                for row in acts_data_result:
-                    if row[0] == 4:  # sw_rank == 4
-                        replacements["@rank4_count"] = row[1]
-                        replacements["@rank4_sum"] = float(row[1] * 500)
-                        sum_rank4 = float(row[1] * 500)
-                    elif row[0] == 3:  # sw_rank == 3
-                        replacements["@rank3_count"] = row[1]
-                        replacements["@rank3_sum"] = float(row[1] * 1000)
-                        sum_rank3 = float(row[1] * 1000)
-                    elif row[0] == 0:  # sw_rank == 0
-                        replacements["@time_count"] = round(row[2], 2)
-                        replacements["@time_sum"] = round(float(data[1]) - sum_rank4 - sum_rank3, 2)
-
-
-            # Проверка `llc_edrpou` и выбор пути к шаблону
-            template_path = 'static/docs/kdn_act.docx' if str(data[6]) == '38736443' else 'static/docs/llc_act.docx'
-
-            # Открываем шаблон документа Word
-            document = Document(template_path)
-
-            # Замена меток на соответствующие значения в тексте документа
-            self.replace_text_in_document(document, replacements)
-            self.replace_in_tables(document.tables, replacements)
-            self.formatting_text(document)
-
-            # Сохраняем измененный файл в памяти
-            output = BytesIO()
-            document.save(output)
-            output.seek(0)
-            docx_name = f'{data[3]}_Акт_{self.format_date(data[0])[1]}_{self.format_date(data[0])[2]}'
-
-            # Отправляем файл для скачивания
-            return await send_file(output, as_attachment=True, attachment_filename=f"{docx_name}.docx",
-                                   mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+            params = {'family': 'llc', 'document': 'act', 'act_id': act_id}
+            return await send_render_job('llc_act', params, "Акт не найден", allow_async=False)
 
         @self.app.route('/llc_acts/<int:act_id>/generate_bill', methods=['POST'])
         async def generate_bill(act_id):
-            # SQL-запрос для получения данных по act_id
-            query = """
-            SELECT act.act_date, 
-                   act.act_sum, 
-                   act.id, 
-                   agr.agreement_name, 
-                   agr.agreement_date, 
-                   llc.name, 
-                   llc.edrpou, 
-                   ri.name, 
-                   ri.iban, 
-                   ri.bank_account_detail, 
-                   ri.address, 
-                   ri.phone, 
-                   ri.inn, 
-                   ri.name_short
-            FROM credentials.llc_acts act
-            JOIN credentials.llc_agreements agr ON act.agreement = agr.id
-            JOIN credentials.llc_credentials llc ON agr.llc_id = llc.id
-            JOIN credentials.ri_credentials ri ON agr.ri_id = ri.id
-            WHERE act.id = %s
-            """
-            result = await self.local_db.execute_query(query, (act_id,))
-            data = result[0] if result else {}
-
-            # Новый запрос для получения данных из llc_acts_data
-            query_acts_data = """
-            SELECT sw_rank, count_devices, worktime_float
-            FROM credentials.llc_acts_data
-            WHERE act_id = %s
-            """
-            acts_data_result = await self.local_db.execute_query(query_acts_data, (act_id,))
-
-            # Подготовка переменных для replacement
-            replacements = {
-                "@bill_name": f"B{act_id}_{data[0].strftime('%m/%y')}_{data[3]}",
-                "@bill_date": f"{calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1]} {self.format_date(data[0])[1]} {self.format_date(data[0])[2]} року",
-                "@ri_name": data[7],
-                "@ri_iban": data[8],
-                "@bank_account_detail_ri": data[9],
-                "@ri_address": data[10],
-                "@ri_phone": data[11],
-                "@ri_inn": data[12],
-                "@llc_name": data[5],
-                "@llc_edrpou": data[6],
-                "@agr_name": data[3],
-                "@agr_date": self.format_date(data[4])[0],
-                "@bill_sum": data[1],
-                "@handwritebill_sum": self.convert_to_currency_words(data[1]),  # Конвертация числа в пропись
-                "@ri_shortname": data[13]
-            }
+            params = {'family': 'llc', 'document': 'bill', 'act_id': act_id}
+            return await send_render_job('llc_act', params, "Акт не найден", allow_async=False)
 
-            # Условия для замены значений из acts_data
-            if str(data[6]) == '38736443':  # Если edrpou == 38736443
-                for row in acts_data_result:
-                    if row[0] == 1:  # sw_rank == 1
-                        replacements["@rank1_count"] = row[1]
-                        replacements["@rank1_sum"] = float(row[1] * 1000)
-                        sum_rank1 = float(row[1] * 1000)
-                    elif row[0] == 2:  # sw_rank == 2
-                        replacements["@rank2_count"] = row[1]
-                        replacements["@rank2_sum"] = float(row[1] * 1000)
-                        sum_rank2 = float(row[1] * 1000)
-                    elif row[0] == 0:  # sw_rank == 0
-                        replacements["@time_count"] = round(row[2], 2)
-                        replacements["@time_sum"] = round(float(data[1]) - sum_rank2 - sum_rank1, 2)
-            else:  # Если edrpou != 38736443
-                for row in acts_data_result:
-                    if row[0] == 4:  # sw_rank == 4
-                        replacements["@rank4_count"] = row[1]
-                        replacements["@rank4_sum"] = float(row[1]*500)
-                        sum_rank4 = float(row[1]*500)
-                    elif row[0] == 3:  # sw_rank == 3
-                        replacements["@rank3_count"] = row[1]
-                        replacements["@rank3_sum"] = float(row[1]*1000)
-                        sum_rank3 = float(row[1]*1000)
-                    elif row[0] == 0:  # sw_rank == 0
-                        replacements["@time_count"] = round(row[2],2)
-                        replacements["@time_sum"] = round(float(data[1])-sum_rank4-sum_rank3, 2)
-
-
-
-            # Открываем файл шаблона
-            template_path = 'static/docs/kdn_bill.xlsx' if str(data[6]) == '38736443' else 'static/docs/llc_bill.xlsx'
-            workbook = openpyxl.load_workbook(template_path)
-            sheet = workbook.active
-
-            # Замена меток на соответствующие значения
-            for row in sheet.iter_rows():
-                for cell in row:
-                    if isinstance(cell.value, str):
-                        # Проверяем наличие и заменяем все метки внутри текста ячейки
-                        for key, replacement in replacements.items():
-                            replacement = str(replacement)
-                            if key in cell.value:
-                                cell.value = cell.value.replace(key, replacement)
-
-            # Сохраняем измененный файл в памяти
-            output = BytesIO()
-            workbook.save(output)
-            output.seek(0)
-            xlxs_name = f'{data[3]}_Рахунок_{self.format_date(data[0])[1]}_{self.format_date(data[0])[2]}'
-
-            # Отправляем файл для скачивания
-            return await send_file(output, as_attachment=True, attachment_filename=f"{xlxs_name}.xlsx",
-                                   mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        @self.app.route('/llc_acts/<int:act_id>/bundle', methods=['GET', 'POST'])
+        @basic_auth_required()
+        async def llc_act_bundle(act_id):
+            # Отчёт, акт и счёт по одной загрузке данных акта
+            params = {'family': 'llc', 'act_id': act_id, 'format': document_bundle_format()}
+            return await send_render_job('llc_act_bundle', params, "Акт не найден")
 
         @self.app.route('/llc_acts/<int:agreement_id>/generate_data/<int:act_id>', methods=['POST'])
         # @basic_auth_required()
@@ -763,13 +832,17 @@ class MyApp:
 
             edrpou = edrpou_data[0][0]
 
-            # Шаг 4. Логика в зависимости от edrpou
-            if edrpou == 38736443:
-                # Первая логика
-                await handle_kdn_logic(act_date, act_sum, agreement, ri_id, act_id)
-            else:
-                # Вторая логика
-                await handle_llc_logic(act_sum, llc_id, act_id)
+            # Шаг 4. Логика в зависимости от edrpou; строки данных акта записываются одной транзакцией
+            async with self.local_db.transaction():
+                if edrpou == 38736443:
+                    # Первая логика
+                    await handle_kdn_logic(act_date, act_sum, agreement, ri_id, act_id)
+                else:
+                    # Вторая логика
+                    await handle_llc_logic(act_sum, llc_id, act_id)
+
+            # Данные акта сформированы заново: ранее выданные документы по нему больше не нужны
+            await asyncio.to_thread(self.render_cache.invalidate, f'llc_act:{act_id}')
 
             return redirect(url_for('llc_acts', agreement_id=agreement_id))
 
@@ -1020,263 +1093,20 @@ class MyApp:
         @self.app.route('/llc_acts/<int:agreement_id>/generate_protocol', methods=['GET'])
         @basic_auth_required()
         async def generate_llc_protocol(agreement_id):
-            # Получаем данные по договору и связанные данные для замены в шаблоне
-            agreement_query = """
-            SELECT la.id AS proto_num, la.agreement_name, la.agreement_date, 
-                   lc.name AS llc_name, lc.in_persona, lc.address AS llc_address, lc.edrpou AS llc_edrpou, 
-                   lc.iban AS llc_iban, lc.bank_account_detail AS bank_account_detail_llc, lc.inn AS llc_inn, lc.name_short AS llc_shortname,
-                   ri.name AS ri_name, ri.inn AS ri_inn, ri.pidstava, ri.address AS ri_address, 
-                   ri.iban AS ri_iban, ri.bank_account_detail AS bank_account_detail_ri, ri.name_short AS ri_shortname
-            FROM credentials.llc_agreements AS la
-            JOIN credentials.llc_credentials AS lc ON la.llc_id = lc.id
-            JOIN credentials.ri_credentials AS ri ON la.ri_id = ri.id
-            WHERE la.id = %s;
-            """
-            agreement_data = await self.local_db.execute_query(agreement_query, (agreement_id,))
-
-            # Проверка, что данные по договору найдены
-            if not agreement_data:
-                return "Договор не найден", 404
-
-            # Извлечение данных из результата
-            agreement = agreement_data[0]
-
-            # Проверка ЕДРПОУ организации
-            llc_edrpou = agreement[6]
-            print(llc_edrpou)
-            print(type(llc_edrpou))
-            if llc_edrpou == 38736443:
-                template_path = 'static/docs/KDN_proto.docx'
-            else:
-                # Загружаем шаблон llc_proto.docx
-                template_path = 'static/docs/llc_proto.docx'
-
-            doc = Document(template_path)
-            # Формируем номер протокола
-            proto_num = f"{agreement[0]}_{agreement[2].strftime('%Y-%m-%d')}_{agreement[1]}"
-
-            # Задаем значения для замены
-            replacements = {
-                '@proto_num': proto_num,
-                '@agr_name': agreement[1],
-                '@agr_date': self.format_date(agreement[2])[0],
-                '@llc_name': agreement[3],
-                '@persona': agreement[4],
-                '@ri_name': agreement[11],
-                '@ri_inn': agreement[12],
-                '@pidstava': agreement[13],
-                '@llc_address': agreement[5],
-                '@llc_edrpou': llc_edrpou,
-                '@llc_iban': agreement[7],
-                '@bank_account_detail_llc': agreement[8],
-                '@llc_inn': agreement[9],
-                '@llc_shortname': agreement[10],
-                '@ri_address': agreement[14],
-                '@ri_iban': agreement[15],
-                '@bank_account_detail_ri': agreement[16],
-                '@ri_shortname': agreement[17]
-            }
-
-            # Замена текста в шаблоне
-            self.replace_text_in_document(doc, replacements)
-            self.replace_in_tables(doc.tables, replacements)
-
-            # Сохранение документа
-            doc_io = BytesIO()
-            doc.save(doc_io)
-            doc_io.seek(0)
-
-            # Формируем название файла
-            file_name = f"{agreement[1]} Протокол.docx"
-
-            # Отправка документа клиенту
-            return await send_file(doc_io, as_attachment=True, attachment_filename=file_name)
+            params = {'document': 'protocol', 'agreement_id': agreement_id}
+            return await send_render_job('llc_agreement', params, "Договор не найден")
 
         @self.app.route('/llc_acts/<int:agreement_id>/generate_contract', methods=['GET'])
         @basic_auth_required()
         async def generate_llc_contract(agreement_id):
-            # Получаем данные по договору и связанные данные для замены в шаблоне
-            agreement_query = """
-            SELECT la.id AS contract_num, la.agreement_name, la.agreement_date, 
-                   lc.name AS llc_name, lc.in_persona, lc.address AS llc_address, lc.edrpou AS llc_edrpou, 
-                   lc.iban AS llc_iban, lc.bank_account_detail AS bank_account_detail_llc, lc.inn AS llc_inn, lc.name_short AS llc_shortname,
-                   ri.name AS ri_name, ri.inn AS ri_inn, ri.pidstava, ri.address AS ri_address, 
-                   ri.iban AS ri_iban, ri.bank_account_detail AS bank_account_detail_ri, ri.name_short AS ri_shortname
-            FROM credentials.llc_agreements AS la
-            JOIN credentials.llc_credentials AS lc ON la.llc_id = lc.id
-            JOIN credentials.ri_credentials AS ri ON la.ri_id = ri.id
-            WHERE la.id = %s;
-            """
-            agreement_data = await self.local_db.execute_query(agreement_query, (agreement_id,))
-
-            # Проверяем, что данные по договору найдены
-            if not agreement_data:
-                return "Договор не найден", 404
-
-            # Извлекаем данные из результата
-            agreement = agreement_data[0]
-
-            # Определяем шаблон договора
-            template_path = 'static/docs/llc_contract.docx'
-
-            # Загружаем шаблон
-            doc = Document(template_path)
-
-            # Формируем номер договора
-            contract_num = f"{agreement[0]}_{agreement[2].strftime('%Y-%m-%d')}_{agreement[1]}"
-
-            # Задаем значения для замены
-            replacements = {
-                '@contract_num': contract_num,
-                '@agr_name': agreement[1],
-                '@agr_date': self.format_date(agreement[2])[0],
-                '@llc_name': agreement[3],
-                '@persona': agreement[4],
-                '@ri_name': agreement[11],
-                '@ri_inn': agreement[12],
-                '@pidstava': agreement[13],
-                '@llc_address': agreement[5],
-                '@llc_edrpou': agreement[6],
-                '@llc_iban': agreement[7],
-                '@bank_account_detail_llc': agreement[8],
-                '@llc_inn': agreement[9],
-                '@llc_shortname': agreement[10],
-                '@ri_address': agreement[14],
-                '@ri_iban': agreement[15],
-                '@bank_account_detail_ri': agreement[16],
-                '@ri_shortname': agreement[17]
-            }
-
-            # Замена текста в шаблоне
-            self.replace_text_in_document(doc, replacements)
-            self.replace_in_tables(doc.tables, replacements)
-            self.formatting_text(doc)
-
-            # Сохранение документа
-            doc_io = BytesIO()
-            doc.save(doc_io)
-            doc_io.seek(0)
-
-            # Формируем название файла
-            file_name = f"{agreement[1]}_Договір.docx"
-
-            # Отправка документа клиенту
-            return await send_file(doc_io, as_attachment=True, attachment_filename=file_name)
+            params = {'document': 'contract', 'agreement_id': agreement_id}
+            return await send_render_job('llc_agreement', params, "Договор не найден")
 
         @self.app.route('/llc_acts/<int:agreement_id>/generate_llc_appendix', methods=['GET'])
         @basic_auth_required()
         async def generate_llc_appendix(agreement_id):
-            # Получаем данные по договору
-            agreement_query = """
-            SELECT la.id, la.agreement_name, la.agreement_date, 
-                   lc.name AS llc_name, lc.edrpou AS llc_edrpou, 
-                   lc.address AS llc_address, lc.iban AS llc_iban, lc.bank_account_detail AS bank_account_detail_llc, 
-                   lc.name_short AS llc_shortname, ri.id AS engineer_id, lc.id AS llc_id, lc.in_persona, ri.name, ri.inn,
-                   ri.pidstava, ri.address AS ri_address, ri.iban, ri.bank_account_detail, ri.name_short, lc.inn
-            FROM credentials.llc_agreements AS la
-            JOIN credentials.llc_credentials AS lc ON la.llc_id = lc.id
-            JOIN credentials.ri_credentials AS ri ON la.ri_id = ri.id
-            WHERE la.id = %s;
-            """
-            agreement_data = await self.local_db.execute_query(agreement_query, (agreement_id,))
-            print(agreement_data)
-
-            if not agreement_data:
-                return "Договор не найден", 404
-
-            agreement = agreement_data[0]
-            llc_edrpou = agreement[4]
-
-            # Выбираем запросы в зависимости от ЕДРПОУ
-            if llc_edrpou == 38736443:
-                model_query = """
-                SELECT sw.model, COUNT(DISTINCT sw.ip)
-                FROM dbsyphon.switches_report sw
-                JOIN credentials.engineer_cantons ct ON sw.canton = ct.canton
-                WHERE sw.switch_rank IN (1,2) AND ct.engineer_id = %s
-                GROUP BY 1;
-                """
-                ip_pool_query = """
-                SELECT CONCAT(SUBSTRING_INDEX(sr.ip, '.', 3), '.0/24') AS ip_pool
-                FROM dbsyphon.switches_report sr
-                JOIN credentials.engineer_cantons ct ON sr.canton = ct.canton
-                WHERE sr.switch_rank IN (1,2) AND ct.engineer_id = %s
-                GROUP BY ip_pool;
-                """
-                query_param = agreement[9]  # engineer_id
-            else:
-                model_query = """
-                SELECT sw.model, COUNT(DISTINCT sw.ip)
-                FROM dbsyphon.switches_report sw
-                JOIN credentials.llc_cantons ct ON sw.canton = ct.canton
-                WHERE sw.switch_rank IN (3,4) AND ct.llc_id = %s
-                GROUP BY 1;
-                """
-                ip_pool_query = """
-                SELECT CONCAT(SUBSTRING_INDEX(sr.ip, '.', 3), '.0/24') AS ip_pool
-                FROM dbsyphon.switches_report sr
-                JOIN credentials.llc_cantons ct ON sr.canton = ct.canton
-                WHERE sr.switch_rank IN (3,4) AND ct.llc_id = %s
-                GROUP BY ip_pool;
-                """
-                query_param = agreement[10]  # llc_id
-
-            # Выполняем запросы
-            data_table1 = await self.local_db.execute_query(model_query, (query_param,))
-            data_table2 = await self.local_db.execute_query(ip_pool_query, (query_param,))
-
-            # Загружаем шаблон документа
-            template_path = 'static/docs/llc_appendix.docx'
-            doc = Document(template_path)
-
-            # Форматируем дату договора
-            agreement_date_str, month_ukr_name, year, _ = self.format_date(agreement[2])
-
-            # Заполняем заменяемые поля
-            replacements = {
-                '@agr_num': agreement[0],
-                '@agr_name': agreement[1],
-                '@agr_date': agreement_date_str,
-                '@llc_name': agreement[3],
-                '@persona': agreement[11],
-                '@ri_name': agreement[12],
-                '@ri_inn': agreement[13],
-                '@pidstava': agreement[14],
-                '@ri_address': agreement[15],
-                '@ri_iban': agreement[16],
-                '@llc_inn': agreement[19],
-                '@bank_account_detail_ri': agreement[17],
-                '@ri_shortname': agreement[18],
-                '@llc_edrpou': llc_edrpou,
-                '@llc_address': agreement[5],
-                '@llc_iban': agreement[6],
-                '@bank_account_detail_llc': agreement[7],
-                '@llc_shortname': agreement[8]
-            }
-
-            # Выполняем замену в шаблоне
-            self.replace_text_in_document(doc, replacements)
-            self.replace_in_tables(doc.tables, replacements)
-            self.formatting_text(doc)
-
-            # Создаём таблицы
-            table1 = self.create_table(doc, data_table1, ['Модель обладнання', 'Кількість'])
-            table2 = self.create_table(doc, data_table2, ['Діапазон ІР адрес'])
-
-            # Вставляем таблицы в документ
-            self.replace_table_in_document(doc, '@table1', table1)
-            self.replace_table_in_document(doc, '@table2', table2)
-
-            # Сохраняем документ в память
-            doc_io = BytesIO()
-            doc.save(doc_io)
-            doc_io.seek(0)
-
-            # Формируем название файла
-            file_name = f"{agreement[1]}_Додаток.docx"
-
-            # Отправляем файл клиенту
-            return await send_file(doc_io, as_attachment=True, attachment_filename=file_name)
+            params = {'document': 'appendix', 'agreement_id': agreement_id}
+            return await send_render_job('llc_agreement', params, "Договор не найден")
 
         @self.app.route('/llc_acts/<int:agreement_id>/delete/<int:act_id>', methods=['POST'])
         @basic_auth_required()
@@ -1287,6 +1117,7 @@ class MyApp:
             where id = %s AND agreement = %s
             """
             await self.local_db.execute_query(delete_query, (act_id, agreement_id))
+            await asyncio.to_thread(self.render_cache.invalidate, f'llc_act:{act_id}')
 
             # Перенаправление обратно на страницу актов
             return redirect(url_for('llc_acts', agreement_id=agreement_id))
@@ -1433,46 +1264,6 @@ class MyApp:
 
             return await render_template('kdn_new_acts.html', agreement=agreement, acts=acts, agreement_id=agreement_id)
 
-        async def get_kdn_new_act_document_data(act_id):
-            query = """
-            SELECT act.act_date,
-                   act.act_sum,
-                   act.id,
-                   agr.agreement_name,
-                   agr.agreement_date,
-                   llc.name,
-                   llc.edrpou,
-                   ri.name,
-                   ri.iban,
-                   ri.bank_account_detail,
-                   ri.address,
-                   ri.phone,
-                   ri.inn,
-                   ri.name_short,
-                   llc.in_persona,
-                   ri.pidstava,
-                   llc.address,
-                   llc.iban,
-                   llc.bank_account_detail,
-                   llc.inn,
-                   llc.name_short
-            FROM credentials.llc_acts_new act
-            JOIN credentials.llc_agreements_new agr ON act.agreement = agr.id
-            JOIN credentials.llc_credentials llc ON agr.llc_id = llc.id
-            JOIN credentials.ri_credentials ri ON agr.ri_id = ri.id
-            WHERE act.id = %s
-            """
-            result = await self.local_db.execute_query(query, (act_id,))
-            data = result[0] if result else None
-
-            query_acts_data = """
-            SELECT sw_rank, model_list, count_devices, ip_list, worktime_float
-            FROM credentials.llc_acts_data_new
-            WHERE act_id = %s
-            """
-            acts_data_result = await self.local_db.execute_query(query_acts_data, (act_id,))
-            return data, acts_data_result
-
         @self.app.route('/kdn-new/acts/<int:agreement_id>/generate_data/<int:act_id>', methods=['POST'])
         @basic_auth_required()
         async def generate_kdn_new_act_data(agreement_id, act_id):
@@ -1510,204 +1301,46 @@ class MyApp:
             if not edrpou_data:
                 return "Организация не найдена", 404
 
-            if edrpou_data[0][0] == 38736443:
-                await handle_kdn_logic(
-                    act_date,
-                    act_sum,
-                    agreement,
-                    ri_id,
-                    act_id,
-                    "credentials.llc_acts_data_new",
-                    "credentials.engineer_cantons_new"
-                )
-            else:
-                await handle_llc_logic(act_sum, llc_id, act_id, "credentials.llc_acts_data_new")
+            async with self.local_db.transaction():
+                if edrpou_data[0][0] == 38736443:
+                    await handle_kdn_logic(
+                        act_date,
+                        act_sum,
+                        agreement,
+                        ri_id,
+                        act_id,
+                        "credentials.llc_acts_data_new",
+                        "credentials.engineer_cantons_new"
+                    )
+                else:
+                    await handle_llc_logic(act_sum, llc_id, act_id, "credentials.llc_acts_data_new")
 
+            await asyncio.to_thread(self.render_cache.invalidate, f'kdn_act:{act_id}')
             return redirect(url_for('kdn_new_acts', agreement_id=agreement_id))
 
         @self.app.route('/kdn-new/acts/<int:act_id>/generate_report_llc', methods=['POST'])
         @basic_auth_required()
         async def generate_kdn_new_report_llc(act_id):
-            data, acts_data_result = await get_kdn_new_act_document_data(act_id)
-            if not data:
-                return "Акт не найден", 404
-
-            replacements = {
-                "@act_name": f"R{act_id}_{data[0].strftime('%m/%y')}_{data[3]}",
-                "@act_date": f"«{calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1]}» {self.format_date(data[0])[1]} {self.format_date(data[0])[2]} року",
-                "@ri_name": data[7],
-                "@ri_iban": data[8],
-                "@bank_account_detail_ri": data[9],
-                "@ri_address": data[10],
-                "@ri_phone": data[11],
-                "@ri_inn": data[12],
-                "@llc_name": data[5],
-                "@llc_edrpou": data[6],
-                "@agr_name": data[3],
-                "@agr_date": self.format_date(data[4])[0],
-                "@act_sum": data[1],
-                "@actsumwords": self.convert_to_currency_words(data[1]),
-                "@ri_shortname": data[13],
-                "@llc_in_persona": data[14],
-                "@ri_pidstava": data[15],
-                "@current_month": self.format_date(data[0])[1],
-                "@current_year": self.format_date(data[0])[2],
-                "@last_day_of_the_month": calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1],
-                "@llc_address": data[16],
-                "@llc_iban": data[17],
-                "@bank_account_detail_llc": data[18],
-                "@llc_inn": data[19],
-                "@llc_shortname": data[20]
-            }
-
-            for row in acts_data_result:
-                if row[0] == 1:
-                    replacements["@rank1_models"] = row[1]
-                    replacements["@rank1_count"] = row[2]
-                    replacements["@rank1_ips"] = row[3]
-                elif row[0] == 2:
-                    replacements["@rank2_models"] = row[1]
-                    replacements["@rank2_count"] = row[2]
-                    replacements["@rank2_ips"] = row[3]
-                elif row[0] == 0:
-                    replacements["@time_models"] = row[1]
-                    replacements["@time_count"] = round(row[4], 2)
-                    replacements["@time_ips"] = row[3]
-
-            document = Document('static/docs/kdn_report.docx')
-            self.replace_text_in_document(document, replacements)
-            self.replace_in_tables(document.tables, replacements)
-            self.formatting_text(document)
-            clear_document_highlights(document)
-
-            output = BytesIO()
-            document.save(output)
-            pdf_bytes = await convert_office_bytes_to_pdf(output.getvalue(), ".docx")
-            docx_name = f'{data[3]}_Звіт_{self.format_date(data[0])[1]}_{self.format_date(data[0])[2]}'
-            return await send_file(BytesIO(pdf_bytes), as_attachment=True, attachment_filename=f"{docx_name}.pdf",
-                                   mimetype="application/pdf")
+            params = {'family': 'kdn-new', 'document': 'report', 'act_id': act_id}
+            return await send_render_job('llc_act', params, "Акт не найден")
 
         @self.app.route('/kdn-new/acts/<int:act_id>/generate_act', methods=['POST'])
         @basic_auth_required()
         async def generate_kdn_new_act(act_id):
-            data, acts_data_result = await get_kdn_new_act_document_data(act_id)
-            if not data:
-                return "Акт не найден", 404
-
-            replacements = {
-                "@act_name": f"A{act_id}_{data[0].strftime('%m/%y')}_{data[3]}",
-                "@act_date": f"«{calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1]}» {self.format_date(data[0])[1]} {self.format_date(data[0])[2]} року",
-                "@ri_name": data[7],
-                "@ri_iban": data[8],
-                "@bank_account_detail_ri": data[9],
-                "@ri_address": data[10],
-                "@ri_phone": data[11],
-                "@ri_inn": data[12],
-                "@llc_name": data[5],
-                "@llc_edrpou": data[6],
-                "@agr_name": data[3],
-                "@agr_date": self.format_date(data[4])[0],
-                "@act_sum": data[1],
-                "@actsumwords": self.convert_to_currency_words(data[1]),
-                "@ri_shortname": data[13],
-                "@llc_in_persona": data[14],
-                "@ri_pidstava": data[15],
-                "@current_month": self.format_date(data[0])[1],
-                "@current_year": self.format_date(data[0])[2],
-                "@last_day_of_the_month": calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1],
-                "@llc_address": data[16],
-                "@llc_iban": data[17],
-                "@bank_account_detail_llc": data[18],
-                "@llc_inn": data[19],
-                "@llc_shortname": data[20]
-            }
-            sum_rank1 = 0
-            sum_rank2 = 0
-
-            for row in acts_data_result:
-                if row[0] == 1:
-                    replacements["@rank1_count"] = row[2]
-                    replacements["@rank1_sum"] = float(row[2] * 1000)
-                    sum_rank1 = float(row[2] * 1000)
-                elif row[0] == 2:
-                    replacements["@rank2_count"] = row[2]
-                    replacements["@rank2_sum"] = float(row[2] * 1000)
-                    sum_rank2 = float(row[2] * 1000)
-                elif row[0] == 0:
-                    replacements["@time_count"] = round(row[4], 2)
-                    replacements["@time_sum"] = round(float(data[1]) - sum_rank2 - sum_rank1, 2)
-
-            document = Document('static/docs/kdn_act.docx')
-            self.replace_text_in_document(document, replacements)
-            self.replace_in_tables(document.tables, replacements)
-            self.formatting_text(document)
-            clear_document_highlights(document)
-
-            output = BytesIO()
-            document.save(output)
-            pdf_bytes = await convert_office_bytes_to_pdf(output.getvalue(), ".docx")
-            docx_name = f'{data[3]}_Акт_{self.format_date(data[0])[1]}_{self.format_date(data[0])[2]}'
-            return await send_file(BytesIO(pdf_bytes), as_attachment=True, attachment_filename=f"{docx_name}.pdf",
-                                   mimetype="application/pdf")
+            params = {'family': 'kdn-new', 'document': 'act', 'act_id': act_id}
+            return await send_render_job('llc_act', params, "Акт не найден")
 
         @self.app.route('/kdn-new/acts/<int:act_id>/generate_bill', methods=['POST'])
         @basic_auth_required()
         async def generate_kdn_new_bill(act_id):
-            data, acts_data_result = await get_kdn_new_act_document_data(act_id)
-            if not data:
-                return "Акт не найден", 404
+            params = {'family': 'kdn-new', 'document': 'bill', 'act_id': act_id}
+            return await send_render_job('llc_act', params, "Акт не найден")
 
-            replacements = {
-                "@bill_name": f"B{act_id}_{data[0].strftime('%m/%y')}_{data[3]}",
-                "@bill_date": f"{calendar.monthrange(int(data[0].strftime('%Y')), int(data[0].month))[-1]} {self.format_date(data[0])[1]} {self.format_date(data[0])[2]} року",
-                "@ri_name": data[7],
-                "@ri_iban": data[8],
-                "@bank_account_detail_ri": data[9],
-                "@ri_address": data[10],
-                "@ri_phone": data[11],
-                "@ri_inn": data[12],
-                "@llc_name": data[5],
-                "@llc_edrpou": data[6],
-                "@agr_name": data[3],
-                "@agr_date": self.format_date(data[4])[0],
-                "@bill_sum": data[1],
-                "@handwritebill_sum": self.convert_to_currency_words(data[1]),
-                "@ri_shortname": data[13]
-            }
-            sum_rank1 = 0
-            sum_rank2 = 0
-
-            for row in acts_data_result:
-                if row[0] == 1:
-                    replacements["@rank1_count"] = row[2]
-                    replacements["@rank1_sum"] = float(row[2] * 1000)
-                    sum_rank1 = float(row[2] * 1000)
-                elif row[0] == 2:
-                    replacements["@rank2_count"] = row[2]
-                    replacements["@rank2_sum"] = float(row[2] * 1000)
-                    sum_rank2 = float(row[2] * 1000)
-                elif row[0] == 0:
-                    replacements["@time_count"] = round(row[4], 2)
-                    replacements["@time_sum"] = round(float(data[1]) - sum_rank2 - sum_rank1, 2)
-
-            workbook = openpyxl.load_workbook('static/docs/kdn_bill.xlsx')
-            sheet = workbook.active
-
-            for row in sheet.iter_rows():
-                for cell in row:
-                    if isinstance(cell.value, str):
-                        for key, replacement in replacements.items():
-                            if key in cell.value:
-                                cell.value = cell.value.replace(key, str(replacement))
-            clear_workbook_highlights(workbook)
-            prepare_workbook_for_pdf(workbook)
-
-            output = BytesIO()
-            workbook.save(output)
-            pdf_bytes = await convert_office_bytes_to_pdf(output.getvalue(), ".xlsx")
-            xlxs_name = f'{data[3]}_Рахунок_{self.format_date(data[0])[1]}_{self.format_date(data[0])[2]}'
-            return await send_file(BytesIO(pdf_bytes), as_attachment=True, attachment_filename=f"{xlxs_name}.pdf",
-                                   mimetype="application/pdf")
+        @self.app.route('/kdn-new/acts/<int:act_id>/bundle', methods=['GET', 'POST'])
+        @basic_auth_required()
+        async def kdn_new_act_bundle(act_id):
+            params = {'family': 'kdn-new', 'act_id': act_id, 'format': document_bundle_format()}
+            return await send_render_job('llc_act_bundle', params, "Акт не найден")
 
         @self.app.route('/kdn-new/acts/<int:agreement_id>/delete/<int:act_id>', methods=['POST'])
         @basic_auth_required()
@@ -1718,6 +1351,7 @@ class MyApp:
             WHERE id = %s AND agreement = %s;
             """
             await self.local_db.execute_query(delete_query, (act_id, agreement_id))
+            await asyncio.to_thread(self.render_cache.invalidate, f'kdn_act:{act_id}')
             return redirect(url_for('kdn_new_acts', agreement_id=agreement_id))
 
 
@@ -1977,53 +1611,73 @@ class MyApp:
                 # Выполняем запрос
                 soft_estimates = await self.local_db.execute_query(soft_estimates_query,
                                                                    (protocol_month, protocol_year))
+                if soft_estimates is None:
+                    await flash("Ошибка при генерации протоколов: не удалось прочитать сметы из базы данных.", "error")
+                    return redirect(url_for('estimates_upload'))
                 print("Количество записей для генерации протоколов:", len(soft_estimates))
 
                 if not soft_estimates:
                     await flash("Записей для указанного месяца и года не найдено.", "info")
                     return redirect(url_for('estimates_upload'))
 
+                # Суммы прописью для всех записей месяца одним вызовом
+                amounts = list(dict.fromkeys(record[6] for record in soft_estimates if record[6] is not None))
+                sums_caps = dict(zip(amounts, self.convert_amounts_to_words(amounts)))
+
+                # Договоры по паре (ИНН ФОП, ИНН РИ) одним запросом; при нескольких берётся первый
+                agreement_query = """
+                    SELECT fop.inn, ri.inn, agreements.id
+                    FROM credentials.agreements AS agreements
+                    JOIN credentials.fop_credentials AS fop ON agreements.master_id = fop.id
+                    JOIN credentials.ri_credentials AS ri ON agreements.ri_id = ri.id;
+                """
+                def inn_key(inn):
+                    # ИНН сравниваются как числа, как при сравнении числа со строкой в MySQL ('00032129' = 32129)
+                    text = str(inn).strip()
+                    return int(text) if text.isdigit() else text
+
+                agreements = await self.local_db.execute_query(agreement_query)
+                if agreements is None:
+                    # Без списка договоров все записи ушли бы в protocols_missing_agreements
+                    await flash("Ошибка при генерации протоколов: не удалось прочитать договоры из базы данных.", "error")
+                    return redirect(url_for('estimates_upload'))
+
+                agreements_by_inn = {}
+                for fop_inn, ri_inn, agreement_id in agreements:
+                    agreements_by_inn.setdefault((inn_key(fop_inn), inn_key(ri_inn)), agreement_id)
+
+                protocol_rows = []
+                missing_rows = []
                 for record in soft_estimates:
                     (id, clientId, description, fop_inn, fop_name, fop_in, fop_change,
                      fop_expense, fop_out, type_agr, ri_inn, ri_name, date_of_protocol) = record
 
-                    # Поиск соответствующего договора
-                    agreement_query = """
-                        SELECT agreements.id 
-                        FROM credentials.agreements AS agreements
-                        JOIN credentials.fop_credentials AS fop ON agreements.master_id = fop.id
-                        JOIN credentials.ri_credentials AS ri ON agreements.ri_id = ri.id
-                        WHERE fop.inn = %s AND ri.inn = %s;
-                    """
-                    agreement_result = await self.local_db.execute_query(agreement_query, (fop_inn, ri_inn))
-                    agreement = agreement_result[0][0] if agreement_result else None
-                    print("Договор найден:", agreement)
-
+                    agreement = agreements_by_inn.get((inn_key(fop_inn), inn_key(ri_inn)))
                     if agreement:
-                        # Договор найден, вставляем данные в таблицу protocols
-                        proto_sum_caps = self.convert_to_currency_words(fop_change)
-
-                        insert_protocol_query = """
-                            INSERT INTO credentials.protocols (agreement, proto_date, proto_sum, proto_sum_caps)
-                            VALUES (%s, %s, %s, %s);
-                        """
-                        await self.local_db.execute_query(insert_protocol_query,
-                                                          (agreement, date_of_protocol, fop_change, proto_sum_caps))
-                        print(f"Протокол добавлен для договора {agreement} на сумму {fop_change}")
+                        # Договор найден - протокол
+                        protocol_rows.append((agreement, date_of_protocol, fop_change, sums_caps[fop_change]))
                     else:
-                        # Договор не найден, копируем все данные в protocols_missing_agreements
-                        insert_missing_agreement_query = """
-                            INSERT INTO credentials.protocols_missing_agreements 
-                            (clientId, description, fop_inn, fop_name, fop_in, fop_change, fop_expense, fop_out, 
-                             type_agr, ri_inn, ri_name, date_of_protocol, agreement_state)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-                        """
-                        await self.local_db.execute_query(insert_missing_agreement_query,
-                                                          (clientId, description, fop_inn, fop_name, fop_in, fop_change,
-                                                           fop_expense, fop_out, type_agr, ri_inn, ri_name,
-                                                           date_of_protocol, False))
-                        print(
-                            f"Протокол не добавлен, данные сохранены в таблицу protocols_missing_agreements для клиента {clientId}")
+                        # Договор не найден - данные в protocols_missing_agreements
+                        missing_rows.append((clientId, description, fop_inn, fop_name, fop_in, fop_change,
+                                             fop_expense, fop_out, type_agr, ri_inn, ri_name,
+                                             date_of_protocol, False))
+
+                insert_protocol_query = """
+                    INSERT INTO credentials.protocols (agreement, proto_date, proto_sum, proto_sum_caps)
+                    VALUES (%s, %s, %s, %s);
+                """
+                insert_missing_agreement_query = """
+                    INSERT INTO credentials.protocols_missing_agreements 
+                    (clientId, description, fop_inn, fop_name, fop_in, fop_change, fop_expense, fop_out, 
+                     type_agr, ri_inn, ri_name, date_of_protocol, agreement_state)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+                """
+                async with self.local_db.transaction():
+                    inserted = await self.local_db.execute_many(insert_protocol_query, protocol_rows)
+                    missing = await self.local_db.execute_many(insert_missing_agreement_query, missing_rows)
+                if inserted is None or missing is None:
+                    raise RuntimeError("запись протоколов в базу данных не выполнена")
+                print(f"Протоколов добавлено: {inserted}, без договора: {missing}")
 
                 await flash("Протоколы успешно сгенерированы и сохранены.", "success")
 
@@ -2054,7 +1708,8 @@ class MyApp:
                     await flash("Некорректный формат даты.")
                     return redirect(url_for('estimates_upload'))
 
-                # Чтение данных из XLSX
+                # Чтение данных из XLSX; pandas загружается только для этой страницы
+                import pandas as pd
                 df = pd.read_excel(file)
                 insert_query = """
                     INSERT INTO credentials.soft_estimates (
@@ -2077,9 +1732,9 @@ class MyApp:
 
                 try:
                     # Выполнение вставки
-                    await self.local_db.ensure_connection()
-                    for record in records:
-                        await self.local_db.execute_query(insert_query, record)
+                    inserted = await self.local_db.execute_many(insert_query, records)
+                    if inserted is None:
+                        raise RuntimeError("запись в базу данных не выполнена")
                     await flash("Данные успешно загружены.")
                 except Exception as e:
                     await flash(f"Ошибка при загрузке данных: {e}")
@@ -2102,167 +1757,14 @@ class MyApp:
         @self.app.route('/protocols/<int:agreement_id>/generate_docx/<int:protocol_id>', methods=['GET'])
         @basic_auth_required()
         async def generate_docx(agreement_id,protocol_id):
-            # Получаем информацию по договору и протоколу
-            agreement_query = """
-            SELECT a.agreement_name, a.agreement_date, f.name AS fop_name, f.inn AS inn_fop, f.pidstava AS pidstava_fop, 
-                   f.address AS fop_address, f.iban AS fop_iban, f.bank_account_detail AS bank_account_detail_fop, f.name_short AS fop_name_short,
-                   r.name AS ri_name, r.inn AS inn_ri, r.pidstava AS pidstava_ri, r.address AS ri_address, r.iban AS ri_iban, r.bank_account_detail AS bank_account_detail_ri, r.name_short AS ri_name_short
-            FROM credentials.agreements AS a
-            JOIN credentials.fop_credentials AS f ON a.master_id = f.id
-            JOIN credentials.ri_credentials AS r ON a.ri_id = r.id
-            WHERE a.id = %s;
-            """
-            agreement_data = await self.local_db.execute_query(agreement_query, (agreement_id,))
-            agreement = agreement_data[0]  # Мы получаем первый элемент, чтобы передать данные как строку, а не кортеж.
-
-            protocol_query = """
-                        SELECT proto_date, proto_sum, proto_sum_caps
-                        FROM credentials.protocols
-                        WHERE agreement = %s and id = %s;
-                        """
-            protocol_data = await self.local_db.execute_query(protocol_query, (agreement_id, protocol_id))
-            protocol = protocol_data[0]  # Тоже получаем первый элемент из протоколов
-
-            if not agreement_data or not protocol_data:
-                return "Договор или протокол не найден", 404
-
-            # Преобразуем данные и форматируем дату
-            agreement_date_str, month_ukr_name, year, _ = self.format_date(agreement[1])
-            proto_date_str, proto_month_ukr_name, proto_year, last_day_of_the_month  = self.format_date(protocol[0])
-            template_month = calendar.monthrange(int(protocol[0].strftime("%Y")), int(protocol[0].month))
-            last_day_of_the_month = str(template_month[1])
-
-            # Загрузка шаблона
-            template_path = 'static/docs/M-RI_protocol.docx'
-            doc = Document(template_path)
-
-            # Замена маркеров
-            replacements = {
-                '@agr_num': agreement[0],
-                '@agr_date': agreement_date_str,
-                '@proto_date': proto_date_str,
-                '@fop_name': agreement[2],
-                '@inn_fop': agreement[3],
-                '@pidstava_fop': agreement[4],
-                '@ri_name': agreement[9],
-                '@inn_ri': agreement[10],
-                '@pidstava_ri': agreement[11],
-                '@month_ukr_name': proto_month_ukr_name,
-                '@year': proto_year,
-                '@last_day_of_the_month': last_day_of_the_month,
-                '@agr_sum': f"{protocol[1]:,.2f}",
-                '@agrsum_handwriting_sample': protocol[2],
-                '@fop_address': agreement[5],
-                '@fop_iban': agreement[6],
-                '@bank_account_detail_fop': agreement[7],
-                '@fopname_short': agreement[8],
-                '@ri_address': agreement[12],
-                '@ri_iban': agreement[13],
-                '@bank_account_detail_ri': agreement[14],
-                '@riname_short': agreement[15]
-            }
-
-
-            # Замена текста в шаблоне
-            self.replace_text_in_document(doc, replacements)
-            self.replace_in_tables(doc.tables, replacements)
-            self.formatting_text(doc)
-
-
-            # Сохранение документа в память
-            doc_io = BytesIO()
-            doc.save(doc_io)
-            doc_io.seek(0)
-
-            # Формируем название файла
-            file_name = f"{agreement[0]}_протокол_{proto_month_ukr_name}_{proto_year}.docx"
-
-            # Отправка документа клиенту
-            return await send_file(doc_io, as_attachment=True, attachment_filename=file_name)
+            params = {'document': 'protocol', 'agreement_id': agreement_id, 'protocol_id': protocol_id}
+            return await send_render_job('fop_protocol', params, "Договор или протокол не найден")
 
         @self.app.route('/protocols/<int:agreement_id>/generate_act_docx/<int:protocol_id>', methods=['GET'])
         @basic_auth_required()
         async def generate_act_docx(agreement_id,protocol_id):
-            # Получаем информацию по договору и протоколу
-            agreement_query = """
-            SELECT a.agreement_name, a.agreement_date, f.name AS fop_name, f.inn AS inn_fop, f.pidstava AS pidstava_fop, 
-                   f.address AS fop_address, f.iban AS fop_iban, f.bank_account_detail AS bank_account_detail_fop, f.name_short AS fop_name_short,
-                   r.name AS ri_name, r.inn AS inn_ri, r.pidstava AS pidstava_ri, r.address AS ri_address, r.iban AS ri_iban, r.bank_account_detail AS bank_account_detail_ri, r.name_short AS ri_name_short
-            FROM credentials.agreements AS a
-            JOIN credentials.fop_credentials AS f ON a.master_id = f.id
-            JOIN credentials.ri_credentials AS r ON a.ri_id = r.id
-            WHERE a.id = %s;
-            """
-            agreement_data = await self.local_db.execute_query(agreement_query, (agreement_id,))
-            agreement = agreement_data[0]  # Мы получаем первый элемент, чтобы передать данные как строку, а не кортеж.
-
-            protocol_query = """
-            SELECT proto_date, proto_sum, proto_sum_caps
-            FROM credentials.protocols
-            WHERE agreement = %s and id = %s;
-            """
-            protocol_data = await self.local_db.execute_query(protocol_query, (agreement_id,protocol_id))
-            protocol = protocol_data[0]  # Тоже получаем первый элемент из протоколов
-
-            if not agreement_data or not protocol_data:
-                return "Договор или протокол не найден", 404
-
-            # Преобразуем данные и форматируем дату
-            agreement_date_str, month_ukr_name, year, _ = self.format_date(agreement[1])
-            proto_date_str, proto_month_ukr_name, proto_year, last_day_of_the_month = self.format_date(protocol[0])
-            template_month = calendar.monthrange(int(protocol[0].strftime("%Y")), int(protocol[0].month))
-            last_day_of_the_month = str(template_month[1])
-            act_date = f"{last_day_of_the_month} {proto_month_ukr_name} {proto_year} року "
-            # Загрузка шаблона
-            template_path = 'static/docs/M-RI_act.docx'
-            doc = Document(template_path)
-
-            # Замена маркеров
-            replacements = {
-                '@agr_num': agreement[0],
-                '@agr_date': agreement_date_str,
-                '@proto_date': proto_date_str,
-                '@fop_name': agreement[2],
-                '@inn_fop': agreement[3],
-                '@pidstava_fop': agreement[4],
-                '@ri_name': agreement[9],
-                '@inn_ri': agreement[10],
-                '@pidstava_ri': agreement[11],
-                '@month_ukr_name': proto_month_ukr_name,
-                '@year': proto_year,
-                '@last_day_of_the_month': last_day_of_the_month,
-                '@agr_sum': f"{protocol[1]:,.2f}",
-                '@agrsum_handwriting_sample': protocol[2],
-                '@fop_address': agreement[5],
-                '@fop_iban': agreement[6],
-                '@bank_account_detail_fop': agreement[7],
-                '@fopname_short': agreement[8],
-                '@ri_address': agreement[12],
-                '@ri_iban': agreement[13],
-                '@bank_account_detail_ri': agreement[14],
-                '@riname_short': agreement[15],
-                '@today': act_date,
-                '@act_nubmer': f'{protocol_id}/{agreement[0]}',
-                '@act_hours': self.amount_to_time(float(protocol[1]))
-            }
-
-            # Замена текста в шаблоне
-            print(self.amount_to_time(float(protocol[1])))
-            self.replace_text_in_document(doc, replacements)
-            self.replace_in_tables(doc.tables, replacements)
-            self.formatting_text(doc)
-
-
-            # Сохранение документа в память
-            doc_io = BytesIO()
-            doc.save(doc_io)
-            doc_io.seek(0)
-
-            # Формируем название файла
-            file_name = f"{agreement[0]}_акт_{proto_month_ukr_name}_{proto_year}.docx"
-
-            # Отправка документа клиенту
-            return await send_file(doc_io, as_attachment=True, attachment_filename=file_name)
+            params = {'document': 'act', 'agreement_id': agreement_id, 'protocol_id': protocol_id}
+            return await send_render_job('fop_protocol', params, "Договор или протокол не найден")
 
         @self.app.route('/update_agreement_state/<int:agreement_id>', methods=['POST'])
         @basic_auth_required()
@@ -2279,6 +1781,7 @@ class MyApp:
             WHERE id = %s
             """
             await self.local_db.execute_query(query, (agreement_state, agreement_id))
+            await asyncio.to_thread(self.render_cache.invalidate, f'agreement:{agreement_id}')
             return {"message": "Agreement state updated successfully"}, 200
 
         @self.app.route('/agreement_detail/<int:agreement_id>', methods=['GET', 'POST'])
@@ -2348,6 +1851,7 @@ class MyApp:
                 VALUES (%s, %s)
                 """
                 await self.local_db.execute_query(term_query, (agreement_id, termination_date))
+                await asyncio.to_thread(self.render_cache.invalidate, f'agreement:{agreement_id}')
                 return redirect(url_for('agreement_detail', agreement_id=agreement_id))
 
             return await render_template('agreement_detail.html', agreement=agreement)
@@ -2355,252 +1859,28 @@ class MyApp:
         @self.app.route('/agreement_termination/<int:agreement_id>', methods=['GET'])
         @basic_auth_required()
         async def agreement_termination(agreement_id):
-            # Запрос на получение данных о договоре
-            agreement_query = """
-            SELECT a.agreement_name, a.agreement_date, f.name AS fop_name, f.inn AS inn_fop, f.pidstava AS pidstava_fop, 
-                   f.address AS fop_address, f.iban AS fop_iban, f.bank_account_detail AS bank_account_detail_fop, f.name_short AS fop_name_short,
-                   r.name AS ri_name, r.inn AS inn_ri, r.pidstava AS pidstava_ri, r.address AS ri_address, r.iban AS ri_iban, r.bank_account_detail AS bank_account_detail_ri, r.name_short AS ri_name_short,
-                   a.agreement_state, t.termination_date
-            FROM credentials.agreements AS a
-            JOIN credentials.fop_credentials AS f ON a.master_id = f.id
-            JOIN credentials.ri_credentials AS r ON a.ri_id = r.id
-            JOIN credentials.agreement_termination AS t ON a.id = t.agreement_id
-            WHERE a.id = %s;
-            """
-            agreement_data = await self.local_db.execute_query(agreement_query, (agreement_id,))
-
-            if not agreement_data:
-                return "Договор не найден", 404
-
-            agreement = agreement_data[0]  # Получаем первую запись для передачи данных как строку
-
-            # Преобразуем дату договора
-            agreement_date_str, month_ukr_name, year, _ = self.format_date(agreement[1])
-            termination_date_str, termination_month_ukr, year, _ = self.format_date(agreement[17])
-
-            # Загрузка шаблона расторжения договора
-            template_path = 'static/docs/M-RI_termination.docx'
-            doc = Document(template_path)
-
-            # Подготовка данных для замены
-            replacements = {
-                '@agr_num': agreement[0],
-                '@agr_date': agreement_date_str,
-                '@fop_name': agreement[2],
-                '@inn_fop': agreement[3],
-                '@pidstava_fop': agreement[4],
-                '@ri_name': agreement[9],
-                '@inn_ri': agreement[10],
-                '@pidstava_ri': agreement[11],
-                '@fop_address': agreement[5],
-                '@fop_iban': agreement[6],
-                '@bank_account_detail_fop': agreement[7],
-                '@fopname_short': agreement[8],
-                '@ri_address': agreement[12],
-                '@ri_iban': agreement[13],
-                '@bank_account_detail_ri': agreement[14],
-                '@riname_short': agreement[15],
-                '@agreement_state': 'Активный' if agreement[16] == 1 else 'Неактивный',
-                '@term_date': termination_date_str
-            }
-
-            # Замена текста в шаблоне
-            self.replace_text_in_document(doc, replacements)
-            self.replace_in_tables(doc.tables, replacements)
-            self.formatting_text(doc)
-
-            # Сохранение документа в память
-            doc_io = BytesIO()
-            doc.save(doc_io)
-            doc_io.seek(0)
-
-            # Формируем название файла
-            file_name = f"{agreement[0]}_РАСТОРЖЕНИЕ_ДОГОВОРА.docx"
-
-            # Отправка файла клиенту
-            return await send_file(doc_io, as_attachment=True, attachment_filename=file_name)
+            params = {'document': 'termination', 'agreement_id': agreement_id}
+            return await send_render_job('fop_agreement', params, "Договор не найден")
 
         @self.app.route('/generate_contract/<int:agreement_id>', methods=['GET'])
         @basic_auth_required()
         async def generate_contract(agreement_id):
-            # Запрос на получение данных о договоре
-            agreement_query = """
-            SELECT a.agreement_name, a.agreement_date, f.name AS fop_name, f.inn AS inn_fop, f.pidstava AS pidstava_fop, 
-                   f.address AS fop_address, f.iban AS fop_iban, f.bank_account_detail AS bank_account_detail_fop, f.name_short AS fop_name_short,
-                   r.name AS ri_name, r.inn AS inn_ri, r.pidstava AS pidstava_ri, r.address AS ri_address, r.iban AS ri_iban, r.bank_account_detail AS bank_account_detail_ri, r.name_short AS ri_name_short,
-                   a.agreement_state
-            FROM credentials.agreements AS a
-            JOIN credentials.fop_credentials AS f ON a.master_id = f.id
-            JOIN credentials.ri_credentials AS r ON a.ri_id = r.id
-            WHERE a.id = %s;
-            """
-            agreement_data = await self.local_db.execute_query(agreement_query, (agreement_id,))
-            agreement = agreement_data[0] # Мы получаем первый элемент, чтобы передать данные как строку, а не кортеж.
-
-            if not agreement_data:
-                return "Договор не найден", 404
-
-            # Преобразуем данные и форматируем дату
-            agreement_date_str, month_ukr_name, year, _ = self.format_date(agreement[1])
-
-            # Загрузка шаблона договора
-            template_path = 'static/docs/M-RI_agreement.docx'
-            doc = Document(template_path)
-
-            # Замена маркеров
-            replacements = {
-                '@agr_num': agreement[0],
-                '@agr_date': agreement_date_str,
-                '@fop_name': agreement[2],
-                '@inn_fop': agreement[3],
-                '@pidstava_fop': agreement[4],
-                '@ri_name': agreement[9],
-                '@inn_ri': agreement[10],
-                '@pidstava_ri': agreement[11],
-                '@fop_address': agreement[5],
-                '@fop_iban': agreement[6],
-                '@bank_account_detail_fop': agreement[7],
-                '@fopname_short': agreement[8],
-                '@ri_address': agreement[12],
-                '@ri_iban': agreement[13],
-                '@bank_account_detail_ri': agreement[14],
-                '@riname_short': agreement[15],
-                '@agreement_state': 'Активный' if agreement[16] == 1 else 'Неактивный'  # Активный договор или нет
-            }
-
-            # Замена текста в шаблоне
-            self.replace_text_in_document(doc, replacements)
-            self.replace_in_tables(doc.tables, replacements)
-            self.formatting_text(doc)
-
-            # Сохранение документа в память
-            doc_io = BytesIO()
-            doc.save(doc_io)
-            doc_io.seek(0)
-
-            # Формируем название файла
-            file_name = f"{agreement[0]}_ДОГОВІР.docx"
-
-            # Отправка документа клиенту
-            return await send_file(doc_io, as_attachment=True, attachment_filename=file_name)
+            params = {'document': 'contract', 'agreement_id': agreement_id}
+            return await send_render_job('fop_agreement', params, "Договор не найден")
 
         @self.app.route('/generate_dod1/<int:agreement_id>', methods=['GET'])
         @basic_auth_required()
         async def generate_dod1(agreement_id):
-            # Запросы для получения данных
-            query1 = """
-            SELECT 
-                sr.model, 
-                COUNT(DISTINCT sr.ip) AS ip_count
-            FROM 
-                dbsyphon.switches_report sr
-            JOIN 
-                credentials.fop_territory ft ON sr.vetka = ft.vetka
-            JOIN 
-                credentials.agreements a ON a.master_id = ft.master_id
-            WHERE
-                sr.switch_rank = 4
-            AND
-                a.id = %s
-            GROUP BY 
-                sr.model;
-            """
-
-            query2 = """
-            SELECT 
-                CONCAT(SUBSTRING_INDEX(sr.ip, '.', 3), '.0/24') AS ip_pool
-            FROM 
-                dbsyphon.switches_report sr
-            JOIN 
-                credentials.fop_territory ft ON sr.vetka = ft.vetka
-            JOIN 
-                credentials.agreements a ON a.master_id = ft.master_id
-            WHERE
-                sr.switch_rank = 4
-            AND
-                a.id = %s
-            GROUP BY 
-                ip_pool;
-            """
-
-            # Выполнение запросов и получение данных
-            data_table1 = await self.local_db.execute_query(query1, (agreement_id,))
-            data_table2 = await self.local_db.execute_query(query2, (agreement_id,))
-
-            # Запрос на получение данных о договоре
-            agreement_query = """
-            SELECT a.agreement_name, a.agreement_date, f.name AS fop_name, f.inn AS inn_fop, f.pidstava AS pidstava_fop, 
-                   f.address AS fop_address, f.iban AS fop_iban, f.bank_account_detail AS bank_account_detail_fop, f.name_short AS fop_name_short,
-                   r.name AS ri_name, r.inn AS inn_ri, r.pidstava AS pidstava_ri, r.address AS ri_address, r.iban AS ri_iban, r.bank_account_detail AS bank_account_detail_ri, r.name_short AS ri_name_short,
-                   a.agreement_state
-            FROM credentials.agreements AS a
-            JOIN credentials.fop_credentials AS f ON a.master_id = f.id
-            JOIN credentials.ri_credentials AS r ON a.ri_id = r.id
-            WHERE a.id = %s;
-            """
-            agreement_data = await self.local_db.execute_query(agreement_query, (agreement_id,))
-
-            if not agreement_data:
-                return "Договор не найден", 404
-
-            agreement = agreement_data[0]  # Получаем данные как строку, а не кортеж.
-
-            # Преобразуем данные и форматируем дату
-            agreement_date_str, month_ukr_name, year, _ = self.format_date(agreement[1])
-
-            # Загрузка шаблона договора
-            template_path = 'static/docs/M-RI_dod1.docx'
-            doc = Document(template_path)
-
-            # Замена маркеров в шаблоне
-            replacements = {
-                '@agr_num': agreement[0],
-                '@agr_date': agreement_date_str,
-                '@fop_name': agreement[2],
-                '@inn_fop': agreement[3],
-                '@pidstava_fop': agreement[4],
-                '@ri_name': agreement[9],
-                '@inn_ri': agreement[10],
-                '@pidstava_ri': agreement[11],
-                '@fop_address': agreement[5],
-                '@fop_iban': agreement[6],
-                '@bank_account_detail_fop': agreement[7],
-                '@fopname_short': agreement[8],
-                '@ri_address': agreement[12],
-                '@ri_iban': agreement[13],
-                '@bank_account_detail_ri': agreement[14],
-                '@riname_short': agreement[15],
-                '@agreement_state': 'Активний' if agreement[16] == 1 else 'Неактивний'  # Активный договор или нет
-            }
-
-            # Замена текста в шаблоне
-            self.replace_text_in_document(doc, replacements)
-            self.replace_in_tables(doc.tables, replacements)
-            self.formatting_text(doc)
-
-            # Создание таблицы @table1
-            table1 = self.create_table(doc, data_table1,
-                                       ['Найменування (модель) технічних засобів електронних комунікацій', 'Кількість'])
-
-            # Создание таблицы @table2
-            table2 = self.create_table(doc, data_table2,
-                                       ['Діапазон ІР адрес технічних засобів електронних комунікацій'])
-
-            # Замена маркеров @table1 и @table2 на таблицы
-            self.replace_table_in_document(doc, '@table1', table1)
-            self.replace_table_in_document(doc, '@table2', table2)
-
-            # Сохранение документа в память
-            doc_io = BytesIO()
-            doc.save(doc_io)
-            doc_io.seek(0)
-
-            # Формируем название файла
-            file_name = f"{agreement[0]}_Додаток1.docx"
-
-            # Отправка документа клиенту
-            return await send_file(doc_io, as_attachment=True, attachment_filename=file_name)
+            params = {'document': 'dod1', 'agreement_id': agreement_id}
+            return await send_render_job('fop_agreement', params, "Договор не найден")
 
+        @self.app.route('/agreement_bundle/<int:agreement_id>', methods=['GET'])
+        @basic_auth_required()
+        async def agreement_bundle(agreement_id):
+            # Договор, додаток 1, расторжение (если есть) и, при ?protocol_id=, протокол с актом
+            protocol_id = request.args.get('protocol_id', type=int)
+            params = {'agreement_id': agreement_id, 'protocol_id': protocol_id, 'format': document_bundle_format()}
+            return await send_render_job('fop_agreement_bundle', params, "Договор или протокол не найден")
 
         @self.app.route('/protocols/<int:agreement_id>', methods=['GET', 'POST'])
         @basic_auth_required()
@@ -2672,6 +1952,7 @@ class MyApp:
             WHERE id = %s
             """
             await self.local_db.execute_query(update_query, (protocol_id,))
+            await asyncio.to_thread(self.render_cache.invalidate, f'protocol:{protocol_id}')
 
             # Перезагрузка страницы после удаления
             return redirect(url_for('protocols', agreement_id=agreement_id))
@@ -2828,26 +2109,24 @@ class MyApp:
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             """
 
-            # Вставка данных в базу и получение id новой записи
+            # Вставка данных в базу и получение id новой записи одной транзакцией
             try:
-                # Выполняем вставку данных
-                await self.local_db.execute_query(insert_query, (
-                name, inn, pidstava, address, iban, bank_account_detail, name_short, email))
-
-                # Получаем id последней вставленной записи
-                result = await self.local_db.execute_query("select max(id) from credentials.fop_credentials")
-                master_id = result[0][0]  # Получаем id новой записи
-                print(master_id)
-
-                # Вставка данных в таблицу fop_territory
-                if vetkas:
-                    insert_territory_query = """
-                    INSERT INTO credentials.fop_territory (master_id, canton, vetka)
-                    VALUES (%s, %s, %s)
-                    """
-                    for vetka in vetkas:
-                        print(vetka)
-                        await self.local_db.execute_query(insert_territory_query, (master_id, canton, int(vetka)))
+                async with self.local_db.transaction():
+                    # Выполняем вставку данных; id новой записи - lastrowid того же соединения
+                    master_id = await self.local_db.execute_insert(insert_query, (
+                    name, inn, pidstava, address, iban, bank_account_detail, name_short, email))
+                    print(master_id)
+
+                    # Вставка данных в таблицу fop_territory
+                    if vetkas:
+                        insert_territory_query = """
+                        INSERT INTO credentials.fop_territory (master_id, canton, vetka)
+                        VALUES (%s, %s, %s)
+                        """
+                        print(vetkas)
+                        await self.local_db.execute_many(
+                            insert_territory_query, [(master_id, canton, int(vetka)) for vetka in vetkas]
+                        )
 
                 return jsonify({"message": "Данные успешно добавлены"}), 200
             except Exception as e:
@@ -3013,6 +2292,38 @@ class MyApp:
         # async def index():
         #     return jsonify({"message": "Добро пожаловать в Quart приложение!"})
 
+        async def copy_remote_rows(remote_query, insert_query, params=None):
+            # Перенос результата удалённого запроса в локальную таблицу потоком, частями
+            inserted = 0
+            # aclosing: при ошибке записи чтение прерывается сразу, соединение закрывается, а не дочитывается
+            async with aclosing(self.remote_db.stream(remote_query, params)) as batches:
+                async for batch in batches:
+                    if await self.local_db.execute_many(insert_query, batch) is None:
+                        raise RuntimeError("запись в локальную базу данных не выполнена")
+                    inserted += len(batch)
+            return inserted
+
+        async def insert_new_rows(batch, id_index, table, insert_query, to_params):
+            # Запись части удалённых строк, которых ещё нет в локальной таблице (проверка по id этой части)
+            ids = [row[id_index] for row in batch]
+            existing = await self.local_db.execute_query(
+                f"SELECT id FROM {table} WHERE id IN ({build_placeholders(ids)})", tuple(ids)
+            )
+            if existing is None:
+                raise RuntimeError(f"чтение {table} не выполнено")
+            # Повторы id внутри части (например, ip дважды в mrtg.switches) записываются один раз,
+            # а INSERT IGNORE пропускает строки, добавленные после проверки, вместо ошибки 1062
+            seen = {row[0] for row in existing}
+            new_rows = []
+            for row in batch:
+                if row[id_index] not in seen:
+                    seen.add(row[id_index])
+                    new_rows.append(to_params(row))
+            inserted = await self.local_db.execute_many(insert_query, new_rows, ignore=True)
+            if inserted is None:
+                raise RuntimeError(f"запись в {table} не выполнена")
+            return inserted
+
         @self.app.route('/fetch-logs-and-store', methods=['GET'])
         async def fetch_logs_and_store():
             """
@@ -3020,11 +2331,8 @@ class MyApp:
             для определенных кантонов и сохраняет их в локальной базе данных dbsyphon.ntst_logs,
             пропуская записи с уже существующими идентификаторами.
             """
-            # Подключение к удаленной базе данных
-            try:
-                await self.remote_db.connect()
-            except Exception as e:
-                return jsonify({"error": "Удаленная база данных недоступна, попробуйте позже."}), 503
+            # Проверка доступности удаленной базы данных: при недоступности - ответ 503 без ожидания
+            await self.remote_db.ensure_connection()
 
             # Запрос данных из удаленной базы данных
             remote_query = """
@@ -3036,36 +2344,24 @@ class MyApp:
                 'Лукьяновский', 'Святошинский', 'Бощаговский', 'Теремковский'
             )
             """
-            remote_data = await self.remote_db.execute_query(remote_query)
-
-            # Закрытие соединения с удаленной базой данных
-            await self.remote_db.close()
-
-            if not remote_data:
-                return jsonify({
-                    "message": "Данные успешно получены, но новых данных нет.",
-                    "new_data_count": 0
-                }), 200
-
-            # Вставка данных в локальную базу данных
             insert_query = """
             INSERT INTO dbsyphon.ntst_logs (id, log_date, ip, canton, model, sw_rank)
             VALUES (%s, %s, %s, %s, %s, %s)
             """
-            check_query = "SELECT COUNT(*) FROM dbsyphon.ntst_logs WHERE id = %s"
 
+            # Удалённые строки читаются потоком и записываются частями: память не зависит от размера логов
             new_data_count = 0
-            for record in remote_data:
-                # Проверка наличия записи в локальной базе данных
-                existing_count = await self.local_db.execute_query(check_query, (record[0],))
-
-                # Если запись не существует, выполняем вставку
-                if existing_count[0][0] == 0:
-                    await self.local_db.execute_query(
-                        insert_query,
-                        (record[0], record[1], record[2], record[3], record[4], record[5])
+            async with aclosing(self.remote_db.stream(remote_query)) as batches:
+                async for batch in batches:
+                    new_data_count += await insert_new_rows(
+                        batch, 0, "dbsyphon.ntst_logs", insert_query, lambda record: tuple(record[:6])
                     )
-                    new_data_count += 1
+
+            if not new_data_count:
+                return jsonify({
+                    "message": "Данные успешно получены, но новых данных нет.",
+                    "new_data_count": 0
+                }), 200
 
             return jsonify({
                 "message": "Данные успешно получены и сохранены в локальной базе данных.",
@@ -3079,55 +2375,25 @@ class MyApp:
             Возвращает количество новых записей, которые были добавлены.
             """
             # Проверка доступности удаленной базы данных
-            try:
-                await self.remote_db.connect()
-            except Exception as e:
-                return jsonify({"error": "Удаленная база данных недоступна, попробуйте позже."}), 503
+            await self.remote_db.ensure_connection()
 
             # Получение списка IP-адресов из локальной базы данных
             ip_query = "SELECT ip_address FROM dbsyphon.devices"
             ip_addresses = await self.local_db.execute_query(ip_query)
 
             if not ip_addresses:
-                await self.remote_db.close()
                 return jsonify({"error": "Не удалось получить IP-адреса из локальной базы данных."}), 500
 
             # Формируем список IP-адресов для SQL запроса
             ip_list = [ip[0] for ip in ip_addresses]
 
-            # Получение всех ID из локальной базы данных
-            local_ids_query = "SELECT id FROM ntst_pinger_hosts_log;"
-            local_ids = await self.local_db.execute_query(local_ids_query)
-            local_ids_list = [id[0] for id in local_ids]
-
-            ip_placeholders = build_placeholders(ip_list)
-            remote_params = list(ip_list)
-            id_filter = ""
-            if local_ids_list:
-                id_placeholders = build_placeholders(local_ids_list)
-                id_filter = f"AND hl.id NOT IN ({id_placeholders})"
-                remote_params.extend(local_ids_list)
-
-            # Запрос данных из удаленной базы данных для полученных IP-адресов
+            # Запрос данных из удаленной базы данных для полученных IP-адресов.
+            # Уже сохранённые записи отсеиваются по частям, а не списком всех локальных id в запросе
             remote_query = f"""
             SELECT hl.ip, hl.start, hl.stop, hl.id
             FROM pinger.HostLogs AS hl
-            WHERE hl.ip IN ({ip_placeholders})
-            {id_filter};
+            WHERE hl.ip IN ({build_placeholders(ip_list)});
             """
-            remote_data = await self.remote_db.execute_query(remote_query, tuple(remote_params))
-
-            # Закрытие соединения с удаленной базой данных
-            await self.remote_db.close()
-
-            if not remote_data:
-                return jsonify({
-                    "message": "Данные успешно получены, но новых данных нет.",
-                    "new_data_count": 0
-                }), 200
-
-            # Подсчет количества новых данных
-            new_data_count = len(remote_data)
 
             # Вставка данных в локальную базу данных
             insert_query = """
@@ -3135,11 +2401,19 @@ class MyApp:
             VALUES (%s, %s, %s, %s, TIMESTAMPDIFF(SECOND, %s, %s))
             """
 
-            for record in remote_data:
-                await self.local_db.execute_query(
-                    insert_query,
-                    (record[3], record[0], record[1], record[2], record[1], record[2])
-                )
+            new_data_count = 0
+            async with aclosing(self.remote_db.stream(remote_query, tuple(ip_list))) as batches:
+                async for batch in batches:
+                    new_data_count += await insert_new_rows(
+                        batch, 3, "dbsyphon.ntst_pinger_hosts_log", insert_query,
+                        lambda record: (record[3], record[0], record[1], record[2], record[1], record[2])
+                    )
+
+            if not new_data_count:
+                return jsonify({
+                    "message": "Данные успешно получены, но новых данных нет.",
+                    "new_data_count": 0
+                }), 200
 
             return jsonify({
                 "message": "Данные успешно получены и сохранены в локальной базе данных.",
@@ -3149,6 +2423,9 @@ class MyApp:
         @self.app.route('/bdcom_list', methods=['POST'])
         async def bdcom_list():
             try:
+                # Таблица очищается, только если удаленная база данных доступна
+                await self.remote_db.ensure_connection()
+
                 # Очистка таблицы
                 await self.local_db.execute_query("TRUNCATE TABLE dbsyphon.bdcom_list")
 
@@ -3161,19 +2438,17 @@ class MyApp:
                         'Виноградарский', 'Борщаговский', 'Теремковский', 'Святошинский'
                     ) AND model LIKE 'BDCOM%';
                 """
-                results = await self.remote_db.execute_query(remote_query)
-
-                # Вставка в локальную таблицу
+                # Вставка в локальную таблицу частями по мере чтения из remote_db
                 insert_query = """
                     INSERT INTO dbsyphon.bdcom_list (ntst_id, ip, login, passwd)
                     VALUES (%s, %s, %s, %s);
                 """
-                if results:
-                    for row in results:
-                        await self.local_db.execute_query(insert_query, row)
+                inserted = await copy_remote_rows(remote_query, insert_query)
 
-                return jsonify({"status": "success", "inserted": len(results)}), 200
+                return jsonify({"status": "success", "inserted": inserted}), 200
 
+            except DatabaseUnavailable:
+                raise
             except Exception as e:
                 import traceback
                 traceback.print_exc()
@@ -3213,11 +2488,8 @@ class MyApp:
             Проверяет доступность удаленной базы данных и использует `fetch_info` для отслеживания последней синхронизации.
             """
 
-            # Шаг 1: Проверка доступности удаленной базы данных
-            try:
-                await self.remote_db.connect()
-            except Exception as e:
-                return jsonify({"error": "Удаленная база данных недоступна, попробуйте позже."}), 503
+            # Шаг 1: Проверка доступности удаленной базы данных (недоступна - ответ 503 от обработчика ошибок)
+            await self.remote_db.ensure_connection()
 
             # Шаг 2: Получение времени последней модификации из локальной базы данных
             modification_time_query = """
@@ -3237,7 +2509,6 @@ class MyApp:
                 INSERT INTO dbsyphon.fetch_info (db, db_table, modification_time)
                 VALUES ('dbsyphon', 'switches_report', %s);
                 """
-                await self.local_db.execute_query(insert_fetch_info_query, (current_date,))
 
                 # Выполняем запрос к удаленной базе для получения всех нужных данных
                 remote_query = """
@@ -3251,17 +2522,17 @@ class MyApp:
                                          'DGS-1100-06/ME R3', 
                                          'Датчик дыма');
                 """
-                remote_data = await self.remote_db.execute_query(remote_query)
-
                 # Вставка данных в локальную таблицу `switches_report`
                 insert_switches_report_query = """
                 INSERT INTO dbsyphon.switches_report (canton, model, ip, switch_rank, vetka)
                 VALUES (%s, %s, %s, %s, %s);
                 """
-                for record in remote_data:
-                    await self.local_db.execute_query(insert_switches_report_query, record)
+                # Отметка о синхронизации и данные фиксируются вместе
+                async with self.local_db.transaction():
+                    await self.local_db.execute_query(insert_fetch_info_query, (current_date,))
+                    inserted = await copy_remote_rows(remote_query, insert_switches_report_query)
+                print(f"В switches_report добавлено строк: {inserted}")
 
-                await self.remote_db.close()
                 return jsonify({"message": "Данные успешно получены и добавлены в switches_report."}), 200
 
             # Обработка случая, когда результат есть
@@ -3269,7 +2540,6 @@ class MyApp:
 
             if last_modification_date == current_date:
                 # Вариант 2: Синхронизация уже выполнена сегодня
-                await self.remote_db.close()
                 return jsonify({"message": "Синхронизация уже проводилась сегодня."}), 200
 
             else:
@@ -3295,11 +2565,9 @@ class MyApp:
                 SELECT canton, model, ip, switch_rank, vetka
                 FROM dbsyphon.switches_report;
                 """
-                await self.local_db.execute_query(copy_to_archive_query)
 
                 # Очищаем данные из `switches_report`
                 clear_switches_report_query = "DELETE FROM dbsyphon.switches_report;"
-                await self.local_db.execute_query(clear_switches_report_query)
 
                 # Обновляем запись в `fetch_info` с новой датой синхронизации
                 update_fetch_info_query = """
@@ -3307,7 +2575,6 @@ class MyApp:
                 SET modification_time = %s 
                 WHERE db = 'dbsyphon' AND db_table = 'switches_report';
                 """
-                await self.local_db.execute_query(update_fetch_info_query, (current_date,))
                 insert_switches_report_query = """
                 INSERT INTO dbsyphon.switches_report (canton, model, ip, switch_rank, vetka)
                 VALUES (%s, %s, %s, %s, %s);
@@ -3325,26 +2592,30 @@ class MyApp:
                                          'DGS-1100-06/ME R3', 
                                          'Датчик дыма');
                 """
-                remote_data = await self.remote_db.execute_query(remote_query)
-
-                # Вставка данных в `switches_report` после очистки
-                for record in remote_data:
-                    print(record)
-                    await self.local_db.execute_query(insert_switches_report_query, record)
+                # Архивирование, очистка и вставка новых данных одной транзакцией: при ошибке
+                # switches_report остаётся прежней, а не пустой. CREATE TABLE выполнен до неё,
+                # так как DDL в MySQL неявно фиксирует транзакцию
+                async with self.local_db.transaction():
+                    await self.local_db.execute_query(copy_to_archive_query)
+                    await self.local_db.execute_query(clear_switches_report_query)
+                    await self.local_db.execute_query(update_fetch_info_query, (current_date,))
+                    inserted = await copy_remote_rows(remote_query, insert_switches_report_query)
+                print(f"В switches_report добавлено строк: {inserted}")
 
-                await self.remote_db.close()
                 return jsonify({"message": "Данные успешно обновлены в switches_report."}), 200
 
     def run(self):
         # Запуск приложения на Quart
         self.app.run(debug=True)
 
-app = MyApp()
-asgi_app = app.app
-
+# Единственный экземпляр приложения: его использует и hypercorn (app:asgi_app), и запуск через python app.py.
+# Процессы пула формирования документов (spawn) при запуске через python app.py импортируют
+# этот модуль как __mp_main__ - в них приложение не создаётся
+if __name__ != '__mp_main__':
+    app = MyApp()
+    asgi_app = app.app
+    print(f"Приложение загружено за {time.perf_counter() - _IMPORT_STARTED:.2f} с")
 
 
 if __name__ == '__main__':
-    app = MyApp()
     app.run()
-    # asgi_app.run()
@@ -0,0 +1,216 @@
+import asyncio
+import calendar
+import re
+import zipfile
+from datetime import date
+from functools import partial
+from io import BytesIO
+
+from document_builders import KDN_EDRPOU, build_fop_agreement_documents, build_llc_act_documents
+
+
+# Семейства документов пакетной выгрузки за месяц
+BATCH_FAMILIES = ("fop", "llc", "kdn-new")
+
+_UNSAFE_NAME_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+class BatchExportUnavailable(RuntimeError):
+    """
+    Список документов за месяц не получен: запрос к базе данных завершился ошибкой.
+    """
+
+
+def _month_bounds(year, month):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _check_rows(rows, family, year, month):
+    # execute_query возвращает None при ошибке: пустой архив выглядел бы как месяц без документов
+    if rows is None:
+        raise BatchExportUnavailable(
+            f"Не удалось получить список документов {family} за {month:02d}.{year} из базы данных"
+        )
+
+
+async def month_documents(db, family, year, month):
+    """
+    Документы семейства за месяц по всем активным договорам: список пар (описание, функция).
+    Функция без аргументов загружает данные акта или протокола один раз и возвращает
+    список BuiltDocument всех его документов либо None.
+    Если список актов или протоколов не удалось прочитать, BatchExportUnavailable.
+    """
+    first_day, last_day = _month_bounds(year, month)
+    builders = []
+
+    if family == "fop":
+        query = """
+        SELECT p.agreement, p.id
+        FROM credentials.protocols p
+        JOIN credentials.agreements a ON p.agreement = a.id
+        WHERE p.proto_state = 1 AND a.agreement_state = 1
+          AND p.proto_date BETWEEN %s AND %s
+        ORDER BY a.agreement_name, p.id;
+        """
+        rows = await db.execute_query(query, (first_day, last_day))
+        _check_rows(rows, family, year, month)
+        for agreement_id, protocol_id in rows:
+            builders.append((
+                f"договор {agreement_id}, протокол {protocol_id}",
+                partial(build_fop_agreement_documents, db, agreement_id, (), protocol_id),
+            ))
+
+    elif family == "llc":
+        query = """
+        SELECT act.id
+        FROM credentials.llc_acts act
+        JOIN credentials.llc_agreements agr ON act.agreement = agr.id
+        WHERE act.act_state = 1 AND agr.agreement_state = 1
+          AND act.act_date BETWEEN %s AND %s
+        ORDER BY agr.agreement_name, act.id;
+        """
+        rows = await db.execute_query(query, (first_day, last_day))
+        _check_rows(rows, family, year, month)
+        for (act_id,) in rows:
+            builders.append((f"акт {act_id}", partial(build_llc_act_documents, db, "llc", act_id)))
+
+    elif family == "kdn-new":
+        query = """
+        SELECT act.id
+        FROM credentials.llc_acts_new act
+        JOIN credentials.llc_agreements_new agr ON act.agreement = agr.id
+        JOIN credentials.llc_credentials llc ON agr.llc_id = llc.id
+        WHERE act.act_state = 1 AND agr.agreement_state = 1 AND llc.edrpou = %s
+          AND act.act_date BETWEEN %s AND %s
+        ORDER BY agr.agreement_name, act.id;
+        """
+        rows = await db.execute_query(query, (KDN_EDRPOU, first_day, last_day))
+        _check_rows(rows, family, year, month)
+        for (act_id,) in rows:
+            builders.append((f"акт {act_id}", partial(build_llc_act_documents, db, "kdn-new", act_id)))
+
+    else:
+        raise ValueError(f"Неизвестное семейство документов: {family}")
+
+    return builders
+
+
+class _ZipChunks:
+    """
+    Файловый объект только для записи: zipfile пишет в него архив,
+    а генератор забирает накопленные байты после каждого документа.
+    Без seek/tell zipfile пишет размеры в дескрипторах данных после содержимого.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _entry_name(file_name, used_names):
+    name = _UNSAFE_NAME_CHARS.sub("_", file_name).strip() or "document"
+    if name not in used_names:
+        used_names.add(name)
+        return name
+
+    stem, dot, extension = name.rpartition(".")
+    if not dot:
+        stem, extension = name, ""
+    number = 2
+    while True:
+        candidate = f"{stem} ({number}){dot}{extension}"
+        if candidate not in used_names:
+            used_names.add(candidate)
+            return candidate
+        number += 1
+
+
+def bundle_zip(files):
+    """
+    ZIP-архив из готовых файлов одного акта или договора: список (имя, байты).
+    """
+    output = BytesIO()
+    used_names = set()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as archive:
+        for file_name, data in files:
+            archive.writestr(_entry_name(file_name, used_names), data)
+    return output.getvalue()
+
+
+async def stream_zip(builders, render, concurrency=4):
+    """
+    Асинхронный генератор ZIP-архива. Документы формируются параллельно
+    (не больше concurrency актов или протоколов одновременно) и попадают в архив по мере готовности,
+    поэтому первые байты уходят клиенту до окончания всей выгрузки.
+
+    builders - список пар (описание, функция), как их возвращает month_documents;
+    функция возвращает BuiltDocument, список BuiltDocument или None.
+    render(documents) - корутина, возвращающая файлы документов одного акта
+    или протокола списком (имя, байты). Ошибки отдельных
+    документов не прерывают выгрузку: их список записывается в конец архива в errors.txt.
+    Документы сжаты форматами DOCX/XLSX/PDF, поэтому хранятся без повторного сжатия.
+    """
+    pending = asyncio.Queue()
+    for label, builder in builders:
+        pending.put_nowait((label, builder))
+
+    # Ограниченная очередь готовых документов: если клиент читает медленно,
+    # исполнители ждут, а не накапливают документы в памяти
+    results = asyncio.Queue(maxsize=max(1, concurrency))
+
+    async def worker():
+        while True:
+            try:
+                label, builder = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                built = await builder()
+                if built is None:
+                    await results.put((label, None, "данные не найдены"))
+                    continue
+                documents = built if isinstance(built, list) else [built]
+                await results.put((label, await render(documents), None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                await results.put((label, None, f"{type(error).__name__}: {error}"))
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(builders))))]
+    buffer = _ZipChunks()
+    used_names = set()
+    errors = []
+
+    try:
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+            for _ in range(len(builders)):
+                label, files, error = await results.get()
+                if error is not None:
+                    errors.append(f"{label}: {error}")
+                    continue
+                for file_name, data in files:
+                    archive.writestr(_entry_name(file_name, used_names), data)
+                chunk = buffer.drain()
+                if chunk:
+                    yield chunk
+
+            if errors:
+                print(f"Пакетная выгрузка: не сформированы документы для {len(errors)} позиций")
+                archive.writestr("errors.txt", "\n".join(errors) + "\n")
+        yield buffer.drain()
+    finally:
+        # Клиент отключился или выгрузка завершена: останавливаем оставшиеся задачи
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -1,20 +1,374 @@
+import asyncio
+import collections
+import math
+import random
+import re
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from contextvars import ContextVar
+
 import aiomysql
 from aiomysql import Error as AiomysqlError, OperationalError, InterfaceError
 
+from sql_utils import quote_identifier
+
+
+# INSERT/REPLACE ... VALUES (<строка>) [ON DUPLICATE KEY UPDATE ...]; строка может содержать
+# выражения, например TIMESTAMPDIFF(SECOND, %s, %s), поэтому курсор aiomysql её не склеивает
+_INSERT_VALUES_RE = re.compile(
+    r"^\s*((?:INSERT|REPLACE)\b.*?\bVALUES?\s*)(\(.*?\))(\s*ON\s+DUPLICATE\s+KEY\s+UPDATE\b.*?)?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL
+)
+
+
+# Коды ошибок MySQL, после которых соединение непригодно: не удалось подключиться, сервер
+# недоступен или разорвал соединение, соединение закрыто сервером (KILL, простой, остановка)
+_CONNECTION_ERRORS = frozenset((1053, 1927, 2002, 2003, 2006, 2013, 2055, 4031))
+# Ошибки, после которых запрос можно повторить на том же соединении: ожидание блокировки, взаимоблокировка
+_TRANSIENT_ERRORS = frozenset((1205, 1213))
+
+_IDEMPOTENT_WRITE_RE = re.compile(r"^\s*(?:INSERT\s+IGNORE|REPLACE)\b|\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.IGNORECASE)
+
+
+# Первая таблица запроса: SELECT ... FROM t, INSERT INTO t, UPDATE t, DELETE FROM t, TRUNCATE TABLE t
+_QUERY_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+([`\w.]+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def _query_tag(query):
+    """
+    Метка запроса для метрик: вид запроса и первая таблица, например "select credentials.llc_acts".
+    Числа в имени таблицы заменяются на N (архивные таблицы с датой дают одну метку).
+    """
+    words = query.split(None, 1)
+    if not words:
+        return "empty"
+    match = _QUERY_TABLE_RE.search(query)
+    if match is None:
+        return words[0].lower()
+    table = re.sub(r"\d+", "N", match.group(1).replace("`", "").lower())
+    return f"{words[0].lower()} {table}"
+
 
 def _query_returns_rows(query):
     return query.strip().upper().startswith(("SELECT", "SHOW", "DESCRIBE", "EXPLAIN"))
 
 
+def _query_is_idempotent(query):
+    """
+    Повтор запроса не меняет результат: чтение, INSERT IGNORE, REPLACE, ON DUPLICATE KEY UPDATE.
+    Обычный INSERT/UPDATE/DELETE мог выполниться до обрыва соединения, поэтому не повторяется.
+    """
+    return _query_returns_rows(query) or _IDEMPOTENT_WRITE_RE.search(query) is not None
+
+
+def _is_connection_error(error):
+    return isinstance(error, InterfaceError) or (bool(error.args) and error.args[0] in _CONNECTION_ERRORS)
+
+
+def _is_retryable_error(error):
+    return _is_connection_error(error) or (bool(error.args) and error.args[0] in _TRANSIENT_ERRORS)
+
+
+def _insert_ignore(query):
+    """
+    INSERT ... -> INSERT IGNORE ...; для других запросов IGNORE не применим.
+    """
+    if not re.match(r"^\s*INSERT\b", query, re.IGNORECASE):
+        raise ValueError("ignore допустим только для INSERT")
+    return re.sub(r"^\s*INSERT\s+(?!IGNORE\b)", "INSERT IGNORE ", query, count=1, flags=re.IGNORECASE)
+
+
+def _bulk_statement(query, update_columns=None):
+    """
+    Запрос для execute_many: (начало, шаблон строки, окончание) для многострочного INSERT
+    или None, если запрос не вида INSERT ... VALUES (...).
+    """
+    match = _INSERT_VALUES_RE.match(query)
+    if match is None:
+        if update_columns:
+            raise ValueError("update_columns допустим только для INSERT ... VALUES (...)")
+        return None
+
+    prefix, row, postfix = match.group(1), match.group(2), match.group(3) or ""
+    if update_columns:
+        if postfix:
+            raise ValueError("Запрос уже содержит ON DUPLICATE KEY UPDATE")
+        assignments = ", ".join(
+            f"{quote_identifier(column)} = VALUES({quote_identifier(column)})" for column in update_columns
+        )
+        postfix = f" ON DUPLICATE KEY UPDATE {assignments}"
+    return prefix, row, postfix
+
+
+async def _execute_chunk(cursor, query, statement, chunk):
+    if statement is None:
+        await cursor.executemany(query, chunk)
+    else:
+        prefix, row, postfix = statement
+        await cursor.execute(
+            prefix + ", ".join([row] * len(chunk)) + postfix,
+            [value for values in chunk for value in values]
+        )
+    return max(cursor.rowcount, 0)
+
+
+class DatabaseUnavailable(RuntimeError):
+    """
+    База данных недоступна (открыт CircuitBreaker) или перегружена (истекло ожидание слота).
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Быстрый отказ при недоступном сервере базы данных: после failure_threshold ошибок
+    соединения подряд запросы отклоняются сразу (DatabaseUnavailable), без ожидания таймаутов.
+    Через reset_timeout секунд пропускается один пробный запрос: успех закрывает breaker,
+    ошибка снова открывает его с удвоенным интервалом, но не больше max_reset_timeout.
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=5.0, max_reset_timeout=300.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.open_timeout = reset_timeout
+        self._probe_started = None
+        self.rejected = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() < self.opened_at + self.open_timeout:
+            return "open"
+        return "half_open"
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 1
+        return max(1, math.ceil(self.opened_at + self.open_timeout - time.monotonic()))
+
+    def check(self):
+        """
+        Допуск запроса: исключение DatabaseUnavailable, пока breaker открыт. В полуоткрытом
+        состоянии допускается один пробный запрос; если он не завершился за open_timeout
+        (задача отменена), допускается следующий.
+        """
+        if self.opened_at is None:
+            return
+        now = time.monotonic()
+        probing = self._probe_started is not None and now - self._probe_started < self.open_timeout
+        if now < self.opened_at + self.open_timeout or probing:
+            self.rejected += 1
+            raise DatabaseUnavailable(f"База данных {self.name} недоступна", self.retry_after())
+        self._probe_started = now
+
+    def record_success(self):
+        if self.opened_at is not None:
+            print(f"Соединение с базой данных {self.name} восстановлено")
+        self.failures = 0
+        self.opened_at = None
+        self.open_timeout = self.reset_timeout
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        now = time.monotonic()
+        if self.opened_at is not None:
+            # Неудачная проба: следующая - через удвоенный интервал
+            if self._probe_started is not None:
+                self.open_timeout = min(self.open_timeout * 2, self.max_reset_timeout)
+                self.opened_at = now
+                self._probe_started = None
+        elif self.failures >= self.failure_threshold:
+            self.opened_at = now
+            print(f"База данных {self.name} недоступна, запросы отклоняются {self.open_timeout:.0f} с")
+
+
+def _pool_supports_resize(pool):
+    """
+    Проверка внутренних атрибутов aiomysql.Pool, на которые опираются _set_pool_maxsize
+    и _close_idle_connections. Они не входят в публичный API и проверены только
+    для версии aiomysql из requirements.txt (aiomysql==0.2.0): при обновлении aiomysql
+    эту проверку и обе функции нужно пересмотреть.
+    """
+    free = getattr(pool, "_free", None)
+    return (
+        isinstance(free, collections.deque) and free.maxlen is not None
+        and isinstance(getattr(pool, "_cond", None), asyncio.Condition)
+        and isinstance(getattr(pool, "_used", None), set)
+        and all(hasattr(pool, name) for name in ("size", "maxsize", "closed"))
+        and all(hasattr(connection, "last_usage") and hasattr(connection, "ensure_closed") for connection in free)
+    )
+
+
+async def _set_pool_maxsize(pool, maxsize):
+    # У aiomysql.Pool нет изменения размера: предел - maxlen очереди свободных соединений _free,
+    # а задачи, ожидающие соединения, ждут на условии _cond и после оповещения создают новые
+    pool._free = collections.deque(pool._free, maxlen=maxsize)
+    async with pool._cond:
+        pool._cond.notify_all()
+
+
+async def _close_idle_connections(pool, minsize, idle_for):
+    now = asyncio.get_running_loop().time()
+    closed = 0
+    for connection in list(pool._free):
+        if pool.size <= minsize:
+            break
+        if now - connection.last_usage >= idle_for:
+            pool._free.remove(connection)
+            await connection.ensure_closed()
+            closed += 1
+    return closed
+
+
+class PoolAutoscaler:
+    """
+    Адаптивный размер пула по времени ожидания соединения. Раз в interval секунд:
+    если 95-й процентиль ожидания за период не меньше wait_threshold, maxsize пула
+    увеличивается на step (не больше max_size); если ожиданий нет дольше cooldown,
+    закрываются соединения, простаивающие дольше cooldown (остаётся не меньше minsize),
+    а maxsize уменьшается на step до исходного maxsize DatabaseManager.
+    Каждое решение об изменении пула пишется в лог.
+    """
+
+    def __init__(self, max_size, wait_threshold=0.05, interval=10.0, cooldown=300.0, step=2):
+        self.max_size = max_size
+        self.wait_threshold = wait_threshold
+        self.interval = interval
+        self.cooldown = cooldown
+        self.step = max(1, step)
+        self._waits = collections.deque(maxlen=4096)
+        self._last_pressure = time.monotonic()
+        self._last_resize = time.monotonic()
+        self._at_limit = False
+        self.resizes = 0
+
+    def record_wait(self, seconds):
+        self._waits.append(seconds)
+
+    def _p95(self):
+        waits = sorted(self._waits)
+        self._waits.clear()
+        if not waits:
+            return 0.0, 0
+        return waits[math.ceil(len(waits) * 0.95) - 1], len(waits)
+
+    async def adjust(self, pool, minsize, base_maxsize, name):
+        p95, count = self._p95()
+        now = time.monotonic()
+        current = pool.maxsize
+
+        if p95 >= self.wait_threshold:
+            self._last_pressure = now
+            if current >= self.max_size:
+                if not self._at_limit:
+                    self._at_limit = True
+                    print(f"Пул {name}: p95 ожидания соединения {p95 * 1000:.0f} мс, "
+                          f"maxsize уже на пределе {self.max_size}")
+                return
+            new = min(self.max_size, current + self.step)
+            await _set_pool_maxsize(pool, new)
+            self._last_resize = now
+            self.resizes += 1
+            print(f"Пул {name}: p95 ожидания соединения {p95 * 1000:.0f} мс за {count} запросов, "
+                  f"maxsize {current} -> {new}")
+            return
+
+        self._at_limit = False
+        if now - self._last_pressure < self.cooldown:
+            return
+
+        closed = await _close_idle_connections(pool, minsize, self.cooldown)
+        if closed:
+            print(f"Пул {name}: закрыто простаивающих соединений: {closed}, открыто {pool.size}")
+
+        if current > base_maxsize and now - self._last_resize >= self.cooldown:
+            # Предел не опускается ниже числа открытых соединений: иначе очередь _free
+            # молча вытеснит возвращаемые соединения, не закрыв их
+            new = max(base_maxsize, current - self.step, pool.size)
+            if new < current:
+                await _set_pool_maxsize(pool, new)
+                self._last_resize = now
+                self.resizes += 1
+                print(f"Пул {name}: ожиданий нет {self.cooldown:.0f} с, maxsize {current} -> {new}")
+
+
 class DatabaseManager:
-    def __init__(self, host, user, password, db=None, minsize=1, maxsize=10):
+    # Строк в одном многострочном INSERT по умолчанию
+    chunk_size = 1000
+    # Повторы идемпотентных запросов после ошибки соединения: пауза - случайная доля
+    # от retry_backoff * 2^попытка (не больше retry_backoff_max), чтобы повторы не совпадали
+    max_retries = 2
+    retry_backoff = 0.1
+    retry_backoff_max = 2.0
+
+    def __init__(self, host, user, password, db=None, minsize=1, maxsize=10, pool_recycle=3600,
+                 connect_timeout=None, circuit_breaker=None, max_concurrency=None, queue_timeout=30.0,
+                 keepalive_interval=None, name=None, metrics=None, autoscaler=None):
+        """
+        circuit_breaker - CircuitBreaker для быстрого отказа: с ним ошибки соединения
+        передаются вызывающему как DatabaseUnavailable, а не возвращаются как None.
+        max_concurrency - не больше стольких одновременных операций (запрос, пакетная
+        запись, поток чтения, блок connection()); ожидание слота не дольше queue_timeout.
+        keepalive_interval - период проверки простаивающих соединений после start().
+        metrics - MetricsRegistry для метрик пула и запросов с меткой db=name.
+        autoscaler - PoolAutoscaler: maxsize становится нижней границей, размер пула меняется после start().
+        """
         self.host = host
         self.user = user
         self.password = password
         self.db = db
         self.minsize = minsize
         self.maxsize = maxsize
+        self.pool_recycle = pool_recycle
+        self.connect_timeout = connect_timeout
+        self.circuit_breaker = circuit_breaker
+        self.queue_timeout = queue_timeout
+        self.keepalive_interval = keepalive_interval
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.autoscaler = autoscaler
+        self._tasks = []
         self.pool = None
+        # Счётчики восстановления после ошибок
+        self.retries = 0
+        self.evicted_connections = 0
+        self.failed_operations = 0
+        self.acquire_waiting = 0
+        self.name = name or db or host
+        self.metrics = metrics
+        if metrics is not None:
+            self._acquire_seconds = metrics.histogram(
+                "db_pool_acquire_wait_seconds", "Ожидание соединения из пула", ("db",)
+            )
+            self._query_seconds = metrics.histogram(
+                "db_query_duration_seconds", "Время выполнения запроса по метке запроса", ("db", "tag")
+            )
+            self._query_errors = metrics.counter(
+                "db_query_errors_total", "Ошибки запросов по метке запроса и типу ошибки", ("db", "tag", "error")
+            )
+            self._pool_connections = metrics.gauge(
+                "db_pool_connections", "Соединения пула: открытые, занятые, свободные, максимум, ожидающие",
+                ("db", "state")
+            )
+            self._recovery_total = metrics.counter(
+                "db_recovery_events_total", "Повторы запросов, закрытые после ошибки соединения, неудачные операции",
+                ("db", "event")
+            )
+            self._circuit_open = metrics.gauge("db_circuit_open", "Circuit breaker открыт (1) или закрыт (0)", ("db",))
+            metrics.add_collector(self._collect_metrics)
+        # Соединение, закреплённое за текущей задачей блоком connection()/transaction():
+        # (соединение, открыта ли транзакция) или None
+        self._bound = ContextVar(f"db_connection_{id(self)}", default=None)
 
     async def connect(self):
         """
@@ -22,6 +376,8 @@ class DatabaseManager:
         """
         if self.pool and not self.pool.closed:
             return
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.check()
 
         try:
             self.pool = await aiomysql.create_pool(
@@ -32,17 +388,25 @@ class DatabaseManager:
                 minsize=self.minsize,
                 maxsize=self.maxsize,
                 autocommit=True,
-                pool_recycle=3600,
+                pool_recycle=self.pool_recycle,
+                connect_timeout=self.connect_timeout,
             )
             print(f"Успешно создан пул подключений к базе данных {self.db} на {self.host}.")
-        except AiomysqlError as e:
+            self._connection_ok()
+        except (AiomysqlError, OSError) as e:
             print(f"Ошибка подключения к базе данных: {e}")
             self.pool = None
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_failure()
 
     async def close(self):
         """
-        Закрытие пула подключений к базе данных.
+        Закрытие пула подключений к базе данных и остановка проверки соединений.
         """
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
         if self.pool and not self.pool.closed:
             self.pool.close()
             await self.pool.wait_closed()
@@ -52,44 +416,493 @@ class DatabaseManager:
     async def ensure_connection(self):
         """
         Убедитесь, что пул подключений активен, иначе создайте его.
+        С circuit_breaker недоступность базы данных - исключение DatabaseUnavailable.
         """
         if self.pool is None or self.pool.closed:
             await self.connect()
+        elif self.circuit_breaker is not None:
+            self.circuit_breaker.check()
+        if not self.pool and self.circuit_breaker is not None:
+            raise DatabaseUnavailable(
+                f"Нет подключения к базе данных {self.db} на {self.host}", self.circuit_breaker.retry_after()
+            )
+
+    def _connection_ok(self):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_success()
 
-    async def _execute(self, query, params=None, return_lastrowid=False, retry=True):
+    def _connection_failed(self, error):
+        """
+        Учёт ошибки соединения; с circuit_breaker она передаётся вызывающему как DatabaseUnavailable.
+        """
+        self.failed_operations += 1
+        if self.circuit_breaker is None or not _is_connection_error(error):
+            return
+        self.circuit_breaker.record_failure()
+        raise DatabaseUnavailable(
+            f"Ошибка соединения с базой данных {self.db} на {self.host}: {error}", self.circuit_breaker.retry_after()
+        ) from error
+
+    def _evict(self, connection, error):
+        """
+        Закрытие соединения после ошибки соединения: пул не вернёт его в оборот при освобождении,
+        остальные соединения, в том числе занятые другими запросами, не затрагиваются.
+        """
+        if _is_connection_error(error):
+            connection.close()
+            self.evicted_connections += 1
+
+    async def _retry_pause(self, attempt, error):
+        self.retries += 1
+        delay = random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt))
+        print(f"Ошибка соединения с базой данных {self.db}: {error}. Повтор {attempt} через {delay:.2f} с")
+        await asyncio.sleep(delay)
+        # Пул мог быть закрыт, а circuit_breaker - открыться, пока шла пауза
         await self.ensure_connection()
-        if not self.pool:
-            return None
+        return bool(self.pool)
 
+    @staticmethod
+    async def _prepare_retry(connection, attempt):
+        # Перед повтором соединение проверяется и при необходимости переподключается на месте
+        if attempt:
+            await connection.ping()
+
+    def _collect_metrics(self):
+        stats = self.stats()
+        for state in ("size", "used", "free", "maxsize", "waiting"):
+            self._pool_connections.set(stats[state], db=self.name, state=state)
+        for event in ("retries", "evicted_connections", "failed_operations"):
+            self._recovery_total.set_total(stats[event], db=self.name, event=event)
+        self._circuit_open.set(int(stats["circuit"] not in (None, "closed")), db=self.name)
+
+    def _observe_query(self, tag, seconds, error=None):
+        if self.metrics is None:
+            return
+        self._query_seconds.observe(seconds, db=self.name, tag=tag)
+        if error is not None:
+            self._query_errors.inc(db=self.name, tag=tag, error=type(error).__name__)
+
+    @contextmanager
+    def _timed(self, tag):
+        """
+        Учёт времени и ошибок запроса с меткой tag в метриках.
+        """
+        started = time.perf_counter()
         try:
-            async with self.pool.acquire() as connection:
-                async with connection.cursor() as cursor:
-                    await cursor.execute(query, params)
-                    if not _query_returns_rows(query):
-                        await connection.commit()
-                    if return_lastrowid:
-                        return cursor.lastrowid
-                    return await cursor.fetchall()
-        except (OperationalError, InterfaceError) as e:
-            if retry:
-                print(f"Потеря соединения: {e}. Повторная попытка...")
-                await self.close()
-                await self.connect()
-                return await self._execute(query, params, return_lastrowid, retry=False)
-            print(f"Повторная попытка не удалась: {e}")
-            return None
+            yield
         except AiomysqlError as e:
-            print(f"Ошибка выполнения запроса: {e}")
+            self._observe_query(tag, time.perf_counter() - started, e)
+            raise
+        else:
+            self._observe_query(tag, time.perf_counter() - started)
+
+    @asynccontextmanager
+    async def _acquire(self):
+        """
+        Соединение из пула с учётом времени ожидания.
+        """
+        started = time.perf_counter()
+        self.acquire_waiting += 1
+        try:
+            connection = await self.pool.acquire()
+        finally:
+            self.acquire_waiting -= 1
+        waited = time.perf_counter() - started
+        if self.metrics is not None:
+            self._acquire_seconds.observe(waited, db=self.name)
+        if self.autoscaler is not None:
+            self.autoscaler.record_wait(waited)
+        try:
+            yield connection
+        finally:
+            self.pool.release(connection)
+
+    def stats(self):
+        pool = self.pool
+        return {
+            "size": pool.size if pool else 0,
+            "used": pool.size - pool.freesize if pool else 0,
+            "free": pool.freesize if pool else 0,
+            "maxsize": pool.maxsize if pool else self.maxsize,
+            "waiting": self.acquire_waiting,
+            "retries": self.retries,
+            "evicted_connections": self.evicted_connections,
+            "failed_operations": self.failed_operations,
+            "circuit": self.circuit_breaker.state if self.circuit_breaker is not None else None,
+        }
+
+    @asynccontextmanager
+    async def _slot(self):
+        """
+        Слот одновременной операции (max_concurrency), ожидание не дольше queue_timeout.
+        """
+        if self._slots is None:
+            yield
+            return
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise DatabaseUnavailable(
+                f"База данных {self.db} на {self.host} перегружена", max(1, math.ceil(self.queue_timeout))
+            ) from None
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def start(self):
+        """
+        Создание пула заранее и запуск фоновой проверки соединений (keepalive_interval): простаивающие
+        соединения проверяются ping, а при недоступной базе пул создаётся заново с отсрочкой
+        circuit_breaker. С autoscaler запускается и подстройка размера пула.
+        Ошибка подключения при старте не останавливает приложение.
+        """
+        try:
+            await self.ensure_connection()
+        except DatabaseUnavailable as e:
+            print(e)
+        if self._tasks:
+            return
+        if self.keepalive_interval:
+            self._tasks.append(asyncio.create_task(self._keepalive()))
+        if self.autoscaler is not None and self._autoscaler_supported():
+            self._tasks.append(asyncio.create_task(self._autoscale()))
+
+    def _autoscaler_supported(self):
+        """
+        Проверка пула перед изменением его размера. Если у aiomysql.Pool нет ожидаемых
+        внутренних атрибутов (другая версия aiomysql), подстройка отключается, а пул
+        продолжает работать с постоянным maxsize.
+        """
+        if not self.pool or _pool_supports_resize(self.pool):
+            return True
+        print(f"Подстройка размера пула {self.name} отключена: aiomysql {aiomysql.__version__} "
+              f"не поддерживается, ожидается версия из requirements.txt")
+        self.autoscaler = None
+        return False
+
+    async def _autoscale(self):
+        while True:
+            await asyncio.sleep(self.autoscaler.interval)
+            if not self.pool or self.pool.closed:
+                continue
+            # Пул мог быть создан после start() или пересоздан после недоступности базы
+            if not self._autoscaler_supported():
+                return
+            try:
+                await self.autoscaler.adjust(self.pool, self.minsize, self.maxsize, self.name)
+            except Exception as e:
+                print(f"Ошибка изменения размера пула {self.name}: {e}")
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            try:
+                await self.ensure_connection()
+                await self._ping_idle()
+            except DatabaseUnavailable:
+                continue
+            except Exception as e:
+                print(f"Ошибка проверки соединений с базой данных {self.db}: {e}")
+
+    async def _ping_idle(self):
+        if not self.pool:
+            return
+        # Свободные соединения забираются из пула все сразу, чтобы проверить каждое
+        connections = []
+        try:
+            for _ in range(self.pool.freesize):
+                connections.append(await self.pool.acquire())
+            for connection in connections:
+                try:
+                    await connection.ping(False)
+                except AiomysqlError as e:
+                    # Закрытое соединение пул не вернёт в оборот при освобождении
+                    connection.close()
+                    self.evicted_connections += 1
+                    if self.circuit_breaker is not None:
+                        self.circuit_breaker.record_failure()
+                    print(f"Соединение с базой данных {self.db} не отвечает: {e}")
+                else:
+                    self._connection_ok()
+        finally:
+            for connection in connections:
+                self.pool.release(connection)
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Одно соединение из пула на блок кода: все запросы execute_query/execute_insert/execute_many
+        этого DatabaseManager внутри блока (в той же задаче asyncio) выполняются через него,
+        без получения соединения из пула на каждый запрос. Вложенный блок использует то же соединение.
+
+        Ошибки запросов внутри блока не перехватываются и не повторяются после переподключения:
+        соединение нельзя подменить посреди блока, поэтому исключение передаётся вызывающему.
+        """
+        bound = self._bound.get()
+        if bound is not None:
+            yield bound[0]
+            return
+
+        await self.ensure_connection()
+        if not self.pool:
+            raise InterfaceError(f"Нет подключения к базе данных {self.db} на {self.host}")
+
+        async with self._slot():
+            async with self._acquire() as connection:
+                token = self._bound.set((connection, False))
+                try:
+                    yield connection
+                except (OperationalError, InterfaceError) as e:
+                    self._evict(connection, e)
+                    if self.circuit_breaker is not None and _is_connection_error(e):
+                        self.circuit_breaker.record_failure()
+                    raise
+                finally:
+                    self._bound.reset(token)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Транзакция на закреплённом соединении (см. connection()): запросы внутри блока
+        фиксируются одним COMMIT при выходе из блока или откатываются целиком при исключении.
+        Вложенный блок transaction() становится частью внешней транзакции.
+
+        DDL (CREATE/ALTER/DROP TABLE) в MySQL неявно фиксирует транзакцию, поэтому такие
+        запросы выполняются до блока.
+        """
+        bound = self._bound.get()
+        if bound is not None and bound[1]:
+            yield bound[0]
+            return
+
+        async with self.connection() as connection:
+            token = self._bound.set((connection, True))
+            try:
+                await connection.begin()
+                yield connection
+            except BaseException:
+                try:
+                    await connection.rollback()
+                except AiomysqlError as e:
+                    print(f"Ошибка отката транзакции: {e}")
+                raise
+            else:
+                await connection.commit()
+            finally:
+                self._bound.reset(token)
+
+    async def _run(self, connection, query, params, return_lastrowid, commit, tag):
+        with self._timed(tag):
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, params)
+                if commit and not _query_returns_rows(query):
+                    await connection.commit()
+                if return_lastrowid:
+                    return cursor.lastrowid
+                return await cursor.fetchall()
+
+    async def _execute(self, query, params=None, return_lastrowid=False, tag=None):
+        tag = tag or _query_tag(query)
+        bound = self._bound.get()
+        if bound is not None:
+            connection, in_transaction = bound
+            return await self._run(connection, query, params, return_lastrowid, not in_transaction, tag)
+
+        await self.ensure_connection()
+        if not self.pool:
             return None
 
-    async def execute_insert(self, query, params=None):
+        retries = self.max_retries if _query_is_idempotent(query) else 0
+        attempt = 0
+        while True:
+            try:
+                async with self._slot():
+                    async with self._acquire() as connection:
+                        try:
+                            await self._prepare_retry(connection, attempt)
+                            result = await self._run(connection, query, params, return_lastrowid, True, tag)
+                        except (OperationalError, InterfaceError) as e:
+                            self._evict(connection, e)
+                            raise
+                self._connection_ok()
+                return result
+            except (OperationalError, InterfaceError) as e:
+                if attempt >= retries or not _is_retryable_error(e):
+                    print(f"Ошибка выполнения запроса: {e}")
+                    self._connection_failed(e)
+                    return None
+                attempt += 1
+                if not await self._retry_pause(attempt, e):
+                    return None
+            except AiomysqlError as e:
+                print(f"Ошибка выполнения запроса: {e}")
+                return None
+
+    async def execute_insert(self, query, params=None, tag=None):
         """
         Выполнение SQL-запроса INSERT и возврат ID вставленной записи.
         """
-        return await self._execute(query, params, return_lastrowid=True)
+        return await self._execute(query, params, return_lastrowid=True, tag=tag)
 
-    async def execute_query(self, query, params=None):
+    async def execute_query(self, query, params=None, tag=None):
         """
         Выполнение SQL запроса и возврат результата с проверкой состояния соединения.
+        tag - метка запроса в метриках, по умолчанию вид запроса и первая таблица.
+        """
+        return await self._execute(query, params, tag=tag)
+
+    async def execute_many(self, query, rows, chunk_size=None, ignore=False, update_columns=None, retry=True,
+                           tag=None):
         """
-        return await self._execute(query, params)
+        Выполнение запроса для множества строк параметров за одно получение соединения из пула.
+
+        INSERT/REPLACE ... VALUES (...) отправляется многострочными INSERT по chunk_size строк,
+        остальные запросы - через cursor.executemany теми же частями. ignore=True превращает
+        INSERT в INSERT IGNORE (для других запросов - ValueError), update_columns добавляет
+        ON DUPLICATE KEY UPDATE col = VALUES(col).
+
+        Возвращает число затронутых строк (сумму rowcount; для ON DUPLICATE KEY UPDATE MySQL считает
+        обновлённую строку за две) или None при ошибке. Части, выполненные до ошибки, остаются в базе;
+        для идемпотентного запроса (INSERT IGNORE, REPLACE, ON DUPLICATE KEY UPDATE) после ошибки
+        соединения выполнение продолжается с прерванной части, retry=False отключает повторы.
+        Внутри transaction() все части входят в транзакцию, а ошибка передаётся вызывающему.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+
+        # IGNORE добавляется в сам запрос: он нужен и многострочному INSERT, и executemany
+        if ignore:
+            query = _insert_ignore(query)
+        statement = _bulk_statement(query, update_columns)
+        tag = tag or _query_tag(query)
+        chunk_size = max(1, chunk_size or self.chunk_size)
+        chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+
+        bound = self._bound.get()
+        if bound is not None:
+            connection, in_transaction = bound
+            affected = 0
+            with self._timed(tag):
+                async with connection.cursor() as cursor:
+                    for chunk in chunks:
+                        affected += await _execute_chunk(cursor, query, statement, chunk)
+                        if not in_transaction:
+                            await connection.commit()
+            return affected
+
+        await self.ensure_connection()
+        if not self.pool:
+            return None
+
+        query_text = query if statement is None else statement[0] + statement[2]
+        retries = self.max_retries if retry and _query_is_idempotent(query_text) else 0
+        attempt = 0
+        affected = 0
+        done = 0
+        while done < len(chunks):
+            try:
+                async with self._slot():
+                    async with self._acquire() as connection:
+                        try:
+                            await self._prepare_retry(connection, attempt)
+                            with self._timed(tag):
+                                async with connection.cursor() as cursor:
+                                    for chunk in chunks[done:]:
+                                        chunk_affected = await _execute_chunk(cursor, query, statement, chunk)
+                                        await connection.commit()
+                                        affected += chunk_affected
+                                        done += 1
+                        except (OperationalError, InterfaceError) as e:
+                            self._evict(connection, e)
+                            raise
+                self._connection_ok()
+            except (OperationalError, InterfaceError) as e:
+                if attempt >= retries or not _is_retryable_error(e):
+                    print(f"Ошибка выполнения пакетного запроса: {e}")
+                    self._connection_failed(e)
+                    return None
+                attempt += 1
+                if not await self._retry_pause(attempt, e):
+                    return None
+            except AiomysqlError as e:
+                print(f"Ошибка выполнения пакетного запроса: {e}")
+                return None
+        return affected
+
+    async def stream(self, query, params=None, batch_size=None, tag=None):
+        """
+        Асинхронный итератор по результату запроса частями по batch_size строк.
+        Используется небуферизованный курсор SSCursor: строки читаются с сервера по мере
+        обработки, и в памяти одновременно находится только одна часть результата.
+
+        Соединение занято до конца обхода, поэтому обработку частей (например, запись
+        в другую базу) лучше выполнять через другой DatabaseManager. Для чтения всегда берётся
+        отдельное соединение из пула, даже внутри connection()/transaction(). При ошибке
+        исключение передаётся вызывающему: часть результата уже могла быть обработана.
+        Ошибка соединения до получения первой части повторяется, как в execute_query.
+
+        Вызывающий, который может прервать обход, оборачивает итератор в contextlib.aclosing:
+        тогда соединение закрывается сразу при выходе, а не при сборке мусора генератора.
+        """
+        batch_size = max(1, batch_size or self.chunk_size)
+        tag = tag or _query_tag(query)
+        await self.ensure_connection()
+        if not self.pool:
+            raise InterfaceError(f"Нет подключения к базе данных {self.db} на {self.host}")
+
+        attempt = 0
+        while True:
+            yielded = False
+            try:
+                async with self._slot():
+                    async with self._acquire() as connection:
+                        try:
+                            await self._prepare_retry(connection, attempt)
+                            cursor = await connection.cursor(aiomysql.SSCursor)
+                            # В метрики идёт время чтения с сервера, без обработки частей вызывающим
+                            read_seconds = 0.0
+                            finished = False
+                            try:
+                                started = time.perf_counter()
+                                await cursor.execute(query, params)
+                                read_seconds += time.perf_counter() - started
+                                while True:
+                                    started = time.perf_counter()
+                                    rows = await cursor.fetchmany(batch_size)
+                                    read_seconds += time.perf_counter() - started
+                                    if not rows:
+                                        break
+                                    yielded = True
+                                    yield rows
+                                finished = True
+                            except AiomysqlError as e:
+                                self._observe_query(tag, read_seconds + time.perf_counter() - started, e)
+                                raise
+                            finally:
+                                if finished:
+                                    await cursor.close()
+                                else:
+                                    # Обход прерван (ошибка, отмена, aclose() у вызывающего): закрытие курсора
+                                    # SSCursor дочитало бы весь оставшийся результат с сервера,
+                                    # поэтому закрывается само соединение, и пул его не вернёт в оборот
+                                    connection.close()
+                            self._observe_query(tag, read_seconds)
+                        except (OperationalError, InterfaceError) as e:
+                            self._evict(connection, e)
+                            raise
+                self._connection_ok()
+                return
+            except (OperationalError, InterfaceError) as e:
+                # Повтор возможен, только пока вызывающему не передано ни одной части
+                if yielded or attempt >= self.max_retries or not _is_retryable_error(e):
+                    print(f"Ошибка чтения результата запроса: {e}")
+                    self._connection_failed(e)
+                    raise
+                attempt += 1
+                if not await self._retry_pause(attempt, e):
+                    raise
+            except AiomysqlError as e:
+                print(f"Ошибка чтения результата запроса: {e}")
+                raise
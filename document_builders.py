@@ -0,0 +1,676 @@
+"""
+Данные для документов: SQL-запросы и словари замен для каждого типа документа.
+
+Функции возвращают BuiltDocument (задание на формирование, имя файла, теги кэша)
+или None, если акт, протокол или договор не найден. Их используют и маршруты
+скачивания отдельных документов, и пакетная выгрузка.
+"""
+import calendar
+
+from document_utils import amount_to_time, convert_to_currency_words, format_date
+from render_executor import RenderJob
+
+
+KDN_EDRPOU = 38736443
+
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PDF_MIMETYPE = "application/pdf"
+
+# Таблицы актов ООО: старые акты и акты kdn-new
+ACT_TABLES = {
+    "llc": ("credentials.llc_acts", "credentials.llc_agreements", "credentials.llc_acts_data"),
+    "kdn-new": ("credentials.llc_acts_new", "credentials.llc_agreements_new", "credentials.llc_acts_data_new"),
+}
+
+
+class BuiltDocument:
+    """
+    Документ, готовый к формированию: задание для пула, имя файла и теги кэша.
+    pdf=True - документ отдаётся после конвертации в PDF.
+    bundle - имя комплекта документов (акта, протокола, договора) без расширения,
+    под ним отдаются архив и объединённый PDF комплекта.
+    """
+
+    __slots__ = ("job", "file_name", "tags", "pdf", "bundle")
+
+    def __init__(self, job, file_name, tags=(), pdf=False, bundle=None):
+        self.job = job
+        self.file_name = file_name
+        self.tags = list(tags)
+        self.pdf = pdf
+        self.bundle = bundle or file_name.rsplit(".", 1)[0]
+
+    @property
+    def mimetype(self):
+        if self.pdf:
+            return PDF_MIMETYPE
+        if self.file_name.endswith(".xlsx"):
+            return XLSX_MIMETYPE
+        return DOCX_MIMETYPE
+
+
+# --- Акты ООО (llc_acts, llc_acts_new): отчёт, акт, счёт ---
+
+async def load_llc_act(db, family, act_id):
+    acts_table, agreements_table, data_table = ACT_TABLES[family]
+    query = f"""
+    SELECT act.act_date,
+           act.act_sum,
+           act.id,
+           agr.agreement_name,
+           agr.agreement_date,
+           llc.name,
+           llc.edrpou,
+           ri.name,
+           ri.iban,
+           ri.bank_account_detail,
+           ri.address,
+           ri.phone,
+           ri.inn,
+           ri.name_short,
+           llc.in_persona,
+           ri.pidstava,
+           llc.address,
+           llc.iban,
+           llc.bank_account_detail,
+           llc.inn,
+           llc.name_short
+    FROM {acts_table} act
+    JOIN {agreements_table} agr ON act.agreement = agr.id
+    JOIN credentials.llc_credentials llc ON agr.llc_id = llc.id
+    JOIN credentials.ri_credentials ri ON agr.ri_id = ri.id
+    WHERE act.id = %s
+    """
+    result = await db.execute_query(query, (act_id,))
+    if not result:
+        return None, []
+
+    query_acts_data = f"""
+    SELECT sw_rank, model_list, count_devices, ip_list, worktime_float
+    FROM {data_table}
+    WHERE act_id = %s
+    """
+    acts_data = await db.execute_query(query_acts_data, (act_id,))
+    return result[0], acts_data
+
+
+def _act_period(act_date):
+    _, month_name, year, _ = format_date(act_date)
+    last_day = calendar.monthrange(act_date.year, act_date.month)[-1]
+    return month_name, year, last_day
+
+
+def llc_act_context(data):
+    """
+    Значения, общие для отчёта, акта и счёта: даты и сумма прописью вычисляются один раз на акт.
+    """
+    month_name, year, last_day = _act_period(data[0])
+    return {
+        "period": data[0].strftime('%m/%y'),
+        "month_name": month_name,
+        "year": year,
+        "last_day": last_day,
+        "agr_date": format_date(data[4])[0],
+        "sum_words": convert_to_currency_words(data[1]),
+    }
+
+
+def llc_act_replacements(prefix, act_id, data, context):
+    """
+    Общие метки отчёта и акта; prefix - 'R' для отчёта, 'A' для акта.
+    """
+    return {
+        "@act_name": f"{prefix}{act_id}_{context['period']}_{data[3]}",
+        "@act_date": f"«{context['last_day']}» {context['month_name']} {context['year']} року",
+        "@ri_name": data[7],
+        "@ri_iban": data[8],
+        "@bank_account_detail_ri": data[9],
+        "@ri_address": data[10],
+        "@ri_phone": data[11],
+        "@ri_inn": data[12],
+        "@llc_name": data[5],
+        "@llc_edrpou": data[6],
+        "@agr_name": data[3],
+        "@agr_date": context["agr_date"],
+        "@act_sum": data[1],
+        "@actsumwords": context["sum_words"],  # Сумма прописью
+        "@ri_shortname": data[13],
+        "@llc_in_persona": data[14],
+        "@ri_pidstava": data[15],
+        "@current_month": context["month_name"],
+        "@current_year": context["year"],
+        "@last_day_of_the_month": context["last_day"],
+        "@llc_address": data[16],
+        "@llc_iban": data[17],
+        "@bank_account_detail_llc": data[18],
+        "@llc_inn": data[19],
+        "@llc_shortname": data[20]
+    }
+
+
+def llc_bill_replacements(act_id, data, context):
+    # Порядок ключей важен: в счёте метки заменяются последовательно
+    return {
+        "@bill_name": f"B{act_id}_{context['period']}_{data[3]}",
+        "@bill_date": f"{context['last_day']} {context['month_name']} {context['year']} року",
+        "@ri_name": data[7],
+        "@ri_iban": data[8],
+        "@bank_account_detail_ri": data[9],
+        "@ri_address": data[10],
+        "@ri_phone": data[11],
+        "@ri_inn": data[12],
+        "@llc_name": data[5],
+        "@llc_edrpou": data[6],
+        "@agr_name": data[3],
+        "@agr_date": context["agr_date"],
+        "@bill_sum": data[1],
+        "@handwritebill_sum": context["sum_words"],  # Сумма прописью
+        "@ri_shortname": data[13]
+    }
+
+
+# Ранги оборудования и цена единицы: для КДН ранги 1 и 2, для остальных ООО - 4 и 3
+_KDN_RANKS = ((1, 1000), (2, 1000))
+_LLC_RANKS = ((4, 500), (3, 1000))
+
+
+def add_report_rows(replacements, acts_data, kdn):
+    """
+    Метки отчёта по строкам llc_acts_data (sw_rank, model_list, count_devices, ip_list, worktime_float).
+    """
+    ranks = {rank for rank, _ in (_KDN_RANKS if kdn else _LLC_RANKS)}
+    for row in acts_data:
+        if row[0] in ranks:
+            replacements[f"@rank{row[0]}_models"] = row[1]
+            replacements[f"@rank{row[0]}_count"] = row[2]
+            replacements[f"@rank{row[0]}_ips"] = row[3]
+        elif row[0] == 0:
+            replacements["@time_models"] = row[1]
+            replacements["@time_count"] = round(row[4], 2)
+            replacements["@time_ips"] = row[3]
+
+
+def add_sum_rows(replacements, acts_data, act_sum, kdn):
+    """
+    Количества и суммы по рангам для акта и счёта. Сумма консультаций -
+    остаток суммы акта после рангов, учтённых до строки консультаций.
+    """
+    prices = dict(_KDN_RANKS if kdn else _LLC_RANKS)
+    rank_sums = {rank: 0 for rank in prices}
+    for row in acts_data:
+        if row[0] in prices:
+            rank_sum = float(row[2] * prices[row[0]])
+            replacements[f"@rank{row[0]}_count"] = row[2]
+            replacements[f"@rank{row[0]}_sum"] = rank_sum
+            rank_sums[row[0]] = rank_sum
+        elif row[0] == 0:
+            replacements["@time_count"] = round(row[4], 2)
+            replacements["@time_sum"] = round(float(act_sum) - sum(rank_sums.values()), 2)
+
+
+LLC_ACT_KINDS = ("report", "act", "bill")
+
+
+def _llc_act_document(family, kind, act_id, data, acts_data, context):
+    kdn_new = family == "kdn-new"
+    kdn = kdn_new or str(data[6]) == str(KDN_EDRPOU)
+    prefix = "kdn" if kdn else "llc"
+
+    if kind == "report":
+        replacements = llc_act_replacements("R", act_id, data, context)
+        add_report_rows(replacements, acts_data, kdn)
+        template, title, extension = f"{prefix}_report", "Звіт", ".docx"
+    elif kind == "act":
+        replacements = llc_act_replacements("A", act_id, data, context)
+        add_sum_rows(replacements, acts_data, data[1], kdn)
+        template, title, extension = f"{prefix}_act", "Акт", ".docx"
+    elif kind == "bill":
+        replacements = llc_bill_replacements(act_id, data, context)
+        add_sum_rows(replacements, acts_data, data[1], kdn)
+        template, title, extension = f"{prefix}_bill", "Рахунок", ".xlsx"
+    else:
+        raise ValueError(f"Неизвестный тип документа акта: {kind}")
+
+    if kdn_new:
+        if extension == ".xlsx":
+            options = {"clear_highlights": True, "prepare_for_pdf": True}
+        else:
+            options = {"formatting": True, "clear_highlights": True}
+        extension = ".pdf"
+    else:
+        options = {"formatting": True} if extension == ".docx" else {}
+
+    tag = "kdn_act" if kdn_new else "llc_act"
+    return BuiltDocument(
+        RenderJob(template, replacements, options=options),
+        f"{data[3]}_{title}_{context['month_name']}_{context['year']}{extension}",
+        tags=[f"{tag}:{act_id}"],
+        pdf=kdn_new,
+        bundle=f"{data[3]}_{context['month_name']}_{context['year']}",
+    )
+
+
+async def build_llc_act_documents(db, family, act_id, kinds=LLC_ACT_KINDS):
+    """
+    Документы акта ООО ('report', 'act', 'bill') по одной загрузке данных акта.
+    Документы kdn-new всегда формируются по шаблонам КДН и отдаются в PDF.
+    """
+    data, acts_data = await load_llc_act(db, family, act_id)
+    if data is None:
+        return None
+
+    context = llc_act_context(data)
+    return [_llc_act_document(family, kind, act_id, data, acts_data, context) for kind in kinds]
+
+
+async def build_llc_act_document(db, family, kind, act_id):
+    documents = await build_llc_act_documents(db, family, act_id, (kind,))
+    return documents[0] if documents else None
+
+
+# --- Договоры ООО (llc_agreements): протокол, договор, додаток ---
+
+async def build_llc_agreement_document(db, kind, agreement_id):
+    """
+    Протокол ('protocol'), договор ('contract') или додаток с таблицами ('appendix') по договору ООО.
+    """
+    if kind == "appendix":
+        return await _build_llc_appendix(db, agreement_id)
+
+    agreement_query = """
+    SELECT la.id, la.agreement_name, la.agreement_date,
+           lc.name AS llc_name, lc.in_persona, lc.address AS llc_address, lc.edrpou AS llc_edrpou,
+           lc.iban AS llc_iban, lc.bank_account_detail AS bank_account_detail_llc, lc.inn AS llc_inn, lc.name_short AS llc_shortname,
+           ri.name AS ri_name, ri.inn AS ri_inn, ri.pidstava, ri.address AS ri_address,
+           ri.iban AS ri_iban, ri.bank_account_detail AS bank_account_detail_ri, ri.name_short AS ri_shortname
+    FROM credentials.llc_agreements AS la
+    JOIN credentials.llc_credentials AS lc ON la.llc_id = lc.id
+    JOIN credentials.ri_credentials AS ri ON la.ri_id = ri.id
+    WHERE la.id = %s;
+    """
+    agreement_data = await db.execute_query(agreement_query, (agreement_id,))
+    if not agreement_data:
+        return None
+
+    agreement = agreement_data[0]
+    number = f"{agreement[0]}_{agreement[2].strftime('%Y-%m-%d')}_{agreement[1]}"
+    replacements = {
+        '@agr_name': agreement[1],
+        '@agr_date': format_date(agreement[2])[0],
+        '@llc_name': agreement[3],
+        '@persona': agreement[4],
+        '@ri_name': agreement[11],
+        '@ri_inn': agreement[12],
+        '@pidstava': agreement[13],
+        '@llc_address': agreement[5],
+        '@llc_edrpou': agreement[6],
+        '@llc_iban': agreement[7],
+        '@bank_account_detail_llc': agreement[8],
+        '@llc_inn': agreement[9],
+        '@llc_shortname': agreement[10],
+        '@ri_address': agreement[14],
+        '@ri_iban': agreement[15],
+        '@bank_account_detail_ri': agreement[16],
+        '@ri_shortname': agreement[17]
+    }
+
+    if kind == "protocol":
+        replacements['@proto_num'] = number
+        template = 'KDN_proto' if agreement[6] == KDN_EDRPOU else 'llc_proto'
+        job = RenderJob(template, replacements)
+        file_name = f"{agreement[1]} Протокол.docx"
+    elif kind == "contract":
+        replacements['@contract_num'] = number
+        job = RenderJob('llc_contract', replacements, options={'formatting': True})
+        file_name = f"{agreement[1]}_Договір.docx"
+    else:
+        raise ValueError(f"Неизвестный тип документа договора ООО: {kind}")
+
+    return BuiltDocument(job, file_name, tags=[f"llc_agreement:{agreement_id}"])
+
+
+async def _build_llc_appendix(db, agreement_id):
+    agreement_query = """
+    SELECT la.id, la.agreement_name, la.agreement_date,
+           lc.name AS llc_name, lc.edrpou AS llc_edrpou,
+           lc.address AS llc_address, lc.iban AS llc_iban, lc.bank_account_detail AS bank_account_detail_llc,
+           lc.name_short AS llc_shortname, ri.id AS engineer_id, lc.id AS llc_id, lc.in_persona, ri.name, ri.inn,
+           ri.pidstava, ri.address AS ri_address, ri.iban, ri.bank_account_detail, ri.name_short, lc.inn
+    FROM credentials.llc_agreements AS la
+    JOIN credentials.llc_credentials AS lc ON la.llc_id = lc.id
+    JOIN credentials.ri_credentials AS ri ON la.ri_id = ri.id
+    WHERE la.id = %s;
+    """
+    agreement_data = await db.execute_query(agreement_query, (agreement_id,))
+    if not agreement_data:
+        return None
+
+    agreement = agreement_data[0]
+    llc_edrpou = agreement[4]
+
+    # Выбираем запросы в зависимости от ЕДРПОУ
+    if llc_edrpou == KDN_EDRPOU:
+        model_query = """
+        SELECT sw.model, COUNT(DISTINCT sw.ip)
+        FROM dbsyphon.switches_report sw
+        JOIN credentials.engineer_cantons ct ON sw.canton = ct.canton
+        WHERE sw.switch_rank IN (1,2) AND ct.engineer_id = %s
+        GROUP BY 1;
+        """
+        ip_pool_query = """
+        SELECT CONCAT(SUBSTRING_INDEX(sr.ip, '.', 3), '.0/24') AS ip_pool
+        FROM dbsyphon.switches_report sr
+        JOIN credentials.engineer_cantons ct ON sr.canton = ct.canton
+        WHERE sr.switch_rank IN (1,2) AND ct.engineer_id = %s
+        GROUP BY ip_pool;
+        """
+        query_param = agreement[9]  # engineer_id
+    else:
+        model_query = """
+        SELECT sw.model, COUNT(DISTINCT sw.ip)
+        FROM dbsyphon.switches_report sw
+        JOIN credentials.llc_cantons ct ON sw.canton = ct.canton
+        WHERE sw.switch_rank IN (3,4) AND ct.llc_id = %s
+        GROUP BY 1;
+        """
+        ip_pool_query = """
+        SELECT CONCAT(SUBSTRING_INDEX(sr.ip, '.', 3), '.0/24') AS ip_pool
+        FROM dbsyphon.switches_report sr
+        JOIN credentials.llc_cantons ct ON sr.canton = ct.canton
+        WHERE sr.switch_rank IN (3,4) AND ct.llc_id = %s
+        GROUP BY ip_pool;
+        """
+        query_param = agreement[10]  # llc_id
+
+    data_table1 = await db.execute_query(model_query, (query_param,))
+    data_table2 = await db.execute_query(ip_pool_query, (query_param,))
+
+    replacements = {
+        '@agr_num': agreement[0],
+        '@agr_name': agreement[1],
+        '@agr_date': format_date(agreement[2])[0],
+        '@llc_name': agreement[3],
+        '@persona': agreement[11],
+        '@ri_name': agreement[12],
+        '@ri_inn': agreement[13],
+        '@pidstava': agreement[14],
+        '@ri_address': agreement[15],
+        '@ri_iban': agreement[16],
+        '@llc_inn': agreement[19],
+        '@bank_account_detail_ri': agreement[17],
+        '@ri_shortname': agreement[18],
+        '@llc_edrpou': llc_edrpou,
+        '@llc_address': agreement[5],
+        '@llc_iban': agreement[6],
+        '@bank_account_detail_llc': agreement[7],
+        '@llc_shortname': agreement[8]
+    }
+
+    # Метки @table1 и @table2 заменяются таблицами
+    job = RenderJob('llc_appendix', replacements, options={'formatting': True}, tables=[
+        ('@table1', ['Модель обладнання', 'Кількість'], data_table1),
+        ('@table2', ['Діапазон ІР адрес'], data_table2),
+    ])
+    return BuiltDocument(job, f"{agreement[1]}_Додаток.docx", tags=[f"llc_agreement:{agreement_id}"])
+
+
+# --- Договоры ФОП (agreements): протокол и акт, договор, додаток 1, расторжение ---
+
+FOP_AGREEMENT_KINDS = ("contract", "dod1", "termination")
+FOP_PROTOCOL_KINDS = ("protocol", "act")
+
+
+async def load_fop_agreement(db, agreement_id):
+    """
+    Строка договора ФОП с реквизитами сторон; последняя колонка - дата расторжения или None.
+    """
+    agreement_query = """
+    SELECT a.agreement_name, a.agreement_date, f.name AS fop_name, f.inn AS inn_fop, f.pidstava AS pidstava_fop,
+           f.address AS fop_address, f.iban AS fop_iban, f.bank_account_detail AS bank_account_detail_fop, f.name_short AS fop_name_short,
+           r.name AS ri_name, r.inn AS inn_ri, r.pidstava AS pidstava_ri, r.address AS ri_address, r.iban AS ri_iban, r.bank_account_detail AS bank_account_detail_ri, r.name_short AS ri_name_short,
+           a.agreement_state, t.termination_date
+    FROM credentials.agreements AS a
+    JOIN credentials.fop_credentials AS f ON a.master_id = f.id
+    JOIN credentials.ri_credentials AS r ON a.ri_id = r.id
+    LEFT JOIN credentials.agreement_termination AS t ON a.id = t.agreement_id
+    WHERE a.id = %s;
+    """
+    agreement_data = await db.execute_query(agreement_query, (agreement_id,))
+    return agreement_data[0] if agreement_data else None
+
+
+def fop_agreement_replacements(agreement):
+    """
+    Общие метки документов ФОП по строке load_fop_agreement.
+    """
+    return {
+        '@agr_num': agreement[0],
+        '@agr_date': format_date(agreement[1])[0],
+        '@fop_name': agreement[2],
+        '@inn_fop': agreement[3],
+        '@pidstava_fop': agreement[4],
+        '@ri_name': agreement[9],
+        '@inn_ri': agreement[10],
+        '@pidstava_ri': agreement[11],
+        '@fop_address': agreement[5],
+        '@fop_iban': agreement[6],
+        '@bank_account_detail_fop': agreement[7],
+        '@fopname_short': agreement[8],
+        '@ri_address': agreement[12],
+        '@ri_iban': agreement[13],
+        '@bank_account_detail_ri': agreement[14],
+        '@riname_short': agreement[15]
+    }
+
+
+def _fop_protocol_documents(agreement_id, protocol_id, agreement, protocol, base, kinds):
+    proto_date_str, proto_month_ukr_name, proto_year, _ = format_date(protocol[0])
+    last_day_of_the_month = str(calendar.monthrange(protocol[0].year, protocol[0].month)[1])
+
+    replacements = dict(base)
+    replacements.update({
+        '@proto_date': proto_date_str,
+        '@month_ukr_name': proto_month_ukr_name,
+        '@year': proto_year,
+        '@last_day_of_the_month': last_day_of_the_month,
+        '@agr_sum': f"{protocol[1]:,.2f}",
+        '@agrsum_handwriting_sample': protocol[2],
+    })
+    tags = [f"agreement:{agreement_id}", f"protocol:{protocol_id}"]
+
+    documents = []
+    for kind in kinds:
+        if kind == "protocol":
+            job = RenderJob('M-RI_protocol', replacements, options={'formatting': True})
+            file_name = f"{agreement[0]}_протокол_{proto_month_ukr_name}_{proto_year}.docx"
+        elif kind == "act":
+            act_replacements = dict(replacements)
+            act_replacements.update({
+                '@today': f"{last_day_of_the_month} {proto_month_ukr_name} {proto_year} року ",
+                '@act_nubmer': f'{protocol_id}/{agreement[0]}',
+                '@act_hours': amount_to_time(float(protocol[1]))
+            })
+            job = RenderJob('M-RI_act', act_replacements, options={'formatting': True})
+            file_name = f"{agreement[0]}_акт_{proto_month_ukr_name}_{proto_year}.docx"
+        else:
+            raise ValueError(f"Неизвестный тип документа протокола: {kind}")
+        documents.append(BuiltDocument(job, file_name, tags=tags,
+                                       bundle=f"{agreement[0]}_{proto_month_ukr_name}_{proto_year}"))
+    return documents
+
+
+async def _fop_dod1_tables(db, agreement_id):
+    models_query = """
+    SELECT
+        sr.model,
+        COUNT(DISTINCT sr.ip) AS ip_count
+    FROM
+        dbsyphon.switches_report sr
+    JOIN
+        credentials.fop_territory ft ON sr.vetka = ft.vetka
+    JOIN
+        credentials.agreements a ON a.master_id = ft.master_id
+    WHERE
+        sr.switch_rank = 4
+    AND
+        a.id = %s
+    GROUP BY
+        sr.model;
+    """
+    ip_pools_query = """
+    SELECT
+        CONCAT(SUBSTRING_INDEX(sr.ip, '.', 3), '.0/24') AS ip_pool
+    FROM
+        dbsyphon.switches_report sr
+    JOIN
+        credentials.fop_territory ft ON sr.vetka = ft.vetka
+    JOIN
+        credentials.agreements a ON a.master_id = ft.master_id
+    WHERE
+        sr.switch_rank = 4
+    AND
+        a.id = %s
+    GROUP BY
+        ip_pool;
+    """
+    data_table1 = await db.execute_query(models_query, (agreement_id,))
+    data_table2 = await db.execute_query(ip_pools_query, (agreement_id,))
+    return [
+        ('@table1', ['Найменування (модель) технічних засобів електронних комунікацій', 'Кількість'], data_table1),
+        ('@table2', ['Діапазон ІР адрес технічних засобів електронних комунікацій'], data_table2),
+    ]
+
+
+async def build_fop_agreement_documents(db, agreement_id, kinds=FOP_AGREEMENT_KINDS,
+                                        protocol_id=None, protocol_kinds=FOP_PROTOCOL_KINDS):
+    """
+    Документы договора ФОП по одной загрузке договора: договор ('contract'), додаток 1
+    с таблицами ('dod1'), расторжение ('termination', только для расторгнутых договоров)
+    и, если указан protocol_id, протокол и акт по нему.
+    None - договор или запрошенный протокол не найден.
+    """
+    agreement = await load_fop_agreement(db, agreement_id)
+    if agreement is None:
+        return None
+
+    protocol = None
+    if protocol_id is not None:
+        protocol_query = """
+        SELECT proto_date, proto_sum, proto_sum_caps
+        FROM credentials.protocols
+        WHERE agreement = %s and id = %s;
+        """
+        protocol_data = await db.execute_query(protocol_query, (agreement_id, protocol_id))
+        if not protocol_data:
+            return None
+        protocol = protocol_data[0]
+
+    base = fop_agreement_replacements(agreement)
+    tags = [f"agreement:{agreement_id}"]
+    documents = []
+
+    for kind in kinds:
+        if kind == "contract":
+            # Активный договор или нет
+            replacements = dict(base, **{'@agreement_state': 'Активный' if agreement[16] == 1 else 'Неактивный'})
+            job = RenderJob('M-RI_agreement', replacements, options={'formatting': True})
+            documents.append(BuiltDocument(job, f"{agreement[0]}_ДОГОВІР.docx", tags=tags, bundle=agreement[0]))
+        elif kind == "termination":
+            if agreement[17] is None:
+                continue
+            replacements = dict(base, **{
+                '@agreement_state': 'Активный' if agreement[16] == 1 else 'Неактивный',
+                '@term_date': format_date(agreement[17])[0],
+            })
+            job = RenderJob('M-RI_termination', replacements, options={'formatting': True})
+            documents.append(BuiltDocument(job, f"{agreement[0]}_РАСТОРЖЕНИЕ_ДОГОВОРА.docx", tags=tags,
+                                           bundle=agreement[0]))
+        elif kind == "dod1":
+            replacements = dict(base, **{'@agreement_state': 'Активний' if agreement[16] == 1 else 'Неактивний'})
+            job = RenderJob('M-RI_dod1', replacements, options={'formatting': True},
+                            tables=await _fop_dod1_tables(db, agreement_id))
+            documents.append(BuiltDocument(job, f"{agreement[0]}_Додаток1.docx", tags=tags, bundle=agreement[0]))
+        else:
+            raise ValueError(f"Неизвестный тип документа договора ФОП: {kind}")
+
+    if protocol is not None:
+        documents.extend(_fop_protocol_documents(agreement_id, protocol_id, agreement, protocol, base, protocol_kinds))
+    return documents
+
+
+async def build_fop_agreement_document(db, kind, agreement_id):
+    """
+    Договор ('contract'), додаток 1 ('dod1') или расторжение ('termination') договора ФОП.
+    """
+    documents = await build_fop_agreement_documents(db, agreement_id, (kind,))
+    return documents[0] if documents else None
+
+
+async def build_fop_protocol_document(db, kind, agreement_id, protocol_id):
+    """
+    Протокол ('protocol') или акт ('act') по протоколу договора ФОП.
+    """
+    documents = await build_fop_agreement_documents(db, agreement_id, (), protocol_id, (kind,))
+    return documents[0] if documents else None
+
+
+LLC_AGREEMENT_KINDS = ("protocol", "contract", "appendix")
+
+# Виды заданий очереди формирования (render_jobs): параметры задания и их допустимые значения.
+# int - обязательный номер, None - необязательный номер, кортеж - одно из перечисленных значений
+DOCUMENT_JOB_KINDS = {
+    "llc_act": {"family": tuple(ACT_TABLES), "document": LLC_ACT_KINDS, "act_id": int},
+    "llc_act_bundle": {"family": tuple(ACT_TABLES), "act_id": int, "format": ("", "pdf")},
+    "llc_agreement": {"document": LLC_AGREEMENT_KINDS, "agreement_id": int},
+    "fop_agreement": {"document": FOP_AGREEMENT_KINDS, "agreement_id": int},
+    "fop_protocol": {"document": FOP_PROTOCOL_KINDS, "agreement_id": int, "protocol_id": int},
+    "fop_agreement_bundle": {"agreement_id": int, "protocol_id": None, "format": ("", "pdf")},
+}
+
+
+def document_job_params(kind, params):
+    """
+    Проверенные параметры задания вида kind. ValueError - неизвестный вид или недопустимый параметр.
+    """
+    spec = DOCUMENT_JOB_KINDS.get(kind)
+    if spec is None:
+        raise ValueError(f"Неизвестный вид задания: {kind}")
+
+    result = {}
+    for name, allowed in spec.items():
+        value = params.get(name)
+        if allowed is int or allowed is None:
+            if value is None and allowed is None:
+                result[name] = None
+                continue
+            try:
+                result[name] = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Параметр {name} должен быть числом") from None
+        else:
+            value = allowed[0] if value is None else value
+            if value not in allowed:
+                raise ValueError(f"Параметр {name}: допустимо {', '.join(repr(item) for item in allowed)}")
+            result[name] = value
+    return result
+
+
+async def build_job_documents(db, kind, params):
+    """
+    Документы задания: BuiltDocument, список BuiltDocument для комплектов или None, если данных нет.
+    """
+    if kind == "llc_act":
+        return await build_llc_act_document(db, params["family"], params["document"], params["act_id"])
+    if kind == "llc_act_bundle":
+        return await build_llc_act_documents(db, params["family"], params["act_id"])
+    if kind == "llc_agreement":
+        return await build_llc_agreement_document(db, params["document"], params["agreement_id"])
+    if kind == "fop_agreement":
+        return await build_fop_agreement_document(db, params["document"], params["agreement_id"])
+    if kind == "fop_protocol":
+        return await build_fop_protocol_document(db, params["document"], params["agreement_id"],
+                                                 params["protocol_id"])
+    if kind == "fop_agreement_bundle":
+        return await build_fop_agreement_documents(db, params["agreement_id"], protocol_id=params["protocol_id"])
+    raise ValueError(f"Неизвестный вид задания: {kind}")
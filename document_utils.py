@@ -1,69 +1,85 @@
+import re
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
 from docx.oxml.ns import qn
 from docx.shared import Pt
-from openpyxl.styles import PatternFill
-from openpyxl.worksheet.properties import PageSetupProperties
-from num2words import num2words
-
-
-def _replace_in_paragraph(paragraph, replacements):
-    for key, value in replacements.items():
-        replacement = str(value)
+from docx.text.paragraph import Paragraph
 
-        while key in paragraph.text:
-            start = paragraph.text.find(key)
-            end = start + len(key)
-            current = 0
-            start_run = start_offset = end_run = end_offset = None
 
-            for idx, run in enumerate(paragraph.runs):
-                run_end = current + len(run.text)
+class PlaceholderReplacer:
+    """
+    Скомпилированный набор замен: одно регулярное выражение на все метки словаря.
+    Более длинные метки стоят в выражении раньше, поэтому '@ri_name' не перехватит '@ri_name_short'.
+    """
 
-                if start_run is None and current <= start < run_end:
-                    start_run = idx
-                    start_offset = start - current
+    def __init__(self, replacements):
+        self.values = {key: str(value) for key, value in replacements.items() if key}
+        keys = sorted(self.values, key=len, reverse=True)
+        self.pattern = re.compile("|".join(map(re.escape, keys))) if keys else None
 
-                if current < end <= run_end:
-                    end_run = idx
-                    end_offset = end - current
-                    break
+    def sub(self, text):
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(lambda match: self.values[match.group()], text)
 
-                current = run_end
 
-            if start_run is None or end_run is None:
-                break
+def _as_replacer(replacements):
+    if isinstance(replacements, PlaceholderReplacer):
+        return replacements
+    return PlaceholderReplacer(replacements)
 
-            runs = paragraph.runs
-            if start_run == end_run:
-                run = runs[start_run]
-                run.text = run.text[:start_offset] + replacement + run.text[end_offset:]
-            else:
-                first_run = runs[start_run]
-                last_run = runs[end_run]
-                first_run.text = first_run.text[:start_offset] + replacement + last_run.text[end_offset:]
-                for idx in range(start_run + 1, end_run + 1):
-                    runs[idx].text = ""
 
+def _replace_in_paragraph(paragraph, replacer):
+    """
+    Замена всех меток в абзаце за один проход по общему тексту ранов.
+    Метка, разбитая на несколько ранов, заменяется в первом из них,
+    остаток последнего рана переносится в первый, промежуточные раны очищаются.
+    """
+    if replacer.pattern is None:
+        return
 
-def replace_text_in_document(doc, replacements):
-    for paragraph in doc.paragraphs:
-        _replace_in_paragraph(paragraph, replacements)
-
-
-def replace_in_tables(tables, replacements):
-    for table in tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    _replace_in_paragraph(paragraph, replacements)
-                if cell.tables:
-                    replace_in_tables(cell.tables, replacements)
-
+    runs = paragraph.runs
+    texts = [run.text for run in runs]
+    full_text = "".join(texts)
+    matches = list(replacer.pattern.finditer(full_text))
+    if not matches:
+        return
 
-def formatting_text(document):
-    for paragraph in document.paragraphs:
-        for run in paragraph.runs:
-            run.font.name = 'Times New Roman'
-            run.font.size = Pt(11)
+    run_ends = []
+    position = 0
+    for text in texts:
+        position += len(text)
+        run_ends.append(position)
+
+    new_texts = [[] for _ in texts]
+    # Ран, в который переносится остаток рана после метки, разбитой на несколько ранов
+    moved_to = {}
+
+    def copy_text(start, end):
+        idx = bisect_right(run_ends, start)
+        while start < end:
+            chunk_end = min(end, run_ends[idx])
+            new_texts[moved_to.get(idx, idx)].append(full_text[start:chunk_end])
+            start = chunk_end
+            idx += 1
+
+    position = 0
+    for match in matches:
+        copy_text(position, match.start())
+        start_run = bisect_right(run_ends, match.start())
+        end_run = bisect_left(run_ends, match.end())
+        target_run = moved_to.get(start_run, start_run)
+        new_texts[target_run].append(replacer.values[match.group()])
+        if end_run != start_run:
+            moved_to[end_run] = target_run
+        position = match.end()
+    copy_text(position, len(full_text))
+
+    for run, old_text, parts in zip(runs, texts, new_texts):
+        new_text = "".join(parts)
+        if new_text != old_text:
+            run.text = new_text
 
 
 def _remove_xml_children(element, child_tags):
@@ -83,25 +99,138 @@ def _clear_paragraph_highlights(paragraph):
         _remove_xml_children(run._r.rPr, ("w:highlight", "w:shd"))
 
 
-def clear_document_highlights(document):
-    for paragraph in document.paragraphs:
-        _clear_paragraph_highlights(paragraph)
+def _clear_cell_shading(tc):
+    _remove_xml_children(tc.tcPr, ("w:shd",))
+
+
+_W_P = qn("w:p")
+_W_TBL = qn("w:tbl")
+_W_TR = qn("w:tr")
+_W_TC = qn("w:tc")
+_W_R = qn("w:r")
+_W_T = qn("w:t")
+_W_RPR = qn("w:rPr")
+
+
+def _remove_empty_runs(paragraph):
+    """
+    Удаление ранов без текста и других элементов (остаются после слияния разбитых меток).
+    """
+    for r in paragraph._p.findall(_W_R):
+        if all(child.tag == _W_RPR or (child.tag == _W_T and not child.text) for child in r):
+            paragraph._p.remove(r)
+
+
+class DocumentPipeline:
+    """
+    Обработка документа python-docx за один обход дерева: шаги регистрируются заранее
+    и применяются к каждому абзацу по очереди, вместо отдельного прохода по всему
+    документу на каждую операцию. Абзацы вложенных таблиц обходятся так же.
+
+    Шаги, зарегистрированные с in_tables=False, применяются только к абзацам
+    основного текста (так шрифт всегда задавался только вне таблиц).
+    """
+
+    def __init__(self):
+        self._steps = []
+        self._cell_steps = []
+
+    def add_step(self, step, in_tables=True):
+        """
+        step(paragraph) - функция обработки одного абзаца.
+        """
+        self._steps.append((step, in_tables))
+        return self
+
+    def add_cell_step(self, step):
+        """
+        step(tc) - функция обработки элемента ячейки таблицы <w:tc>.
+        """
+        self._cell_steps.append(step)
+        return self
+
+    def substitute(self, replacements):
+        replacer = _as_replacer(replacements)
+        if replacer.pattern is None:
+            return self
+        return self.add_step(lambda paragraph: _replace_in_paragraph(paragraph, replacer))
+
+    def set_font(self, name='Times New Roman', size=11, in_tables=False):
+        font_size = Pt(size)
+
+        def step(paragraph):
+            for run in paragraph.runs:
+                run.font.name = name
+                run.font.size = font_size
+
+        return self.add_step(step, in_tables)
+
+    def clear_highlights(self):
+        self.add_step(_clear_paragraph_highlights)
+        return self.add_cell_step(_clear_cell_shading)
+
+    def remove_empty_runs(self):
+        return self.add_step(_remove_empty_runs)
+
+    def apply(self, document):
+        body = document._body
+        body_steps = [step for step, _ in self._steps]
+        table_steps = [step for step, in_tables in self._steps if in_tables]
+
+        for child in document.element.body.iterchildren():
+            if child.tag == _W_P:
+                self._apply_paragraph(Paragraph(child, body), body_steps)
+            elif child.tag == _W_TBL:
+                self._apply_table(child, body, table_steps)
+        return document
+
+    def apply_to_tables(self, tables):
+        table_steps = [step for step, in_tables in self._steps if in_tables]
+        for table in tables:
+            self._apply_table(table._tbl, table._parent, table_steps)
+
+    @staticmethod
+    def _apply_paragraph(paragraph, steps):
+        for step in steps:
+            step(paragraph)
+
+    def _apply_table(self, tbl, parent, steps):
+        for tr in tbl.iterchildren(_W_TR):
+            for tc in tr.iterchildren(_W_TC):
+                for cell_step in self._cell_steps:
+                    cell_step(tc)
+                for child in tc.iterchildren():
+                    if child.tag == _W_P:
+                        self._apply_paragraph(Paragraph(child, parent), steps)
+                    elif child.tag == _W_TBL:
+                        self._apply_table(child, parent, steps)
 
-    for table in document.tables:
-        clear_table_highlights(table)
+
+def replace_text_in_document(doc, replacements):
+    replacer = _as_replacer(replacements)
+    for paragraph in doc.paragraphs:
+        _replace_in_paragraph(paragraph, replacer)
+
+
+def replace_in_tables(tables, replacements):
+    DocumentPipeline().substitute(replacements).apply_to_tables(tables)
+
+
+def formatting_text(document):
+    DocumentPipeline().set_font().apply(document)
+
+
+def clear_document_highlights(document):
+    DocumentPipeline().clear_highlights().apply(document)
 
 
 def clear_table_highlights(table):
-    for row in table.rows:
-        for cell in row.cells:
-            _remove_xml_children(cell._tc.tcPr, ("w:shd",))
-            for paragraph in cell.paragraphs:
-                _clear_paragraph_highlights(paragraph)
-            for nested_table in cell.tables:
-                clear_table_highlights(nested_table)
+    DocumentPipeline().clear_highlights().apply_to_tables([table])
 
 
 def clear_workbook_highlights(workbook):
+    from openpyxl.styles import PatternFill
+
     empty_fill = PatternFill(fill_type=None)
     for sheet in workbook.worksheets:
         for row in sheet.iter_rows():
@@ -110,6 +239,8 @@ def clear_workbook_highlights(workbook):
 
 
 def prepare_workbook_for_pdf(workbook):
+    from openpyxl.worksheet.properties import PageSetupProperties
+
     for sheet in workbook.worksheets:
         sheet.print_area = sheet.calculate_dimension()
         sheet.sheet_properties.pageSetUpPr = PageSetupProperties(fitToPage=True)
@@ -126,21 +257,50 @@ def prepare_workbook_for_pdf(workbook):
         sheet.page_margins.bottom = 0.25
 
 
+@lru_cache(maxsize=4096)
+def _number_words(number):
+    from num2words import num2words
+    return num2words(number, lang='uk')
+
+
+@lru_cache(maxsize=4096)
 def convert_to_currency_words(amount):
+    """
+    Сумма прописью. Результаты кэшируются: одни и те же суммы и их части
+    (гривны, копейки) повторяются в протоколах и актах одного месяца.
+    """
     hryvnia_part = int(amount)
     kopiyka_part = int(round((amount - hryvnia_part) * 100))
-    hryvnia_words = num2words(hryvnia_part, lang='uk')
-    kopiyka_words = num2words(kopiyka_part, lang='uk')
+    hryvnia_words = _number_words(hryvnia_part)
+    kopiyka_words = _number_words(kopiyka_part)
     return f"{hryvnia_words} гривень {kopiyka_words} копійок"
 
 
+def convert_amounts_to_words(amounts):
+    """
+    Суммы прописью для списка сумм в том же порядке; каждая различная сумма переводится один раз.
+    """
+    words = {}
+    for amount in amounts:
+        if amount not in words:
+            words[amount] = convert_to_currency_words(amount)
+    return [words[amount] for amount in amounts]
+
+
+_MONTHS_UKR = {
+    1: 'січня', 2: 'лютого', 3: 'березня', 4: 'квітня', 5: 'травня', 6: 'червня',
+    7: 'липня', 8: 'серпня', 9: 'вересня', 10: 'жовтня', 11: 'листопада', 12: 'грудня'
+}
+
+
+@lru_cache(maxsize=1024)
 def format_date(date):
-    months_ukr = {
-        1: 'січня', 2: 'лютого', 3: 'березня', 4: 'квітня', 5: 'травня', 6: 'червня',
-        7: 'липня', 8: 'серпня', 9: 'вересня', 10: 'жовтня', 11: 'листопада', 12: 'грудня'
-    }
+    """
+    Дата словами и её части: (дата, месяц в родительном падеже, год, день).
+    Кортеж неизменяемый, поэтому результат для одной даты вычисляется один раз.
+    """
     day = date.strftime("%d")
-    month = months_ukr[date.month]
+    month = _MONTHS_UKR[date.month]
     year = date.strftime("%Y")
     return f"{day} {month} {year} року", month, year, day
 
@@ -0,0 +1,202 @@
+import re
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from docx import Document
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml.ns import qn
+from docx.oxml.table import CT_Tbl
+from lxml import etree
+
+from document_utils import DocumentPipeline, PlaceholderReplacer
+from ooxml_zip import read_package, write_package
+
+
+MARKER_PATTERN = re.compile(r"@[A-Za-z_][A-Za-z0-9_]*")
+
+# Символы из области частного использования: в шаблонах договоров не встречаются
+_SLOT_OPEN = "\ue000"
+_SLOT_CLOSE = "\ue001"
+_SLOT_PATTERN = re.compile(f"{_SLOT_OPEN}(\\d+){_SLOT_CLOSE}")
+
+# Место вставки таблицы: XML-комментарий после абзаца с меткой таблицы
+_BLOCK_OPEN = "\ue002"
+_BLOCK_CLOSE = "\ue003"
+_PART_SLOT_PATTERN = re.compile(f"{_SLOT_OPEN}(\\d+){_SLOT_CLOSE}|<!--{_BLOCK_OPEN}(\\d+){_BLOCK_CLOSE}-->")
+
+# Символы, недопустимые в XML 1.0
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+_TEXT_BREAKS = {
+    "\t": '</w:t><w:tab/><w:t xml:space="preserve">',
+    "\n": '</w:t><w:br/><w:t xml:space="preserve">',
+    "\r": '</w:t><w:br/><w:t xml:space="preserve">',
+}
+_TEXT_BREAKS_PATTERN = re.compile("[\t\n\r]")
+
+_DOCUMENT_PART = "word/document.xml"
+
+
+def _iter_table_paragraphs(tables):
+    for table in tables:
+        for row in table.rows:
+            for cell in row.cells:
+                yield from cell.paragraphs
+                yield from _iter_table_paragraphs(cell.tables)
+
+
+def _collect_markers(document):
+    """
+    Все метки документа в тех же абзацах, где их ищет замена во время выполнения.
+    """
+    markers = set()
+    paragraphs = list(document.paragraphs) + list(_iter_table_paragraphs(document.tables))
+    for paragraph in paragraphs:
+        markers.update(MARKER_PATTERN.findall("".join(run.text for run in paragraph.runs)))
+    return markers
+
+
+def _render_value(value):
+    text = escape(_INVALID_XML_CHARS.sub("", value))
+    return _TEXT_BREAKS_PATTERN.sub(lambda match: _TEXT_BREAKS[match.group()], text)
+
+
+class DocxTableBuilder:
+    """
+    Таблица w:tbl, собранная одной строкой XML. Таблица из одной строки создаётся
+    python-docx с теми же свойствами и ширинами колонок, что у doc.add_table; её строка
+    служит прототипом, в ячейки которого подставляется текст, без объектной модели
+    python-docx для каждой строки и ячейки.
+
+    Строка заголовка помечена w:tblHeader и повторяется на каждой странице,
+    строки данных не разрываются между страницами (w:cantSplit).
+    """
+
+    def __init__(self, columns, width):
+        tbl = CT_Tbl.new_tbl(1, columns, width)
+        for index, tc in enumerate(tbl.iter(qn("w:tc"))):
+            for paragraph in tc.findall(qn("w:p")):
+                tc.remove(paragraph)
+            text = etree.SubElement(etree.SubElement(etree.SubElement(tc, qn("w:p")), qn("w:r")), qn("w:t"))
+            text.set("{http://www.w3.org/XML/1998/namespace}space", "preserve")
+            text.text = f"{_SLOT_OPEN}{index}{_SLOT_CLOSE}"
+
+        xml = etree.tostring(tbl, encoding="unicode")
+        row_start = xml.index("<w:tr>")
+        row_end = xml.rindex("</w:tr>") + len("</w:tr>")
+        self.columns = columns
+        self._prefix = xml[:row_start].encode("utf-8")
+        self._suffix = xml[row_end:].encode("utf-8")
+
+        row_parts = _SLOT_PATTERN.split(xml[row_start + len("<w:tr>"):row_end])
+        self._row_chunks = [part.encode("utf-8") for part in row_parts[0::2]]
+        self._row_slots = [int(index) for index in row_parts[1::2]]
+
+    def _row(self, pieces, row_properties, values):
+        pieces.append(b"<w:tr>" + row_properties)
+        pieces.append(self._row_chunks[0])
+        for index, chunk in zip(self._row_slots, self._row_chunks[1:]):
+            value = values[index] if index < len(values) else ""
+            pieces.append(_render_value(str(value)).encode("utf-8"))
+            pieces.append(chunk)
+
+    def build(self, headers, rows):
+        """
+        XML таблицы (байты UTF-8): строка заголовков и строки данных.
+        """
+        pieces = [self._prefix]
+        self._row(pieces, b"<w:trPr><w:tblHeader/></w:trPr>", headers)
+        for row in rows:
+            self._row(pieces, b"<w:trPr><w:cantSplit/></w:trPr>", row)
+        pieces.append(self._suffix)
+        return b"".join(pieces)
+
+
+class CompiledDocxTemplate:
+    """
+    Шаблон DOCX, разобранный один раз: word/document.xml хранится как список
+    неизменяемых фрагментов XML и слотов под значения меток, остальные части
+    пакета - в сжатом виде. Заполнение не строит дерево python-docx: значения
+    подставляются в слоты, собранный XML сжимается, прочие части копируются.
+
+    Метки, разбитые на несколько ранов, объединяются при компиляции тем же кодом,
+    что и при замене через python-docx, поэтому результат совпадает по тексту и
+    форматированию. Метка без значения остаётся в документе как есть.
+
+    table_markers - метки таблиц (@table1): абзац с такой меткой очищается,
+    а сразу после него при заполнении вставляется таблица, собранная DocxTableBuilder.
+    """
+
+    def __init__(self, data, formatting=False, clear_highlights=False, table_markers=()):
+        self.members = read_package(data)
+        document = Document(BytesIO(data))
+
+        # Таблицы вставляются после первого абзаца основного текста с меткой, как replace_table_in_document
+        self._table_width = document._block_width
+        self._table_builders = {}
+        self.table_markers = []
+        for marker in table_markers:
+            paragraph = next((p for p in document.paragraphs if marker in p.text), None)
+            if paragraph is None:
+                continue
+            paragraph.clear()
+            paragraph._p.addnext(etree.Comment(f"{_BLOCK_OPEN}{len(self.table_markers)}{_BLOCK_CLOSE}"))
+            self.table_markers.append(marker)
+
+        self.markers = sorted(_collect_markers(document))
+        slots = {marker: f"{_SLOT_OPEN}{index}{_SLOT_CLOSE}" for index, marker in enumerate(self.markers)}
+        pipeline = DocumentPipeline().substitute(PlaceholderReplacer(slots))
+        if formatting:
+            pipeline.set_font()
+        if clear_highlights:
+            pipeline.clear_highlights()
+        pipeline.remove_empty_runs().apply(document)
+
+        # Значение может начинаться или заканчиваться пробелом
+        for text_element in document.element.iter(qn("w:t")):
+            if text_element.text and _SLOT_OPEN in text_element.text:
+                text_element.set("{http://www.w3.org/XML/1998/namespace}space", "preserve")
+
+        # Части XML между слотами; слот - (метка, это таблица)
+        parts = _PART_SLOT_PATTERN.split(serialize_part_xml(document.element).decode("utf-8"))
+        self._chunks = [part.encode("utf-8") for part in parts[0::3]]
+        self._slots = [
+            (self.markers[int(text_index)], False) if text_index is not None
+            else (self.table_markers[int(block_index)], True)
+            for text_index, block_index in zip(parts[1::3], parts[2::3])
+        ]
+
+        if not any(member.name == _DOCUMENT_PART for member in self.members):
+            raise ValueError(f"В пакете нет {_DOCUMENT_PART}")
+
+    def _table_xml(self, headers, rows):
+        builder = self._table_builders.get(len(headers))
+        if builder is None:
+            builder = self._table_builders[len(headers)] = DocxTableBuilder(len(headers), self._table_width)
+        return builder.build(headers, rows)
+
+    def render_xml(self, replacements, tables=()):
+        """
+        tables - список (метка, заголовки, строки) для меток из table_markers.
+        """
+        replacer = replacements if isinstance(replacements, PlaceholderReplacer) else PlaceholderReplacer(replacements)
+        table_data = {marker: (headers, rows) for marker, headers, rows in tables}
+        rendered = {}
+        pieces = [self._chunks[0]]
+        for (marker, is_table), chunk in zip(self._slots, self._chunks[1:]):
+            if is_table:
+                if marker in table_data:
+                    pieces.append(self._table_xml(*table_data[marker]))
+            else:
+                if marker not in rendered:
+                    rendered[marker] = _render_value(replacer.sub(marker)).encode("utf-8")
+                pieces.append(rendered[marker])
+            pieces.append(chunk)
+        return b"".join(pieces)
+
+    def render(self, replacements, tables=()):
+        """
+        Байты готового DOCX.
+        """
+        return write_package(self.members, {_DOCUMENT_PART: self.render_xml(replacements, tables)})
+
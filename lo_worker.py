@@ -0,0 +1,106 @@
+"""
+Вспомогательный процесс пула LibreOffice.
+
+Запускается интерпретатором Python, в котором доступен модуль uno (пакет python3-uno),
+подключается к уже запущенному soffice через именованный канал и выполняет задания
+на конвертацию. Задания приходят построчно в JSON через stdin, ответы уходят в stdout.
+Модуль не импортирует ничего из приложения: он работает в другом интерпретаторе.
+"""
+import json
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+
+def _property(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+def connect(pipe_name, timeout):
+    """
+    Подключение к soffice, ожидая, пока он откроет канал.
+    """
+    local_context = uno.getComponentContext()
+    resolver = local_context.ServiceManager.createInstanceWithContext(
+        "com.sun.star.bridge.UnoUrlResolver", local_context
+    )
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            context = resolver.resolve(f"uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext")
+            break
+        except NoConnectException:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+    return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+
+
+def convert(desktop, source, target, filter_name):
+    document = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(source), "_blank", 0, (_property("Hidden", True),)
+    )
+    if document is None:
+        raise RuntimeError(f"LibreOffice не смог открыть {source}")
+    try:
+        document.storeToURL(uno.systemPathToFileUrl(target), (_property("FilterName", filter_name),))
+    finally:
+        document.close(True)
+
+
+def convert_batch(desktop, items):
+    """
+    Конвертация нескольких документов за одно задание. Ошибка одного документа
+    не прерывает остальные: возвращается словарь {номер: текст ошибки}.
+    """
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            convert(desktop, item["source"], item["target"], item["filter"])
+        except Exception as e:
+            errors[str(index)] = f"{type(e).__name__}: {e}"
+    return errors
+
+
+def _reply(payload):
+    sys.stdout.write(json.dumps(payload) + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    pipe_name = sys.argv[1]
+    timeout = float(sys.argv[2]) if len(sys.argv) > 2 else 60.0
+
+    desktop = connect(pipe_name, timeout)
+    _reply({"ok": True, "ready": True})
+
+    for line in sys.stdin:
+        job = json.loads(line)
+        command = job.get("command")
+        try:
+            if command == "ping":
+                desktop.getComponents()
+            elif command == "convert":
+                convert(desktop, job["source"], job["target"], job["filter"])
+            elif command == "convert_batch":
+                _reply({"ok": True, "errors": convert_batch(desktop, job["items"])})
+                continue
+            elif command == "quit":
+                _reply({"ok": True})
+                break
+            else:
+                raise ValueError(f"Неизвестная команда: {command}")
+            _reply({"ok": True})
+        except Exception as e:
+            _reply({"ok": False, "error": f"{type(e).__name__}: {e}"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,717 @@
+import asyncio
+import errno
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from io import BytesIO
+from pathlib import Path
+
+
+LIBREOFFICE_FILTERS = {
+    ".docx": "writer_pdf_Export",
+    ".xlsx": "calc_pdf_Export",
+}
+
+WORKER_SCRIPT = Path(__file__).resolve().with_name("lo_worker.py")
+
+
+class LibreOfficeWorkerError(RuntimeError):
+    pass
+
+
+def _libreoffice_env(home_path):
+    """
+    Окружение для soffice с отдельными HOME/XDG-каталогами внутри home_path.
+    """
+    runtime_path = home_path / "runtime"
+    config_path = home_path / "config"
+    cache_path = home_path / "cache"
+    runtime_path.mkdir(mode=0o700, exist_ok=True)
+    config_path.mkdir(exist_ok=True)
+    cache_path.mkdir(exist_ok=True)
+
+    env = os.environ.copy()
+    env["HOME"] = str(home_path)
+    env["XDG_RUNTIME_DIR"] = str(runtime_path)
+    env["XDG_CONFIG_HOME"] = str(config_path)
+    env["XDG_CACHE_HOME"] = str(cache_path)
+    return env
+
+
+# Свободное место в /dev/shm, без которого конвертация идёт в обычном каталоге временных файлов.
+# В Docker /dev/shm по умолчанию 64 МБ, поэтому размер задаётся в docker-compose.yml (shm_size)
+SHM_MIN_FREE_BYTES = 256 * 1024 * 1024
+
+
+def default_work_dir():
+    """
+    Каталог для файлов конвертации: /dev/shm (tmpfs в памяти), если он доступен
+    и в нём есть SHM_MIN_FREE_BYTES свободного места, иначе системный каталог временных файлов.
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        free = shutil.disk_usage("/dev/shm").free
+        if free >= SHM_MIN_FREE_BYTES:
+            return "/dev/shm"
+        print(f"В /dev/shm свободно {free // (1024 * 1024)} МБ, файлы конвертации размещаются "
+              f"в {tempfile.gettempdir()}")
+    return tempfile.gettempdir()
+
+
+def _is_no_space(error):
+    return isinstance(error, OSError) and error.errno == errno.ENOSPC
+
+
+_PROFILE_TEMPLATE = "syphon-lo-profile"
+
+
+def _seed_profile(work_dir, profile_path):
+    """
+    Копия заранее инициализированного профиля LibreOffice вместо создания нового при каждом запуске.
+    """
+    template_path = Path(work_dir) / _PROFILE_TEMPLATE
+    if template_path.is_dir() and not profile_path.exists():
+        try:
+            shutil.copytree(template_path, profile_path, symlinks=True)
+        except OSError as e:
+            # Нет места для копии: soffice создаст профиль сам
+            shutil.rmtree(profile_path, ignore_errors=True)
+            print(f"Не удалось скопировать профиль LibreOffice: {e}")
+
+
+def _store_profile_template(work_dir, profile_path):
+    """
+    Сохранение профиля после первой успешной конвертации как образца для следующих запусков.
+    """
+    template_path = Path(work_dir) / _PROFILE_TEMPLATE
+    if template_path.exists() or not profile_path.is_dir():
+        return
+    staging_path = Path(work_dir) / f"{_PROFILE_TEMPLATE}.{uuid.uuid4().hex}"
+    try:
+        shutil.copytree(profile_path, staging_path, symlinks=True, ignore=shutil.ignore_patterns(".lock"))
+        os.rename(staging_path, template_path)
+    except OSError:
+        # Образец уже сохранил другой процесс
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+
+async def convert_office_bytes_to_pdf(source_bytes, source_suffix, work_dir=None):
+    """
+    Разовая конвертация: отдельный запуск soffice.
+    """
+    [pdf_bytes] = await convert_office_documents_to_pdf([(source_bytes, source_suffix)], work_dir)
+    return pdf_bytes
+
+
+async def convert_office_documents_to_pdf(documents, work_dir=None):
+    """
+    Разовая конвертация нескольких документов одним запуском soffice.
+    documents - список (байты, расширение); результат - PDF в том же порядке.
+    Исходные файлы и PDF лежат в work_dir (по умолчанию /dev/shm), профиль
+    копируется из образца, сохранённого после первой конвертации.
+    Если в work_dir закончилось место, конвертация повторяется в каталоге временных файлов.
+    """
+    work_dir = work_dir or default_work_dir()
+    try:
+        return await _convert_documents_in(documents, work_dir)
+    except OSError as e:
+        # tmpfs заполнен: конвертация повторяется в каталоге временных файлов на диске
+        if not _is_no_space(e) or os.path.samefile(work_dir, tempfile.gettempdir()):
+            raise
+        print(f"Нет места в {work_dir}, конвертация в {tempfile.gettempdir()}")
+        return await _convert_documents_in(documents, tempfile.gettempdir())
+
+
+async def _convert_documents_in(documents, work_dir):
+    with tempfile.TemporaryDirectory(prefix="syphon-lo-", dir=work_dir) as temp_dir:
+        temp_path = Path(temp_dir)
+        profile_path = temp_path / "lo-profile"
+        env = _libreoffice_env(temp_path)
+        await asyncio.to_thread(_seed_profile, work_dir, profile_path)
+        source_paths = []
+        for index, (source_bytes, source_suffix) in enumerate(documents):
+            source_path = temp_path / f"document-{index}{source_suffix}"
+            source_path.write_bytes(source_bytes)
+            source_paths.append(source_path)
+
+        process = await asyncio.create_subprocess_exec(
+            "soffice",
+            "--headless",
+            f"-env:UserInstallation={profile_path.as_uri()}",
+            "--convert-to",
+            "pdf",
+            "--outdir",
+            str(temp_path),
+            *map(str, source_paths),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+        )
+        stdout, stderr = await process.communicate()
+
+        pdf_paths = [source_path.with_suffix(".pdf") for source_path in source_paths]
+        if process.returncode != 0 or not all(pdf_path.exists() for pdf_path in pdf_paths):
+            output = (stderr or stdout).decode("utf-8", errors="replace")
+            raise RuntimeError(f"LibreOffice PDF conversion failed: {output}")
+
+        await asyncio.to_thread(_store_profile_template, work_dir, profile_path)
+        return [pdf_path.read_bytes() for pdf_path in pdf_paths]
+
+
+def merge_pdfs(pdf_documents):
+    """
+    Объединение нескольких PDF в один в заданном порядке.
+    """
+    # pypdf нужен только для объединённых PDF, поэтому импортируется при первом вызове
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for pdf_bytes in pdf_documents:
+        writer.append(BytesIO(pdf_bytes))
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+class LibreOfficeWorker:
+    """
+    Долгоживущий headless soffice и связанный с ним процесс lo_worker.py.
+    Задания передаются через stdin/stdout вспомогательного процесса,
+    сам soffice слушает именованный канал и не перезапускается между заданиями.
+    """
+
+    def __init__(self, index, base_path, python_path, soffice_path="soffice", startup_timeout=60.0,
+                 work_dir=None):
+        self.index = index
+        self.base_path = base_path
+        self.work_dir = work_dir
+        self.python_path = python_path
+        self.soffice_path = soffice_path
+        self.startup_timeout = startup_timeout
+        self.home_path = None
+        self.spill_path = None
+        self.office = None
+        self.bridge = None
+        self.jobs_done = 0
+        self.last_used = 0.0
+
+    async def start(self):
+        self.home_path = self.base_path / f"worker-{self.index}-{uuid.uuid4().hex[:8]}"
+        self.home_path.mkdir(parents=True)
+        (self.home_path / "jobs").mkdir()
+        profile_path = self.home_path / "lo-profile"
+        env = _libreoffice_env(self.home_path)
+        if self.work_dir is not None:
+            await asyncio.to_thread(_seed_profile, self.work_dir, profile_path)
+        pipe_name = f"syphon_lo_{os.getpid()}_{self.home_path.name}"
+
+        self.office = await asyncio.create_subprocess_exec(
+            self.soffice_path,
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--nodefault",
+            "--norestore",
+            "--nolockcheck",
+            f"-env:UserInstallation={profile_path.as_uri()}",
+            f"--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=env,
+        )
+        self.bridge = await asyncio.create_subprocess_exec(
+            self.python_path,
+            str(WORKER_SCRIPT),
+            pipe_name,
+            str(self.startup_timeout),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=env,
+        )
+        await self._read_reply(self.startup_timeout)
+        self.jobs_done = 0
+        self.last_used = time.monotonic()
+
+    def is_alive(self):
+        return (
+            self.office is not None and self.office.returncode is None
+            and self.bridge is not None and self.bridge.returncode is None
+        )
+
+    async def _read_reply(self, timeout):
+        line = await asyncio.wait_for(self.bridge.stdout.readline(), timeout)
+        if not line:
+            raise LibreOfficeWorkerError(f"Процесс LibreOffice #{self.index} завершился")
+        reply = json.loads(line)
+        if not reply.get("ok"):
+            raise LibreOfficeWorkerError(reply.get("error") or "Неизвестная ошибка LibreOffice")
+        return reply
+
+    async def _request(self, payload, timeout):
+        self.bridge.stdin.write((json.dumps(payload) + "\n").encode("utf-8"))
+        await self.bridge.stdin.drain()
+        return await self._read_reply(timeout)
+
+    async def ping(self, timeout=10.0):
+        await self._request({"command": "ping"}, timeout)
+        self.last_used = time.monotonic()
+
+    def _stage(self, source_bytes, source_suffix):
+        """
+        Запись исходного файла задания: пути (исходный файл, PDF).
+        Если в каталоге процесса (обычно /dev/shm) нет места, файлы задания
+        размещаются в каталоге временных файлов на диске.
+        """
+        job_name = uuid.uuid4().hex
+        for jobs_path in (self.home_path / "jobs", None):
+            if jobs_path is None:
+                if self.spill_path is None:
+                    self.spill_path = Path(tempfile.mkdtemp(prefix=f"syphon-lo-jobs-{self.index}-"))
+                    print(f"Нет места для файлов LibreOffice #{self.index}, используется {self.spill_path}")
+                jobs_path = self.spill_path
+            source_path = jobs_path / f"{job_name}{source_suffix}"
+            try:
+                source_path.write_bytes(source_bytes)
+            except OSError as e:
+                source_path.unlink(missing_ok=True)
+                if not _is_no_space(e) or jobs_path == self.spill_path:
+                    raise
+                continue
+            return source_path, jobs_path / f"{job_name}.pdf"
+
+    async def convert(self, source_bytes, source_suffix, timeout):
+        filter_name = LIBREOFFICE_FILTERS.get(source_suffix)
+        if filter_name is None:
+            raise ValueError(f"Неподдерживаемый формат для PDF: {source_suffix}")
+
+        source_path, pdf_path = self._stage(source_bytes, source_suffix)
+        try:
+            await self._request(
+                {"command": "convert", "source": str(source_path), "target": str(pdf_path), "filter": filter_name},
+                timeout,
+            )
+            if not pdf_path.exists():
+                raise LibreOfficeWorkerError("LibreOffice не создал PDF")
+            return pdf_path.read_bytes()
+        finally:
+            self.jobs_done += 1
+            self.last_used = time.monotonic()
+            source_path.unlink(missing_ok=True)
+            pdf_path.unlink(missing_ok=True)
+
+    async def convert_batch(self, documents, timeout):
+        """
+        Конвертация нескольких документов одним заданием в уже открытом soffice.
+        Для документа, который LibreOffice не смог сконвертировать, вместо байтов возвращается исключение.
+        """
+        items = []
+        paths = []
+        try:
+            for source_bytes, source_suffix in documents:
+                filter_name = LIBREOFFICE_FILTERS.get(source_suffix)
+                if filter_name is None:
+                    raise ValueError(f"Неподдерживаемый формат для PDF: {source_suffix}")
+                source_path, pdf_path = self._stage(source_bytes, source_suffix)
+                paths.append((source_path, pdf_path))
+                items.append({"source": str(source_path), "target": str(pdf_path), "filter": filter_name})
+
+            reply = await self._request({"command": "convert_batch", "items": items}, timeout)
+            errors = reply.get("errors") or {}
+            results = []
+            for index, (_, pdf_path) in enumerate(paths):
+                if str(index) in errors:
+                    results.append(RuntimeError(f"LibreOffice PDF conversion failed: {errors[str(index)]}"))
+                elif not pdf_path.exists():
+                    results.append(RuntimeError("LibreOffice не создал PDF"))
+                else:
+                    results.append(pdf_path.read_bytes())
+            return results
+        finally:
+            self.jobs_done += len(documents)
+            self.last_used = time.monotonic()
+            for source_path, pdf_path in paths:
+                source_path.unlink(missing_ok=True)
+                pdf_path.unlink(missing_ok=True)
+
+    async def stop(self):
+        if self.bridge is not None and self.bridge.returncode is None:
+            try:
+                await self._request({"command": "quit"}, 5.0)
+            except (LibreOfficeWorkerError, asyncio.TimeoutError, ConnectionError, ValueError):
+                pass
+
+        for process in (self.bridge, self.office):
+            if process is None or process.returncode is not None:
+                continue
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), 10.0)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+
+        self.bridge = None
+        self.office = None
+        if self.home_path is not None:
+            shutil.rmtree(self.home_path, ignore_errors=True)
+            self.home_path = None
+        if self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+            self.spill_path = None
+
+
+class LibreOfficePool:
+    """
+    Пул предварительно запущенных процессов LibreOffice для конвертации в PDF.
+    Процессы стартуют вместе с приложением, переиспользуются между запросами,
+    проверяются перед выдачей и перезапускаются после max_jobs заданий или падения.
+    Если пул не удалось запустить, используется разовая конвертация.
+
+    Профили, исходные файлы и PDF размещаются в work_dir (по умолчанию /dev/shm),
+    новые и перезапущенные процессы получают копию уже инициализированного профиля.
+    Пакеты конвертируются частями по batch_size документов, на каждую часть отводится batch_timeout секунд.
+    """
+
+    def __init__(self, size=2, max_jobs=200, job_timeout=120.0, startup_timeout=60.0,
+                 health_check_interval=60.0, python_path="/usr/bin/python3", soffice_path="soffice",
+                 work_dir=None, batch_size=10, batch_timeout=300.0):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.job_timeout = job_timeout
+        self.batch_size = max(1, batch_size)
+        self.batch_timeout = batch_timeout
+        self.startup_timeout = startup_timeout
+        self.health_check_interval = health_check_interval
+        self.python_path = python_path
+        self.soffice_path = soffice_path
+        self.work_dir = work_dir or default_work_dir()
+        self.base_path = None
+        self.workers = []
+        self._idle = None
+        self._recycling = set()
+
+    @property
+    def started(self):
+        return bool(self.workers)
+
+    async def start(self):
+        """
+        Запуск процессов пула.
+        """
+        if self.started or self.size <= 0:
+            return
+
+        if not WORKER_SCRIPT.exists() or not Path(self.python_path).exists():
+            print(f"Пул LibreOffice отключен: не найден интерпретатор с uno ({self.python_path}).")
+            return
+
+        self.base_path = Path(tempfile.mkdtemp(prefix="syphon-lo-", dir=self.work_dir))
+        self._idle = asyncio.Queue()
+        workers = [
+            LibreOfficeWorker(index, self.base_path, self.python_path, self.soffice_path, self.startup_timeout,
+                              work_dir=self.work_dir)
+            for index in range(self.size)
+        ]
+        results = await asyncio.gather(*(worker.start() for worker in workers), return_exceptions=True)
+
+        for worker, result in zip(workers, results):
+            if isinstance(result, BaseException):
+                print(f"Не удалось запустить LibreOffice #{worker.index}: {result}")
+                await worker.stop()
+                continue
+            self.workers.append(worker)
+            self._idle.put_nowait(worker)
+
+        if self.workers:
+            await asyncio.to_thread(
+                _store_profile_template, self.work_dir, self.workers[0].home_path / "lo-profile"
+            )
+            print(f"Пул LibreOffice запущен: {len(self.workers)} из {self.size} процессов ({self.work_dir}).")
+        else:
+            shutil.rmtree(self.base_path, ignore_errors=True)
+            self.base_path = None
+            print("Пул LibreOffice не запущен, используется разовая конвертация.")
+
+    async def close(self):
+        """
+        Остановка всех процессов пула.
+        """
+        workers, self.workers = self.workers, []
+        for task in list(self._recycling):
+            task.cancel()
+        await asyncio.gather(*(worker.stop() for worker in workers), return_exceptions=True)
+        if self.base_path is not None:
+            shutil.rmtree(self.base_path, ignore_errors=True)
+            self.base_path = None
+        self._idle = None
+
+    async def _restart(self, worker):
+        await worker.stop()
+        try:
+            await worker.start()
+        except Exception as e:
+            print(f"Не удалось перезапустить LibreOffice #{worker.index}: {e}")
+            await worker.stop()
+            return False
+        print(f"LibreOffice #{worker.index} перезапущен.")
+        return True
+
+    async def _acquire(self):
+        worker = await self._idle.get()
+        healthy = worker.is_alive()
+        if healthy and time.monotonic() - worker.last_used > self.health_check_interval:
+            try:
+                await worker.ping()
+            except (LibreOfficeWorkerError, asyncio.TimeoutError, ConnectionError):
+                healthy = False
+
+        if not healthy and not await self._restart(worker):
+            self._idle.put_nowait(worker)
+            raise LibreOfficeWorkerError(f"LibreOffice #{worker.index} недоступен")
+        return worker
+
+    async def _recycle(self, worker):
+        await self._restart(worker)
+        if worker in self.workers:
+            self._idle.put_nowait(worker)
+
+    def _release(self, worker, failed=False):
+        if not failed and worker.jobs_done < self.max_jobs:
+            self._idle.put_nowait(worker)
+            return
+
+        # Перезапуск идет в фоне, чтобы не задерживать ответ на текущий запрос
+        task = asyncio.create_task(self._recycle(worker))
+        self._recycling.add(task)
+        task.add_done_callback(self._recycling.discard)
+
+    async def convert(self, source_bytes, source_suffix):
+        """
+        Конвертация документа в PDF на свободном процессе пула.
+        При падении процесса он перезапускается, а задание повторяется один раз.
+        """
+        if not self.started:
+            return await convert_office_bytes_to_pdf(source_bytes, source_suffix, self.work_dir)
+        if source_suffix not in LIBREOFFICE_FILTERS:
+            raise ValueError(f"Неподдерживаемый формат для PDF: {source_suffix}")
+
+        for attempt in range(2):
+            worker = await self._acquire()
+            try:
+                pdf_bytes = await worker.convert(source_bytes, source_suffix, self.job_timeout)
+            except (LibreOfficeWorkerError, asyncio.TimeoutError, ConnectionError) as e:
+                self._release(worker, failed=True)
+                if attempt:
+                    raise RuntimeError(f"LibreOffice PDF conversion failed: {e}") from e
+                print(f"Ошибка LibreOffice #{worker.index}: {e}. Повторная попытка...")
+                continue
+            except BaseException:
+                self._release(worker, failed=True)
+                raise
+            self._release(worker)
+            return pdf_bytes
+
+    def _chunks(self, documents):
+        return [documents[start:start + self.batch_size] for start in range(0, len(documents), self.batch_size)]
+
+    async def _convert_chunk(self, chunk):
+        """
+        Конвертация части пакета одним заданием на свободном процессе пула.
+        Если процесс упал или не уложился в batch_timeout, задание повторяется один раз,
+        после второй неудачи вместо PDF каждого документа части возвращается исключение.
+        """
+        for attempt in range(2):
+            worker = await self._acquire()
+            try:
+                results = await worker.convert_batch(chunk, self.batch_timeout)
+            except (LibreOfficeWorkerError, asyncio.TimeoutError, ConnectionError) as e:
+                self._release(worker, failed=True)
+                if attempt:
+                    error = RuntimeError(f"LibreOffice PDF conversion failed: {e}")
+                    return [error] * len(chunk)
+                print(f"Ошибка LibreOffice #{worker.index}: {e}. Повторная попытка...")
+                continue
+            except BaseException:
+                self._release(worker, failed=True)
+                raise
+            self._release(worker)
+            return results
+
+    async def _convert_chunk_once(self, chunk):
+        try:
+            return await convert_office_documents_to_pdf(chunk, self.work_dir)
+        except (RuntimeError, OSError) as e:
+            return [e] * len(chunk)
+
+    async def convert_many(self, documents, return_exceptions=False):
+        """
+        Конвертация нескольких документов (список (байты, расширение)).
+        Документы делятся на части по batch_size, каждая часть - одно задание на свободном процессе пула,
+        поэтому части большого пакета идут параллельно на всех процессах, а на диске одновременно
+        лежат только файлы выполняемых частей. При return_exceptions=True для документа,
+        который не удалось сконвертировать, вместо байтов возвращается исключение,
+        иначе первое такое исключение пробрасывается.
+        """
+        if not documents:
+            return []
+        for _, source_suffix in documents:
+            if source_suffix not in LIBREOFFICE_FILTERS:
+                raise ValueError(f"Неподдерживаемый формат для PDF: {source_suffix}")
+
+        if self.started:
+            chunk_results = await asyncio.gather(*(self._convert_chunk(chunk) for chunk in self._chunks(documents)))
+        else:
+            # Разовая конвертация: части по очереди, чтобы не запускать много soffice сразу
+            chunk_results = [await self._convert_chunk_once(chunk) for chunk in self._chunks(documents)]
+
+        results = [result for chunk in chunk_results for result in chunk]
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+
+class ConversionQueueFull(RuntimeError):
+    """
+    Очередь конвертации переполнена или ожидание в ней истекло.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"Очередь конвертации PDF переполнена, повторите через {retry_after} с.")
+        self.retry_after = retry_after
+
+
+class ConversionScheduler:
+    """
+    Допуск заданий конвертации: не более concurrency одновременных конвертаций,
+    не более max_queue ожидающих, ожидание в очереди не дольше queue_timeout.
+    Ведет счетчики глубины очереди, времени ожидания и времени конвертации.
+    """
+
+    def __init__(self, converter, concurrency=2, max_queue=20, queue_timeout=30.0):
+        self.converter = converter
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.running = 0
+        self.waiting = 0
+        self.submitted = 0
+        self.admitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.conversion_time_total = 0.0
+        self.conversion_time_max = 0.0
+
+    def retry_after(self):
+        """
+        Оценка в секундах, когда очередь успеет продвинуться.
+        """
+        finished = self.completed + self.failed
+        average = self.conversion_time_total / finished if finished else 5.0
+        return max(1, math.ceil(average * (self.waiting + 1) / self.concurrency))
+
+    async def _admit(self):
+        if not self._semaphore.locked():
+            # Свободный слот занимается сразу, без постановки в очередь
+            await self._semaphore.acquire()
+            self.admitted += 1
+            return
+
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise ConversionQueueFull(self.retry_after())
+
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise ConversionQueueFull(self.retry_after()) from None
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    async def convert(self, source_bytes, source_suffix):
+        """
+        Конвертация в PDF с учетом ограничений очереди.
+        """
+        self.submitted += 1
+        await self._admit()
+
+        self.running += 1
+        started = time.monotonic()
+        try:
+            pdf_bytes = await self.converter.convert(source_bytes, source_suffix)
+        except BaseException:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+            return pdf_bytes
+        finally:
+            elapsed = time.monotonic() - started
+            self.conversion_time_total += elapsed
+            self.conversion_time_max = max(self.conversion_time_max, elapsed)
+            self.running -= 1
+            self._semaphore.release()
+
+    async def convert_many(self, documents, return_exceptions=False):
+        """
+        Пакетная конвертация занимает один слот очереди на весь пакет.
+        """
+        self.submitted += 1
+        await self._admit()
+
+        self.running += 1
+        started = time.monotonic()
+        try:
+            pdf_documents = await self.converter.convert_many(documents, return_exceptions=return_exceptions)
+        except BaseException:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+            return pdf_documents
+        finally:
+            elapsed = time.monotonic() - started
+            self.conversion_time_total += elapsed
+            self.conversion_time_max = max(self.conversion_time_max, elapsed)
+            self.running -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        """
+        Текущее состояние очереди и накопленные счетчики.
+        """
+        finished = self.completed + self.failed
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "submitted": self.submitted,
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_time_avg": round(self.wait_time_total / self.admitted, 4) if self.admitted else 0.0,
+            "wait_time_max": round(self.wait_time_max, 4),
+            "conversion_time_avg": round(self.conversion_time_total / finished, 4) if finished else 0.0,
+            "conversion_time_max": round(self.conversion_time_max, 4),
+        }
@@ -0,0 +1,139 @@
+import struct
+import zipfile
+import zlib
+
+
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+_END_RECORD = struct.Struct("<4s4H2LH")
+
+# Бит 11 - имя в UTF-8, биты 1-2 - параметры сжатия. Бит 3 (data descriptor)
+# сбрасывается: размеры и CRC пишутся сразу в локальный заголовок.
+_KEPT_FLAGS = 0x0806
+
+
+class PackageMember:
+    """
+    Элемент zip-пакета (DOCX/XLSX) с уже сжатыми байтами в исходном виде.
+    """
+
+    __slots__ = ("info", "raw")
+
+    def __init__(self, info, raw):
+        self.info = info
+        self.raw = raw
+
+    @property
+    def name(self):
+        return self.info.filename
+
+
+def read_package(data):
+    """
+    Чтение элементов zip-архива без распаковки: сохраняются сжатые данные,
+    CRC и размеры, чтобы при записи копировать элементы без повторного сжатия.
+    """
+    members = []
+    with zipfile.ZipFile(_BytesReader(data)) as archive:
+        for info in archive.infolist():
+            offset = info.header_offset
+            if data[offset:offset + 4] != b"PK\x03\x04":
+                raise zipfile.BadZipFile(f"Повреждён локальный заголовок {info.filename}")
+            name_length, extra_length = struct.unpack("<2H", data[offset + 26:offset + 30])
+            start = offset + 30 + name_length + extra_length
+            members.append(PackageMember(info, data[start:start + info.compress_size]))
+    return members
+
+
+def read_member(member):
+    """
+    Распакованное содержимое элемента.
+    """
+    if member.info.compress_type == zipfile.ZIP_STORED:
+        return bytes(member.raw)
+    if member.info.compress_type == zipfile.ZIP_DEFLATED:
+        return zlib.decompress(member.raw, -15)
+    raise zipfile.BadZipFile(f"Неподдерживаемый метод сжатия {member.info.compress_type}")
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    dos_time = (hour << 11) | (minute << 5) | (second // 2)
+    dos_date = ((year - 1980) << 9) | (month << 5) | day
+    return dos_time, dos_date
+
+
+def write_package(members, replaced, compress_level=6):
+    """
+    Сборка zip-архива: элементы из replaced (имя -> новые байты) сжимаются заново,
+    остальные копируются как есть. Порядок элементов сохраняется.
+    """
+    chunks = []
+    central = []
+    offset = 0
+
+    for member in members:
+        info = member.info
+        flags = info.flag_bits & _KEPT_FLAGS
+        name = info.filename.encode("utf-8" if flags & 0x800 else "cp437")
+
+        if info.filename in replaced:
+            content = replaced[info.filename]
+            compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+            raw = compressor.compress(content) + compressor.flush()
+            method = zipfile.ZIP_DEFLATED
+            crc = zlib.crc32(content)
+            size = len(content)
+        else:
+            raw = member.raw
+            method = info.compress_type
+            crc = info.CRC
+            size = info.file_size
+
+        dos_time, dos_date = _dos_datetime(info.date_time)
+        header = _LOCAL_HEADER.pack(
+            b"PK\x03\x04", 20, flags, method, dos_time, dos_date, crc, len(raw), size, len(name), 0
+        )
+        chunks.extend((header, name, raw))
+        central.append(_CENTRAL_HEADER.pack(
+            b"PK\x01\x02", 20 | (info.create_system << 8), 20, flags, method, dos_time, dos_date,
+            crc, len(raw), size, len(name), 0, 0, 0, info.internal_attr, info.external_attr, offset
+        ) + name)
+        offset += len(header) + len(name) + len(raw)
+
+    central_size = sum(len(entry) for entry in central)
+    end_record = _END_RECORD.pack(b"PK\x05\x06", 0, 0, len(central), len(central), central_size, offset, 0)
+    return b"".join(chunks + central + [end_record])
+
+
+class _BytesReader:
+    """
+    Минимальный файловый объект над bytes без копирования данных.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._position = 0
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += len(self._view)
+        self._position = offset
+        return self._position
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._position + size
+        chunk = bytes(self._view[self._position:end])
+        self._position += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
@@ -0,0 +1,283 @@
+"""
+Нагрузочный замер формирования документов по всем шаблонам static/docs.
+
+Запуск: python render_benchmark.py [--profiles small,typical,large] [--repeat 20]
+        [--templates llc_,kdn_] [--pdf] [--baseline benchmark_baseline.json]
+        [--save-baseline benchmark_baseline.json] [--threshold 0.2]
+
+Работает без MySQL и LibreOffice: данные актов и договоров синтетические, но того же
+вида, что приходят из базы, а документы актов ООО и КДН собираются теми же функциями
+document_builders, что и в приложении. Профиль задаёт размер парка оборудования
+(строк в таблицах додатка 1 и додатка ООО, моделей и IP-адресов в актах).
+
+Каждый шаблон замеряется в отдельном процессе, поэтому пиковая память (RSS)
+относится к одному шаблону. Для каждого шаблона выводятся p50/p95 времени
+формирования, пиковая память и размер результата, а при --pdf и наличии soffice -
+время конвертации в PDF. С базовой линией (--baseline) сравниваются p95 и память:
+рост больше --threshold считается регрессией, и скрипт завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+# Размер парка оборудования по профилям: число устройств
+PROFILES = {"small": 5, "typical": 60, "large": 3000}
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+TEMPLATES_DIR = os.getenv("TEMPLATES_DIR", "static/docs")
+
+# Шаблоны актов ООО и КДН: (семейство, вид документа); КДН формируется как kdn-new (с PDF)
+_ACT_TEMPLATES = {
+    "llc_report": ("llc", "report"), "llc_act": ("llc", "act"), "llc_bill": ("llc", "bill"),
+    "kdn_report": ("kdn-new", "report"), "kdn_act": ("kdn-new", "act"), "kdn_bill": ("kdn-new", "bill"),
+}
+# Шаблоны с таблицами оборудования
+_TABLE_TEMPLATES = {
+    "M-RI_dod1": (['Найменування (модель) технічних засобів електронних комунікацій', 'Кількість'],
+                  ['Діапазон ІР адрес технічних засобів електронних комунікацій']),
+    "llc_appendix": (['Модель обладнання', 'Кількість'], ['Діапазон ІР адрес']),
+}
+# Шаблоны, которые приложение формирует без форматирования шрифта
+_PLAIN_TEMPLATES = ("llc_proto", "KDN_proto")
+
+_MODELS = ("DES-1210-28/ME", "DGS-1100-06/ME", "SNR-S2985G-24T", "TL-SG105E", "Контроль питания, ранг 3",
+           "Eltex MES2324B", "Huawei S2320-28TP", "Zyxel GS1200-8")
+
+
+def _ip(index):
+    return f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+
+
+def _synthetic_value(marker, rng):
+    """
+    Значение метки того же вида и длины, что приходит из базы.
+    """
+    name = marker.lower()
+    if "date" in name:
+        return f"{rng.randint(1, 28):02d} березня 2025 року"
+    if "sum" in name and "words" not in name and "caps" not in name:
+        return f"{rng.uniform(1000, 90000):.2f}"
+    if "words" in name or "caps" in name:
+        return "сорок дві тисячі триста гривень п'ятдесят копійок"
+    if "iban" in name:
+        return "UA" + "".join(str(rng.randint(0, 9)) for _ in range(27))
+    if "inn" in name or "edrpou" in name:
+        return "".join(str(rng.randint(0, 9)) for _ in range(10))
+    if "address" in name:
+        return f"м. Київ, вул. Хрещатик, буд. {rng.randint(1, 200)}, кв. {rng.randint(1, 300)}"
+    if "name" in name or "persona" in name:
+        return f"Товариство з обмеженою відповідальністю «Тестова мережа {rng.randint(1, 999)}»"
+    return f"Значення {marker[1:]} {rng.randint(1, 9999)}"
+
+
+def _act_data(devices, kdn, rng):
+    """
+    Строка акта (21 поле запроса load_llc_act) и строки llc_acts_data для парка из devices устройств.
+    """
+    data = (
+        date(2025, 3, 1), round(devices * 750 + rng.uniform(0, 5000), 2), 15, "ТОВ-15/2024", date(2024, 1, 10),
+        "ТОВ «Тестова мережа»", 38736443 if kdn else 40123456, "ФОП Тестовий Тест Тестович",
+        "UA213223130000026007233566001", "АТ КБ «ПриватБанк»", "м. Київ, вул. Хрещатик, 1", "+380441234567",
+        "1234567890", "Тестовий Т.Т.", "директора Іваненка І.І.", "Виписки з ЄДР", "м. Київ, вул. Січова, 2",
+        "UA903052992990004149123456789", "АТ «Ощадбанк»", "401234567890", "ТОВ «Мережа»",
+    )
+    ranks = (1, 2) if kdn else (4, 3)
+    acts_data = []
+    for rank in ranks:
+        count = max(1, devices // 2)
+        models = ", ".join(_MODELS[index % len(_MODELS)] for index in range(count))
+        ips = ", ".join(_ip(index) for index in range(count))
+        acts_data.append((rank, models, count, ips, 0.0))
+    acts_data.append((0, "Консультації", 1, _ip(devices), rng.uniform(1, 40)))
+    return data, acts_data
+
+
+def benchmark_job(name, marker_names, devices, seed=1):
+    """
+    Задание на формирование шаблона name для парка из devices устройств:
+    (RenderJob, формируется ли документ в PDF в приложении).
+    """
+    from document_builders import _llc_act_document, llc_act_context
+    from render_executor import RenderJob
+
+    rng = random.Random(seed)
+    if name in _ACT_TEMPLATES:
+        family, kind = _ACT_TEMPLATES[name]
+        data, acts_data = _act_data(devices, family == "kdn-new", rng)
+        built = _llc_act_document(family, kind, data[2], data, acts_data, llc_act_context(data))
+        return built.job, built.pdf
+
+    replacements = {marker: _synthetic_value(marker, rng) for marker in marker_names}
+    options = {} if name in _PLAIN_TEMPLATES else {"formatting": True}
+    tables = None
+    if name in _TABLE_TEMPLATES:
+        models_header, ips_header = _TABLE_TEMPLATES[name]
+        models = [[f"{_MODELS[index % len(_MODELS)]} ({index})", rng.randint(1, 4)] for index in range(devices)]
+        ips = [[f"{_ip(index * 8)} - {_ip(index * 8 + 7)}"] for index in range(devices)]
+        tables = [("@table1", models_header, models), ("@table2", ips_header, ips)]
+        for marker, _, _ in tables:
+            replacements.pop(marker, None)
+    return RenderJob(name, replacements, tables=tables, options=options), False
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _measure(name, path, devices, repeat, pdf):
+    """
+    Замер одного шаблона; выполняется в отдельном процессе.
+    """
+    from docx_templates import CompiledDocxTemplate
+    from template_registry import TemplateRegistry
+    from render_executor import render_job
+
+    registry = TemplateRegistry(os.path.dirname(path), check_interval=3600)
+    marker_names = ()
+    if path.lower().endswith(".docx"):
+        marker_names = CompiledDocxTemplate(registry.get(name).data).markers
+    job, app_pdf = benchmark_job(name, marker_names, devices)
+
+    # Первый прогон компилирует шаблон, как первый запрос после запуска
+    started = time.perf_counter()
+    data = render_job(job, registry)
+    first_ms = (time.perf_counter() - started) * 1000
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        data = render_job(job, registry)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    result = {
+        "first_ms": round(first_ms, 2),
+        "p50_ms": round(_percentile(timings, 0.5), 2),
+        "p95_ms": round(_percentile(timings, 0.95), 2),
+        "size": len(data),
+        "pdf_in_app": app_pdf,
+    }
+
+    if pdf:
+        from office_converter import convert_office_bytes_to_pdf
+        started = time.perf_counter()
+        pdf_bytes = asyncio.run(convert_office_bytes_to_pdf(data, os.path.splitext(path)[1].lower()))
+        result["pdf_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        result["pdf_size"] = len(pdf_bytes)
+
+    # ru_maxrss в Linux - в килобайтах
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def run_benchmark(profiles, repeat, template_filter=(), pdf=False):
+    """
+    Результаты по всем шаблонам и профилям: {"шаблон/профиль": {метрики}}.
+    """
+    templates = []
+    for file_name in sorted(os.listdir(TEMPLATES_DIR)):
+        stem, extension = os.path.splitext(file_name)
+        if extension.lower() not in (".docx", ".xlsx") or file_name.startswith("~$"):
+            continue
+        if template_filter and not any(stem.startswith(prefix) for prefix in template_filter):
+            continue
+        templates.append((stem, os.path.join(TEMPLATES_DIR, file_name)))
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for profile in profiles:
+        for name, path in templates:
+            # Новый процесс на каждый шаблон: пиковая память не накапливается между шаблонами
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[f"{name}/{profile}"] = executor.submit(
+                    _measure, name, path, PROFILES[profile], repeat, pdf
+                ).result()
+    return results
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """
+    Регрессии относительно базовой линии: список строк с описанием.
+    Сравниваются p95 времени и пиковая память; рост больше threshold (доля) - регрессия.
+    """
+    regressions = []
+    for case, metrics in results.items():
+        base = baseline.get(case)
+        if base is None:
+            continue
+        for metric in ("p95_ms", "peak_rss_mb"):
+            if metric in base and base[metric] > 0 and metrics[metric] > base[metric] * (1 + threshold):
+                growth = (metrics[metric] / base[metric] - 1) * 100
+                regressions.append(f"{case}: {metric} {base[metric]} -> {metrics[metric]} (+{growth:.0f}%)")
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"{'шаблон/профиль':<28} {'первый':>9} {'p50':>9} {'p95':>9} {'RSS МБ':>8} {'размер':>10} {'PDF':>9}")
+    for case, metrics in results.items():
+        pdf_ms = f"{metrics['pdf_ms']:.1f}" if "pdf_ms" in metrics else "-"
+        line = (f"{case:<28} {metrics['first_ms']:>9.1f} {metrics['p50_ms']:>9.2f} {metrics['p95_ms']:>9.2f} "
+                f"{metrics['peak_rss_mb']:>8.1f} {metrics['size']:>10} {pdf_ms:>9}")
+        base = (baseline or {}).get(case)
+        if base and base.get("p95_ms"):
+            line += f"  p95 {(metrics['p95_ms'] / base['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер формирования документов по шаблонам static/docs")
+    parser.add_argument("--profiles", default="small,typical,large",
+                        help=f"профили парка оборудования: {', '.join(PROFILES)}")
+    parser.add_argument("--repeat", type=int, default=20, help="число замеров на шаблон")
+    parser.add_argument("--templates", default="", help="префиксы имён шаблонов через запятую")
+    parser.add_argument("--pdf", action="store_true", help="замерить конвертацию в PDF (нужен soffice)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="файл базовой линии для сравнения")
+    parser.add_argument("--save-baseline", metavar="PATH", help="сохранить результаты как базовую линию")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимый рост p95 и памяти (доля)")
+    args = parser.parse_args()
+
+    profiles = [profile.strip() for profile in args.profiles.split(",") if profile.strip()]
+    unknown = [profile for profile in profiles if profile not in PROFILES]
+    if unknown:
+        parser.error(f"неизвестные профили: {', '.join(unknown)}")
+
+    pdf = args.pdf
+    if pdf and shutil.which("soffice") is None:
+        print("soffice не найден, замер конвертации в PDF пропущен")
+        pdf = False
+
+    template_filter = tuple(prefix.strip() for prefix in args.templates.split(",") if prefix.strip())
+    results = run_benchmark(profiles, max(1, args.repeat), template_filter, pdf)
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(results, baseline_file, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"Базовая линия сохранена: {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"Регрессии (порог {args.threshold * 100:.0f}%):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("Регрессий относительно базовой линии нет")
+
+
+if __name__ == "__main__":
+    main()
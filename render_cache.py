@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class RenderCache:
+    """
+    Дисковый кэш готовых документов (DOCX, XLSX, PDF) с вытеснением давно
+    не использованных записей по суммарному размеру.
+
+    Ключ - хэш версии шаблона и полностью подставленных данных (значения меток,
+    строки таблиц, параметры, формат результата), поэтому изменившиеся данные
+    дают новый ключ и устаревший документ не отдаётся. Теги ('llc_act:15',
+    'agreement:7') позволяют сразу освободить место при изменении акта или договора.
+
+    Каждая запись - файл <ключ>.bin и файл тегов <ключ>.tags. Индекс LRU хранится
+    в памяти и восстанавливается по mtime файлов при запуске. max_bytes <= 0 отключает кэш.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(template_version, job, output_format):
+        payload = json.dumps({
+            "template": job.template,
+            "version": template_version,
+            "replacements": job.replacements,
+            "tables": job.tables,
+            "options": job.options,
+            "format": output_format,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key, suffix=".bin"):
+        return os.path.join(self.directory, key + suffix)
+
+    def _load_index(self):
+        files = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(".tmp"):
+                # Недописанный файл после аварийного завершения
+                os.remove(os.path.join(self.directory, file_name))
+                continue
+            if not file_name.endswith(".bin"):
+                continue
+            stat = os.stat(os.path.join(self.directory, file_name))
+            files.append((stat.st_mtime_ns, file_name[:-4], stat.st_size))
+
+        for _, key, size in sorted(files):
+            try:
+                with open(self._path(key, ".tags"), encoding="utf-8") as tags_file:
+                    tags = tuple(json.load(tags_file))
+            except (OSError, ValueError):
+                tags = ()
+            self._add_entry(key, size, tags)
+
+        with self._lock:
+            self._evict()
+
+    def _add_entry(self, key, size, tags):
+        self._entries[key] = (size, tags)
+        self._size += size
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+    def _drop_entry(self, key):
+        size, tags = self._entries.pop(key)
+        self._size -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+        for suffix in (".bin", ".tags"):
+            try:
+                os.remove(self._path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            self._drop_entry(next(iter(self._entries)))
+            self.evictions += 1
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            with open(self._path(key), "rb") as cached_file:
+                data = cached_file.read()
+            # mtime хранит порядок LRU между перезапусками
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            # Запись удалена другим процессом, работающим с тем же каталогом
+            with self._lock:
+                if key in self._entries:
+                    self._drop_entry(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data, tags=()):
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+
+        tags = tuple(tags)
+        temp_path = self._path(f"{key}.{uuid.uuid4().hex}", ".tmp")
+        with open(temp_path, "wb") as temp_file:
+            temp_file.write(data)
+        with open(self._path(key, ".tags"), "w", encoding="utf-8") as tags_file:
+            json.dump(list(tags), tags_file)
+        os.replace(temp_path, self._path(key))
+
+        with self._lock:
+            if key in self._entries:
+                size, _ = self._entries.pop(key)
+                self._size -= size
+            self._add_entry(key, len(data), tags)
+            self.stores += 1
+            self._evict()
+
+    def invalidate(self, *tags):
+        """
+        Удаление всех записей с любым из тегов. Возвращает число удалённых записей.
+        """
+        if not self.enabled:
+            return 0
+
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    if key in self._entries:
+                        self._drop_entry(key)
+                        removed += 1
+            self.invalidations += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,131 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from docx_templates import CompiledDocxTemplate
+from template_registry import TemplateRegistry
+from xlsx_templates import CompiledXlsxTemplate
+
+
+class RenderJob:
+    """
+    Задание на формирование документа, которое можно передать в другой процесс:
+    логическое имя шаблона, значения меток, таблицы и параметры компиляции шаблона.
+
+    tables - список (метка, заголовки, строки) для вставки таблиц вместо меток вида @table1.
+    Значения приводятся к строкам сразу, как это делает замена в документе.
+    """
+
+    __slots__ = ("template", "replacements", "tables", "options")
+
+    def __init__(self, template, replacements, tables=None, options=None):
+        self.template = template
+        self.replacements = {key: str(value) for key, value in replacements.items()}
+        self.tables = [
+            (marker, list(headers), [[str(value) for value in row] for row in rows])
+            for marker, headers, rows in (tables or [])
+        ]
+        self.options = dict(options or {})
+
+
+def render_job(job, registry):
+    """
+    Байты готового документа по заданию.
+    """
+    if registry.get(job.template).path.lower().endswith(".xlsx"):
+        template = registry.compiled(job.template, CompiledXlsxTemplate, **job.options)
+        return template.render(job.replacements)
+
+    # Таблицы собираются в XML и вставляются в слоты скомпилированного шаблона
+    table_markers = tuple(marker for marker, _, _ in job.tables)
+    if table_markers:
+        template = registry.compiled(job.template, CompiledDocxTemplate, table_markers=table_markers, **job.options)
+    else:
+        template = registry.compiled(job.template, CompiledDocxTemplate, **job.options)
+    return template.render(job.replacements, job.tables)
+
+
+# Реестр шаблонов процесса-исполнителя
+_worker_registry = None
+
+
+def _init_worker(templates_dir, check_interval):
+    global _worker_registry
+    _worker_registry = TemplateRegistry(templates_dir, check_interval=check_interval)
+    _worker_registry.preload()
+
+
+def _render_in_worker(job):
+    return render_job(job, _worker_registry)
+
+
+def _render_ping():
+    return os.getpid()
+
+
+class RenderExecutor:
+    """
+    Пул процессов для формирования документов: python-docx, openpyxl и сборка
+    zip-пакетов выполняются вне цикла событий Quart и на всех ядрах.
+
+    Каждый процесс держит свой реестр шаблонов и кэш скомпилированных шаблонов.
+    При workers=0 документы формируются в потоке текущего процесса
+    по реестру приложения (для отладки и машин с одним ядром).
+    """
+
+    def __init__(self, registry, workers=None):
+        self.registry = registry
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self._executor = None
+
+    async def start(self):
+        if self.workers <= 0 or self._executor is not None:
+            return
+
+        self._executor = self._create_executor()
+        # Процессы запускаются и загружают шаблоны до первого запроса
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _render_ping) for _ in range(self.workers)
+        ))
+        print(f"Пул формирования документов запущен: {self.workers} процессов")
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.registry.directory, self.registry.check_interval),
+        )
+
+    async def close(self):
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    async def render(self, job):
+        """
+        Байты готового документа. Если пул не запущен, документ формируется в потоке.
+        """
+        if self._executor is None:
+            return await asyncio.to_thread(render_job, job, self.registry)
+
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, _render_in_worker, job)
+        except BrokenProcessPool:
+            # Процесс-исполнитель упал (например, по памяти): пересоздаём пул и повторяем один раз.
+            # Задания, отправленные в тот же пул, получают BrokenProcessPool одновременно:
+            # пул заменяет только первое из них, остальные повторяются на уже созданном новом пуле.
+            # Между проверкой и заменой нет await, поэтому сравнения с захваченным пулом достаточно
+            if self._executor is executor:
+                print("Пул формирования документов повреждён, перезапуск")
+                self._executor = self._create_executor()
+                executor.shutdown(wait=False, cancel_futures=True)
+            if self._executor is None:
+                return await asyncio.to_thread(render_job, job, self.registry)
+            return await loop.run_in_executor(self._executor, _render_in_worker, job)
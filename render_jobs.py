@@ -0,0 +1,299 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager, suppress
+
+
+# Состояния задания: в очереди, выполняется, готово, данные не найдены, ошибка
+JOB_STATES = ("queued", "running", "done", "not_found", "failed")
+_FINISHED_STATES = ("done", "not_found", "failed")
+
+
+class RenderJobStore:
+    """
+    Хранилище заданий на формирование документов: база SQLite и файлы результатов
+    <id>.bin в одном каталоге. Задания переживают перезапуск приложения, а каталог
+    может использоваться несколькими процессами сразу: задание забирается одним
+    процессом внутри транзакции BEGIN IMMEDIATE.
+
+    Задание описывается видом и параметрами в JSON, а не функцией, чтобы его
+    можно было выполнить в другом процессе или после перезапуска.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.db_path = os.path.join(directory, "jobs.sqlite3")
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS render_jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    file_name TEXT,
+                    mimetype TEXT,
+                    size INTEGER,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS render_jobs_state ON render_jobs (state, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        # Соединение на каждую операцию: методы вызываются из разных потоков через asyncio.to_thread
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def result_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.bin")
+
+    def read_result(self, job_id):
+        with open(self.result_path(job_id), "rb") as result_file:
+            return result_file.read()
+
+    def submit(self, kind, params):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO render_jobs (id, kind, params, state, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), now, now)
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM render_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def claim(self, stale_after, max_attempts):
+        """
+        Следующее задание из очереди: (id, вид, параметры) или None. Задание, которое
+        слишком долго числится выполняемым (процесс упал или был перезапущен), выдаётся повторно,
+        пока не исчерпано max_attempts попыток.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "UPDATE render_jobs SET state = 'failed', error = ?, updated_at = ? "
+                "WHERE state = 'running' AND updated_at < ? AND attempts >= ?",
+                ("Задание прервано перезапуском слишком много раз", now, now - stale_after, max_attempts)
+            )
+            row = connection.execute(
+                "SELECT id, kind, params FROM render_jobs "
+                "WHERE state = 'queued' OR (state = 'running' AND updated_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now - stale_after,)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE render_jobs SET state = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (now, row["id"])
+                )
+            # Без COMMIT соединение закрывается с откатом транзакции
+            connection.execute("COMMIT")
+
+        if row is None:
+            return None
+        return row["id"], row["kind"], json.loads(row["params"])
+
+    def _finish(self, job_id, state, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as connection:
+            connection.execute(
+                f"UPDATE render_jobs SET state = ?, updated_at = ?{', ' if fields else ''}{assignments} WHERE id = ?",
+                (state, time.time(), *fields.values(), job_id)
+            )
+
+    def complete(self, job_id, file_name, mimetype, data):
+        temp_path = f"{self.result_path(job_id)}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, self.result_path(job_id))
+        except OSError:
+            # Недописанный файл (например, при заполненном диске) не остаётся в каталоге результатов
+            with suppress(OSError):
+                os.remove(temp_path)
+            raise
+        self._finish(job_id, "done", file_name=file_name, mimetype=mimetype, size=len(data), error=None)
+
+    def mark_not_found(self, job_id):
+        self._finish(job_id, "not_found")
+
+    def fail(self, job_id, error):
+        self._finish(job_id, "failed", error=error)
+
+    def requeue(self, job_id):
+        self._finish(job_id, "queued")
+
+    def touch(self, job_id):
+        """
+        Отметка, что задание ещё выполняется: иначе через stale_after его заберёт другой исполнитель.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE render_jobs SET updated_at = ? WHERE id = ? AND state = 'running'", (time.time(), job_id)
+            )
+
+    def purge(self, max_age):
+        """
+        Удаление завершённых заданий старше max_age секунд вместе с файлами результатов.
+        """
+        states = ", ".join("?" for _ in _FINISHED_STATES)
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT id FROM render_jobs WHERE state IN ({states}) AND updated_at < ?",
+                (*_FINISHED_STATES, time.time() - max_age)
+            ).fetchall()
+            for row in rows:
+                try:
+                    os.remove(self.result_path(row["id"]))
+                except FileNotFoundError:
+                    pass
+                connection.execute("DELETE FROM render_jobs WHERE id = ?", (row["id"],))
+        return len(rows)
+
+    def stats(self):
+        with self._connect() as connection:
+            counts = dict(connection.execute("SELECT state, COUNT(*) FROM render_jobs GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in JOB_STATES}
+
+
+class RenderJobQueue:
+    """
+    Исполнители заданий из RenderJobStore внутри цикла событий приложения.
+    HTTP-запрос только ставит задание в очередь и сразу получает его id,
+    формирование документа идёт в фоне.
+
+    handler(kind, params) - корутина, возвращающая (байты, имя файла, mimetype)
+    или None, если данных для документа нет.
+    """
+
+    def __init__(self, store, handler, concurrency=2, poll_interval=1.0,
+                 stale_after=600, max_attempts=3, ttl=24 * 3600):
+        self.store = store
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.ttl = ttl
+        self._wakeup = asyncio.Event()
+        self._workers = []
+        self._purged_at = None
+
+    async def start(self):
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(max(1, self.concurrency))]
+        print(f"Очередь заданий формирования документов запущена: {len(self._workers)} исполнителей")
+
+    async def close(self):
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def submit(self, kind, params):
+        job_id = await asyncio.to_thread(self.store.submit, kind, params)
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def wait(self, job_id, timeout):
+        """
+        Состояние задания, дождавшись его завершения, но не дольше timeout секунд.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.get(job_id)
+            if job is None or job["state"] in _FINISHED_STATES or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+
+    async def _purge_expired(self):
+        if self._purged_at is not None and time.monotonic() - self._purged_at < 3600:
+            return
+        self._purged_at = time.monotonic()
+        removed = await asyncio.to_thread(self.store.purge, self.ttl)
+        if removed:
+            print(f"Удалено устаревших заданий формирования документов: {removed}")
+
+    async def _worker(self):
+        while True:
+            try:
+                await self._run_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Ошибка хранилища (например, SQLite занят или диск заполнен) не должна останавливать исполнителя
+                print(f"Ошибка исполнителя заданий формирования документов: {type(e).__name__}: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _run_next(self):
+        """
+        Одно задание из очереди либо ожидание нового не дольше poll_interval.
+        """
+        await self._purge_expired()
+        claimed = await asyncio.to_thread(self.store.claim, self.stale_after, self.max_attempts)
+        if claimed is None:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        job_id, kind, params = claimed
+        task = asyncio.create_task(self.handler(kind, params))
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.stale_after / 3)
+                if done:
+                    break
+                try:
+                    await asyncio.to_thread(self.store.touch, job_id)
+                except Exception as e:
+                    # Пропущенная отметка не прерывает задание: его перехватят только после stale_after
+                    print(f"Не удалось продлить задание формирования документа {job_id}: {e}")
+            result = task.result()
+        except asyncio.CancelledError:
+            # Остановка приложения: задание вернётся в очередь и выполнится после запуска
+            task.cancel()
+            self.store.requeue(job_id)
+            raise
+        except Exception as e:
+            print(f"Ошибка задания формирования документа {job_id} ({kind}): {e}")
+            await asyncio.to_thread(self.store.fail, job_id, f"{type(e).__name__}: {e}")
+            return
+
+        try:
+            if result is None:
+                await asyncio.to_thread(self.store.mark_not_found, job_id)
+            else:
+                data, file_name, mimetype = result
+                await asyncio.to_thread(self.store.complete, job_id, file_name, mimetype, data)
+        except Exception as e:
+            # Результат не сохранился: задание завершается ошибкой, а не остаётся в работе до stale_after
+            print(f"Не удалось сохранить результат задания формирования документа {job_id}: {e}")
+            await asyncio.to_thread(self.store.fail, job_id, f"{type(e).__name__}: {e}")
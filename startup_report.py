@@ -0,0 +1,60 @@
+"""
+Отчёт о времени запуска: сколько стоит импорт каждого модуля при загрузке приложения.
+
+Запуск: python startup_report.py [модуль] [число строк]
+Модуль импортируется в отдельном процессе с python -X importtime, поэтому кэш
+уже загруженных модулей не искажает результат. Время собственной загрузки
+модулей суммируется по пакетам верхнего уровня (pandas, openpyxl, docx, ...).
+"""
+import subprocess
+import sys
+
+
+def import_costs(module="app"):
+    """
+    Время импорта модуля в новом процессе: (общее время в секундах,
+    список (пакет, секунды) по убыванию времени собственной загрузки его модулей).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            # Строка заголовка
+            continue
+        # Отступ имени - глубина вложенности импорта, модули верхнего уровня идут с одним пробелом
+        entries.append((int(self_us), int(cumulative_us), name.strip(), len(name) - len(name.lstrip()) == 1))
+
+    # Модули выводятся по завершении загрузки: импорт модуля - строки после предыдущего
+    # модуля верхнего уровня (модули запуска интерпретатора) до строки самого модуля
+    end = next(index for index, entry in enumerate(entries) if entry[3] and entry[2] == module)
+    start = max((index + 1 for index in range(end) if entries[index][3]), default=0)
+
+    packages = {}
+    for self_us, _, name, _ in entries[start:end + 1]:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    total_us = entries[end][1]
+
+    costs = sorted(((package, us / 1_000_000) for package, us in packages.items()), key=lambda item: -item[1])
+    return total_us / 1_000_000, costs
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "app"
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    total, costs = import_costs(module)
+    print(f"Импорт {module}: {total:.3f} с")
+    for package, seconds in costs[:limit]:
+        print(f"  {package:<30} {seconds:8.3f} с  {seconds / total * 100 if total else 0:5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
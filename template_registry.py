@@ -0,0 +1,132 @@
+import hashlib
+import os
+import time
+from io import BytesIO
+
+
+TEMPLATE_EXTENSIONS = (".docx", ".xlsx")
+
+
+class TemplateRecord:
+    """
+    Содержимое одного шаблона в памяти.
+    """
+
+    __slots__ = ("name", "path", "data", "sha256", "mtime_ns", "size")
+
+    def __init__(self, name, path, data, mtime_ns):
+        self.name = name
+        self.path = path
+        self.data = data
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self.mtime_ns = mtime_ns
+        self.size = len(data)
+
+
+class TemplateRegistry:
+    """
+    Реестр шаблонов DOCX/XLSX из каталога static/docs.
+
+    Шаблон доступен по логическому имени - имени файла без расширения
+    ('llc_proto', 'kdn_bill'). Содержимое держится в памяти, файл перечитывается,
+    только если изменились его mtime или размер, а новая версия заменяет старую,
+    только если изменился sha256. Скомпилированные представления шаблона
+    кэшируются по его хэшу и параметрам компиляции.
+    """
+
+    def __init__(self, directory, extensions=TEMPLATE_EXTENSIONS, check_interval=2.0):
+        self.directory = directory
+        self.extensions = tuple(extensions)
+        self.check_interval = check_interval
+        self._records = {}
+        self._checked_at = {}
+        self._compiled = {}
+        self.reloads = 0
+
+    def preload(self):
+        """
+        Загрузка всех шаблонов каталога. Возвращает список имён.
+        """
+        for file_name in sorted(os.listdir(self.directory)):
+            stem, extension = os.path.splitext(file_name)
+            if extension.lower() in self.extensions and not file_name.startswith("~$"):
+                self._load(stem, os.path.join(self.directory, file_name))
+        print(f"Загружено шаблонов: {len(self._records)}")
+        return self.names()
+
+    def names(self):
+        return sorted(self._records)
+
+    def _find_path(self, name):
+        for extension in self.extensions:
+            path = os.path.join(self.directory, name + extension)
+            if os.path.isfile(path):
+                return path
+        raise KeyError(f"Шаблон не найден: {name}")
+
+    def _load(self, name, path):
+        with open(path, "rb") as template_file:
+            data = template_file.read()
+        mtime_ns = os.stat(path).st_mtime_ns
+
+        record = TemplateRecord(name, path, data, mtime_ns)
+        current = self._records.get(name)
+        if current is not None and current.sha256 == record.sha256:
+            # Файл перезаписан тем же содержимым - версия не меняется
+            current.mtime_ns = mtime_ns
+            record = current
+        else:
+            if current is not None:
+                self.reloads += 1
+                self._drop_compiled(name)
+                print(f"Шаблон {name} обновлён: {current.sha256[:12]} -> {record.sha256[:12]}")
+            self._records[name] = record
+
+        self._checked_at[name] = time.monotonic()
+        return record
+
+    def _drop_compiled(self, name):
+        for key in [key for key in self._compiled if key[0] == name]:
+            del self._compiled[key]
+
+    def get(self, name):
+        """
+        Актуальная запись шаблона. Файл проверяется не чаще раза в check_interval секунд.
+        """
+        record = self._records.get(name)
+        if record is None:
+            return self._load(name, self._find_path(name))
+
+        if time.monotonic() - self._checked_at.get(name, 0) < self.check_interval:
+            return record
+
+        self._checked_at[name] = time.monotonic()
+        try:
+            stat = os.stat(record.path)
+        except FileNotFoundError:
+            # Удалённый файл не ломает формирование документов: работаем с версией в памяти
+            return record
+        if stat.st_mtime_ns != record.mtime_ns or stat.st_size != record.size:
+            return self._load(name, record.path)
+        return record
+
+    def open(self, name):
+        """
+        Независимая копия шаблона для python-docx/openpyxl.
+        """
+        return BytesIO(self.get(name).data)
+
+    def version(self, name):
+        return self.get(name).sha256
+
+    def compiled(self, name, factory, **options):
+        """
+        Результат factory(data, **options), вычисленный один раз на версию шаблона.
+        """
+        record = self.get(name)
+        key = (name, record.sha256, tuple(sorted(options.items())))
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = factory(record.data, **options)
+            self._compiled[key] = compiled
+        return compiled
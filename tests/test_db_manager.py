@@ -0,0 +1,309 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+import aiomysql.pool
+from aiomysql import OperationalError
+
+from db_manager import (
+    DatabaseManager, PoolAutoscaler, _bulk_statement, _close_idle_connections, _insert_ignore, _pool_supports_resize,
+)
+
+
+class _FakeReader:
+    eof_received = False
+
+    def at_eof(self):
+        return False
+
+    def exception(self):
+        return None
+
+
+class _FakeConnection:
+    """
+    Соединение без сервера: ровно то, что aiomysql.Pool проверяет при выдаче и возврате.
+    """
+
+    def __init__(self):
+        self._reader = _FakeReader()
+        self.closed = False
+        self.last_usage = asyncio.get_running_loop().time()
+
+    def get_transaction_status(self):
+        return False
+
+    def close(self):
+        self.closed = True
+
+    async def ensure_closed(self):
+        self.closed = True
+
+
+async def _fake_connect(**kwargs):
+    return _FakeConnection()
+
+
+class PoolAutoscalerTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Подстройка размера настоящего aiomysql.Pool с соединениями без сервера.
+    """
+
+    async def asyncSetUp(self):
+        patcher = mock.patch.object(aiomysql.pool, "connect", _fake_connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = aiomysql.pool.Pool(1, 2, False, -1, asyncio.get_running_loop())
+
+    async def _open(self, count):
+        connections = await asyncio.gather(*(self.pool.acquire() for _ in range(count)))
+        return list(connections)
+
+    def _quiet(self, autoscaler):
+        # Давление и последнее изменение размера - дольше cooldown назад
+        autoscaler._last_pressure = autoscaler._last_resize = time.monotonic() - autoscaler.cooldown - 1
+
+    async def test_pool_supports_resize(self):
+        self.assertTrue(_pool_supports_resize(self.pool))
+        self.assertFalse(_pool_supports_resize(object()))
+
+    async def test_grow_until_limit(self):
+        autoscaler = PoolAutoscaler(5, wait_threshold=0.05, step=2)
+        for expected in (4, 5, 5):
+            autoscaler.record_wait(0.2)
+            await autoscaler.adjust(self.pool, 1, 2, "test")
+            self.assertEqual(self.pool.maxsize, expected)
+        self.assertEqual(autoscaler.resizes, 2)
+        # Новые соединения создаются до нового maxsize
+        await self._open(5)
+        self.assertEqual(self.pool.size, 5)
+
+    async def test_no_change_without_pressure_before_cooldown(self):
+        autoscaler = PoolAutoscaler(6, wait_threshold=0.05)
+        autoscaler.record_wait(0.01)
+        await autoscaler.adjust(self.pool, 1, 2, "test")
+        self.assertEqual(self.pool.maxsize, 2)
+
+    async def test_shrink_not_below_open_connections(self):
+        autoscaler = PoolAutoscaler(6, step=2)
+        autoscaler.record_wait(1.0)
+        await autoscaler.adjust(self.pool, 1, 2, "test")
+        autoscaler.record_wait(1.0)
+        await autoscaler.adjust(self.pool, 1, 2, "test")
+        self.assertEqual(self.pool.maxsize, 6)
+
+        # Пять соединений заняты: maxsize - max(2, 6 - 2, 5) = 5
+        connections = await self._open(5)
+        self._quiet(autoscaler)
+        await autoscaler.adjust(self.pool, 1, 2, "test")
+        self.assertEqual(self.pool.maxsize, 5)
+        self.assertEqual(self.pool.size, 5)
+        for connection in connections:
+            self.pool.release(connection)
+
+    async def test_idle_connections_closed_then_shrink_to_base(self):
+        autoscaler = PoolAutoscaler(6, step=2, cooldown=300.0)
+        autoscaler.record_wait(1.0)
+        await autoscaler.adjust(self.pool, 1, 2, "test")
+        self.assertEqual(self.pool.maxsize, 4)
+
+        connections = await self._open(4)
+        for connection in connections:
+            connection.last_usage -= 1000
+            self.pool.release(connection)
+        await asyncio.sleep(0)
+
+        self._quiet(autoscaler)
+        await autoscaler.adjust(self.pool, 1, 2, "test")
+        # Остаётся minsize соединений, maxsize возвращается к исходному
+        self.assertEqual(self.pool.size, 1)
+        self.assertEqual(sum(connection.closed for connection in connections), 3)
+        self.assertEqual(self.pool.maxsize, 2)
+
+    async def test_recently_used_connections_kept(self):
+        connections = await self._open(2)
+        connections[0].last_usage -= 1000
+        for connection in connections:
+            self.pool.release(connection)
+        await asyncio.sleep(0)
+        self.assertEqual(await _close_idle_connections(self.pool, 0, 300.0), 1)
+        self.assertEqual(self.pool.size, 1)
+
+    async def test_start_disables_autoscaler_for_unsupported_pool(self):
+        class UnsupportedPool:
+            closed = False
+
+        db = DatabaseManager("host", "user", "password", autoscaler=PoolAutoscaler(6))
+        db.pool = UnsupportedPool()
+        with mock.patch("builtins.print"):
+            await db.start()
+        self.assertIsNone(db.autoscaler)
+        self.assertEqual(db._tasks, [])
+
+
+class BulkStatementTest(unittest.TestCase):
+    def test_nested_function_in_values(self):
+        prefix, row, postfix = _bulk_statement(
+            "INSERT IGNORE INTO log (id, ip, start, stop, downtime)\n"
+            "VALUES (%s, %s, %s, %s, TIMESTAMPDIFF(SECOND, %s, %s));"
+        )
+        self.assertEqual(prefix, "INSERT IGNORE INTO log (id, ip, start, stop, downtime)\nVALUES ")
+        self.assertEqual(row, "(%s, %s, %s, %s, TIMESTAMPDIFF(SECOND, %s, %s))")
+        self.assertEqual(postfix, "")
+
+    def test_existing_on_duplicate_key_update(self):
+        prefix, row, postfix = _bulk_statement(
+            "INSERT INTO t (a, b) VALUES (%s, %s) ON DUPLICATE KEY UPDATE b = VALUES(b)"
+        )
+        self.assertEqual(row, "(%s, %s)")
+        self.assertEqual(postfix, " ON DUPLICATE KEY UPDATE b = VALUES(b)")
+        with self.assertRaises(ValueError):
+            _bulk_statement("INSERT INTO t (a, b) VALUES (%s, %s) ON DUPLICATE KEY UPDATE b = VALUES(b)", ["b"])
+
+    def test_lowercase(self):
+        prefix, row, postfix = _bulk_statement("  insert into t (a, b) values (%s, now())", ["b"])
+        self.assertEqual(prefix, "insert into t (a, b) values ")
+        self.assertEqual(row, "(%s, now())")
+        self.assertEqual(postfix, " ON DUPLICATE KEY UPDATE `b` = VALUES(`b`)")
+
+    def test_not_insert_values(self):
+        self.assertIsNone(_bulk_statement("UPDATE t SET a = %s WHERE id = %s"))
+        self.assertIsNone(_bulk_statement("INSERT INTO t (a) SELECT a FROM s WHERE id = %s"))
+        with self.assertRaises(ValueError):
+            _bulk_statement("UPDATE t SET a = %s WHERE id = %s", ["a"])
+
+    def test_insert_ignore(self):
+        self.assertEqual(_insert_ignore("insert into t (a) values (%s)"), "INSERT IGNORE into t (a) values (%s)")
+        self.assertEqual(_insert_ignore("INSERT IGNORE INTO t (a) VALUES (%s)"), "INSERT IGNORE INTO t (a) VALUES (%s)")
+        with self.assertRaises(ValueError):
+            _insert_ignore("UPDATE t SET a = %s")
+
+
+class _FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def _run(self, query, rows):
+        pool = self.connection.pool
+        if pool.failures:
+            pool.failures -= 1
+            raise OperationalError(2013, "Lost connection to MySQL server during query")
+        pool.log.append((self.connection.number, query, rows))
+        self.rowcount = rows
+
+    async def execute(self, query, params=None):
+        self._run(query, query.count("(%s"))
+
+    async def executemany(self, query, params):
+        self._run(query, len(params))
+
+
+class _FakeBulkConnection:
+    def __init__(self, pool, number):
+        self.pool = pool
+        self.number = number
+        self.closed = False
+        self.commits = 0
+
+    def cursor(self, *args):
+        return _FakeCursor(self)
+
+    async def commit(self):
+        self.commits += 1
+
+    async def ping(self, reconnect=True):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeBulkPool:
+    """
+    Пул для execute_many: выдаёт новое соединение на каждое получение и считает ошибки соединения.
+    """
+    closed = False
+
+    def __init__(self):
+        self.log = []
+        self.connections = []
+        self.failures = 0
+
+    async def acquire(self):
+        connection = _FakeBulkConnection(self, len(self.connections) + 1)
+        self.connections.append(connection)
+        return connection
+
+    def release(self, connection):
+        pass
+
+
+class ExecuteManyTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.db = DatabaseManager("host", "user", "password", db="test")
+        self.db.retry_backoff = 0.0
+        self.pool = self.db.pool = _FakeBulkPool()
+        patcher = mock.patch("builtins.print")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_chunks_into_multi_row_inserts(self):
+        rows = [(index, index) for index in range(5)]
+        affected = await self.db.execute_many("INSERT INTO t (a, b) VALUES (%s, %s)", rows, chunk_size=2)
+        self.assertEqual(affected, 5)
+        self.assertEqual([rows for _, _, rows in self.pool.log], [2, 2, 1])
+        self.assertEqual(self.pool.log[0][1], "INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)")
+        self.assertEqual(self.pool.connections[0].commits, 3)
+
+    async def test_ignore_on_executemany_path(self):
+        await self.db.execute_many("INSERT INTO t (a) SELECT a FROM s WHERE id = %s", [(1,), (2,)], ignore=True)
+        self.assertEqual(self.pool.log, [(1, "INSERT IGNORE INTO t (a) SELECT a FROM s WHERE id = %s", 2)])
+
+    async def test_ignore_rejected_for_update(self):
+        with self.assertRaises(ValueError):
+            await self.db.execute_many("UPDATE t SET a = %s WHERE id = %s", [(1, 2)], ignore=True)
+
+    async def test_idempotent_retry_resumes_from_failed_chunk(self):
+        rows = [(index,) for index in range(6)]
+        original_run = _FakeCursor._run
+
+        def fail_on_second_chunk(cursor, query, count):
+            if len(self.pool.log) == 1 and not self.db.retries:
+                self.pool.failures = 1
+            original_run(cursor, query, count)
+
+        with mock.patch.object(_FakeCursor, "_run", fail_on_second_chunk):
+            affected = await self.db.execute_many("INSERT INTO t (a) VALUES (%s)", rows, chunk_size=2, ignore=True)
+
+        self.assertEqual(affected, 6)
+        # Первая часть выполнена на первом соединении, вторая и третья - на новом после повтора
+        self.assertEqual([(number, count) for number, _, count in self.pool.log], [(1, 2), (2, 2), (2, 2)])
+        self.assertEqual(self.db.retries, 1)
+        self.assertEqual(self.db.evicted_connections, 1)
+        self.assertTrue(self.pool.connections[0].closed)
+
+    async def test_plain_insert_not_retried(self):
+        self.pool.failures = 1
+        affected = await self.db.execute_many("INSERT INTO t (a) VALUES (%s)", [(1,), (2,)])
+        self.assertIsNone(affected)
+        self.assertEqual(self.db.retries, 0)
+        self.assertEqual(self.db.failed_operations, 1)
+        self.assertEqual(self.pool.log, [])
+
+    async def test_retry_disabled(self):
+        self.pool.failures = 1
+        affected = await self.db.execute_many("INSERT IGNORE INTO t (a) VALUES (%s)", [(1,)], retry=False)
+        self.assertIsNone(affected)
+        self.assertEqual(self.db.retries, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
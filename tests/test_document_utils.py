@@ -0,0 +1,68 @@
+import unittest
+
+from docx import Document
+
+from document_utils import PlaceholderReplacer, _replace_in_paragraph
+
+
+def _paragraph(*texts, bold_first=False):
+    document = Document()
+    paragraph = document.add_paragraph()
+    for index, text in enumerate(texts):
+        run = paragraph.add_run(text)
+        if bold_first and index == 0:
+            run.bold = True
+    return paragraph
+
+
+def _replace(paragraph, replacements):
+    _replace_in_paragraph(paragraph, PlaceholderReplacer(replacements))
+    return [run.text for run in paragraph.runs]
+
+
+class ReplaceInParagraphTest(unittest.TestCase):
+    def test_marker_split_across_two_runs(self):
+        paragraph = _paragraph("Замовник @ri_", "name, далі", bold_first=True)
+        self.assertEqual(_replace(paragraph, {"@ri_name": "ТОВ Альфа"}), ["Замовник ТОВ Альфа, далі", ""])
+        # Значение остаётся в первом ране метки с его форматированием
+        self.assertTrue(paragraph.runs[0].bold)
+
+    def test_marker_split_across_three_runs(self):
+        paragraph = _paragraph("від @ag", "r_da", "te року")
+        self.assertEqual(_replace(paragraph, {"@agr_date": "01.02.2025"}), ["від 01.02.2025 року", "", ""])
+
+    def test_remainder_with_next_marker_moves_to_first_run(self):
+        paragraph = _paragraph("@ri_", "name, код @ri_code.", " Кінець")
+        self.assertEqual(
+            _replace(paragraph, {"@ri_name": "Альфа", "@ri_code": "123"}),
+            ["Альфа, код 123.", "", " Кінець"]
+        )
+
+    def test_two_markers_in_one_run(self):
+        paragraph = _paragraph("@day @month", " ", "@year")
+        self.assertEqual(
+            _replace(paragraph, {"@day": "01", "@month": "лютого", "@year": "2025"}),
+            ["01 лютого", " ", "2025"]
+        )
+
+    def test_prefix_overlapping_keys(self):
+        replacements = {"@ri_name": "ТОВ Альфа", "@ri_name_short": "Альфа"}
+        paragraph = _paragraph("@ri_name_short / @ri_name")
+        self.assertEqual(_replace(paragraph, replacements), ["Альфа / ТОВ Альфа"])
+
+        paragraph = _paragraph("@ri_name", "_short та @ri_name")
+        self.assertEqual(_replace(paragraph, replacements), ["Альфа та ТОВ Альфа", ""])
+
+    def test_value_with_newline(self):
+        paragraph = _paragraph("Адреса: @address")
+        _replace(paragraph, {"@address": "м. Київ,\nвул. Хрещатик, 1"})
+        self.assertEqual(paragraph.text, "Адреса: м. Київ,\nвул. Хрещатик, 1")
+        self.assertEqual(len(paragraph.runs[0]._r.xpath("./w:br")), 1)
+
+    def test_without_markers_runs_untouched(self):
+        paragraph = _paragraph("без ", "міток")
+        self.assertEqual(_replace(paragraph, {"@ri_name": "Альфа"}), ["без ", "міток"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from io import BytesIO
+from pathlib import Path
+
+from docx import Document
+
+from docx_templates import CompiledDocxTemplate, MARKER_PATTERN, _iter_table_paragraphs
+from document_utils import DocumentPipeline
+
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "static" / "docs"
+
+
+def _paragraphs(document):
+    return list(document.paragraphs) + list(_iter_table_paragraphs(document.tables))
+
+
+def _runs(document):
+    """
+    Текст и форматирование непустых ранов каждого абзаца основного текста и таблиц.
+    """
+    return [
+        [
+            (run.text, run.bold, run.italic, run.underline, run.font.name, run.font.size)
+            for run in paragraph.runs if run.text
+        ]
+        for paragraph in _paragraphs(document)
+    ]
+
+
+def _fixture_template():
+    """
+    Шаблон с метками, разбитыми на раны, меткой в таблице и меткой без значения.
+    """
+    document = Document()
+    paragraph = document.add_paragraph()
+    paragraph.add_run("Договір № @agr_").bold = True
+    paragraph.add_run("num від ")
+    paragraph.add_run("@agr_da")
+    paragraph.add_run("te").italic = True
+    document.add_paragraph("@ri_name_short (@ri_name), @unknown")
+    document.add_paragraph("Адреса: @address")
+    table = document.add_table(rows=1, cols=2)
+    table.rows[0].cells[0].text = "@ri_code"
+    cell_paragraph = table.rows[0].cells[1].paragraphs[0]
+    cell_paragraph.add_run("Сума @su")
+    cell_paragraph.add_run("m грн")
+    output = BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+_FIXTURE_VALUES = {
+    "@agr_num": "15/2025",
+    "@agr_date": "01 лютого 2025 року",
+    "@ri_name": "ТОВ \"Альфа\" <тест> & Ко",
+    "@ri_name_short": "Альфа",
+    "@address": "м. Київ,\nвул. Хрещатик, 1\tоф. 2",
+    "@ri_code": " 0012345 ",
+    "@sum": "1 000,00",
+}
+
+
+class CompiledDocxTemplateTest(unittest.TestCase):
+    """
+    Скомпилированный шаблон даёт тот же текст и форматирование ранов,
+    что и замена через python-docx с теми же шагами обработки.
+    """
+
+    def assertSameAsPythonDocx(self, data, values, **options):
+        compiled = Document(BytesIO(CompiledDocxTemplate(data, **options).render(values)))
+
+        expected = Document(BytesIO(data))
+        pipeline = DocumentPipeline().substitute(values)
+        if options.get("formatting"):
+            pipeline.set_font()
+        if options.get("clear_highlights"):
+            pipeline.clear_highlights()
+        pipeline.apply(expected)
+
+        self.assertEqual([p.text for p in _paragraphs(compiled)], [p.text for p in _paragraphs(expected)])
+        self.assertEqual(_runs(compiled), _runs(expected))
+        return compiled
+
+    def test_fixture_template(self):
+        compiled = self.assertSameAsPythonDocx(_fixture_template(), _FIXTURE_VALUES)
+        texts = [paragraph.text for paragraph in _paragraphs(compiled)]
+        self.assertEqual(texts[0], "Договір № 15/2025 від 01 лютого 2025 року")
+        self.assertEqual(texts[1], "Альфа (ТОВ \"Альфа\" <тест> & Ко), @unknown")
+        self.assertEqual(texts[2], "Адреса: м. Київ,\nвул. Хрещатик, 1\tоф. 2")
+        self.assertEqual(texts[3:], [" 0012345 ", "Сума 1 000,00 грн"])
+
+    def test_fixture_template_with_formatting(self):
+        self.assertSameAsPythonDocx(_fixture_template(), _FIXTURE_VALUES, formatting=True, clear_highlights=True)
+
+    def test_repository_templates(self):
+        paths = sorted(TEMPLATES_DIR.glob("*.docx"))
+        self.assertTrue(paths)
+        for path in paths:
+            with self.subTest(template=path.name):
+                data = path.read_bytes()
+                document = Document(BytesIO(data))
+                markers = set()
+                for paragraph in _paragraphs(document):
+                    markers.update(MARKER_PATTERN.findall(paragraph.text))
+                # Значение каждой метки отличается, чтобы перепутанные слоты были заметны
+                values = {marker: f"<{marker[1:]}> & {index}" for index, marker in enumerate(sorted(markers))}
+                self.assertSameAsPythonDocx(data, values, formatting=True, clear_highlights=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,6 @@
-from app import MyApp
+# Приложение создаётся один раз в модуле app; процессы пула (spawn) импортируют этот файл как __mp_main__
+if __name__ != "__mp_main__":
+    from app import app, asgi_app
 
 if __name__ == "__main__":
-    application = MyApp(__name__)
\ No newline at end of file
+    app.run()
@@ -0,0 +1,149 @@
+import re
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+from document_utils import clear_workbook_highlights, prepare_workbook_for_pdf
+from ooxml_zip import read_member, read_package, write_package
+
+
+_SPREADSHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+_SHARED_STRINGS_PART = "xl/sharedStrings.xml"
+_WORKSHEET_PARTS = re.compile(r"xl/worksheets/[^/]+\.xml")
+
+# Символы из области частного использования: в шаблонах счетов не встречаются
+_SLOT_OPEN = "\ue000"
+_SLOT_CLOSE = "\ue001"
+_SLOT_PATTERN = re.compile(f"{_SLOT_OPEN}(\\d+){_SLOT_CLOSE}")
+
+# Символы, недопустимые в XML 1.0
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def _tag(name):
+    return f"{{{_SPREADSHEET_NS}}}{name}"
+
+
+def _string_item_text(item):
+    """
+    Текст элемента <si>/<is> так, как его читает openpyxl: <t> и <r><t>, без фонетики <rPh>.
+    """
+    parts = []
+    for child in item:
+        if child.tag == _tag("t"):
+            parts.append(child.text or "")
+        elif child.tag == _tag("r"):
+            text = child.find(_tag("t"))
+            if text is not None:
+                parts.append(text.text or "")
+    return "".join(parts)
+
+
+def substitute(text, replacements):
+    """
+    Замена меток в тексте ячейки в том же порядке, что и прежний обход ячеек openpyxl:
+    ключи применяются последовательно в порядке словаря.
+    """
+    for key, replacement in replacements.items():
+        if key in text:
+            text = text.replace(key, str(replacement))
+    return text
+
+
+class _CompiledPart:
+    """
+    XML-часть книги, разрезанная на неизменяемые фрагменты и слоты под строки с метками.
+    """
+
+    def __init__(self, xml):
+        parts = _SLOT_PATTERN.split(xml.decode("utf-8"))
+        self.chunks = [part.encode("utf-8") for part in parts[0::2]]
+        self.slots = [int(index) for index in parts[1::2]]
+
+    def render(self, rendered_texts):
+        pieces = [self.chunks[0]]
+        for index, chunk in zip(self.slots, self.chunks[1:]):
+            pieces.append(rendered_texts[index])
+            pieces.append(chunk)
+        return b"".join(pieces)
+
+
+class CompiledXlsxTemplate:
+    """
+    Шаблон XLSX, в котором заранее найдены общие строки (xl/sharedStrings.xml)
+    и встроенные строки листов, содержащие метки '@'. При заполнении заново
+    собираются только эти части, остальные элементы пакета копируются без
+    повторного сжатия, объектная модель openpyxl не строится.
+
+    Строка с меткой, как и при сохранении через openpyxl, записывается
+    простым текстом без форматирования отдельных фрагментов.
+
+    clear_highlights и prepare_for_pdf применяются к шаблону один раз
+    при компиляции через openpyxl.
+    """
+
+    def __init__(self, data, clear_highlights=False, prepare_for_pdf=False):
+        if clear_highlights or prepare_for_pdf:
+            data = self._bake(data, clear_highlights, prepare_for_pdf)
+
+        self.members = read_package(data)
+        self.texts = []
+        self.parts = {}
+
+        for member in self.members:
+            if member.name == _SHARED_STRINGS_PART:
+                item_tag = "si"
+            elif _WORKSHEET_PARTS.fullmatch(member.name):
+                item_tag = "is"
+            else:
+                continue
+            compiled = self._compile_part(read_member(member), item_tag)
+            if compiled is not None:
+                self.parts[member.name] = compiled
+
+    @staticmethod
+    def _bake(data, clear_highlights, prepare_for_pdf):
+        # openpyxl нужен только при компиляции шаблона счёта
+        import openpyxl
+        workbook = openpyxl.load_workbook(BytesIO(data))
+        if clear_highlights:
+            clear_workbook_highlights(workbook)
+        if prepare_for_pdf:
+            prepare_workbook_for_pdf(workbook)
+        output = BytesIO()
+        workbook.save(output)
+        return output.getvalue()
+
+    def _compile_part(self, xml, item_tag):
+        root = etree.fromstring(xml)
+        found = False
+        for item in root.iter(_tag(item_tag)):
+            text = _string_item_text(item)
+            if "@" not in text:
+                continue
+
+            for child in list(item):
+                item.remove(child)
+            text_element = etree.SubElement(item, _tag("t"))
+            text_element.set(_XML_SPACE, "preserve")
+            text_element.text = f"{_SLOT_OPEN}{len(self.texts)}{_SLOT_CLOSE}"
+            self.texts.append(text)
+            found = True
+
+        if not found:
+            return None
+        return _CompiledPart(etree.tostring(root, encoding="UTF-8", xml_declaration=True, standalone=True))
+
+    def render(self, replacements):
+        """
+        Байты готового XLSX.
+        """
+        rendered_texts = [
+            escape(_INVALID_XML_CHARS.sub("", substitute(text, replacements))).encode("utf-8")
+            for text in self.texts
+        ]
+        replaced = {name: part.render(rendered_texts) for name, part in self.parts.items()}
+        return write_package(self.members, replaced)